@@ -0,0 +1,252 @@
+"""Throughput and latency benchmark for VideoProcessor operations.
+
+Generates synthetic clips with ffmpeg's lavfi sources, runs each
+operation at several concurrency levels and records wall time, CPU time
+(this process plus its ffmpeg children), peak RSS of the process tree and
+output size. Results are written as JSON so two commits can be compared:
+
+    python benchmarks/operations.py --output before.json
+    python benchmarks/operations.py --output after.json --compare before.json
+    python benchmarks/operations.py --quick --operations trim_video optimize_video
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.video_processor import VideoProcessor  # noqa: E402
+
+MEDIA_DIR = os.path.join(ROOT, 'benchmarks', 'media')
+
+# name -> (duration in seconds, width, height)
+CLIPS = {
+    '480p_10s': (10, 854, 480),
+    '480p_60s': (60, 854, 480),
+    '1080p_10s': (10, 1920, 1080),
+    '1080p_60s': (60, 1920, 1080)
+}
+QUICK_CLIPS = ['480p_10s']
+
+CONCURRENCY = [1, 2, 4]
+QUICK_CONCURRENCY = [1, 2]
+
+
+def _mid(clip):
+    return CLIPS[clip][0] / 2
+
+
+# name -> coroutine function (processor, input path, work dir, clip name) -> output paths
+OPERATIONS = {
+    'extract_thumbnail': lambda vp, path, work, clip: _file(
+        vp.extract_thumbnail(path, os.path.join(work, 'thumb.jpg'), _mid(clip)),
+        os.path.join(work, 'thumb.jpg')
+    ),
+    'trim_video': lambda vp, path, work, clip: _file(
+        vp.trim_video(path, os.path.join(work, 'trim.mp4'), 1.5, _mid(clip) + 1.5),
+        os.path.join(work, 'trim.mp4')
+    ),
+    'split_video_by_time': lambda vp, path, work, clip: vp.split_video_by_time(
+        path, work, max(2, CLIPS[clip][0] // 4)
+    ),
+    'optimize_video': lambda vp, path, work, clip: _file(
+        vp.optimize_video(path, os.path.join(work, 'optimized.mp4')),
+        os.path.join(work, 'optimized.mp4')
+    ),
+    'merge_videos': lambda vp, path, work, clip: _file(
+        vp.merge_videos([path, path], os.path.join(work, 'merged.mp4')),
+        os.path.join(work, 'merged.mp4')
+    ),
+    'take_screenshots': lambda vp, path, work, clip: vp.take_screenshots(
+        path, work, interval=max(1, CLIPS[clip][0] // 10)
+    )
+}
+
+
+async def _file(coro, path):
+    result = await coro
+    return [path] if result and os.path.exists(path) else []
+
+
+def generate_clip(name):
+    """Create (or reuse) a synthetic H.264/AAC clip"""
+    duration, width, height = CLIPS[name]
+    path = os.path.join(MEDIA_DIR, f"{name}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    subprocess.run([
+        'ffmpeg', '-hide_banner', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=duration={duration}:size={width}x{height}:rate=30",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', '60', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest', path
+    ], check=True)
+    return path
+
+
+class PeakRSS:
+    """Samples the RSS of this process and its children in the background"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    def sample(self):
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        self.peak = max(self.peak, total)
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.ensure_future(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+async def run_case(operation, clip, path, concurrency):
+    """Run `concurrency` copies of one operation at once and measure them"""
+    processor = VideoProcessor()
+    work_dirs = [tempfile.mkdtemp(prefix=f"bench_{operation}_") for _ in range(concurrency)]
+    try:
+        cpu_before = _cpu_seconds()
+        start = time.perf_counter()
+        with PeakRSS() as rss:
+            outputs = await asyncio.gather(*(
+                OPERATIONS[operation](processor, path, work_dir, clip) for work_dir in work_dirs
+            ))
+        wall = time.perf_counter() - start
+        cpu = _cpu_seconds() - cpu_before
+
+        files = [p for result in outputs for p in (result or [])]
+        failed = sum(1 for result in outputs if not result)
+        return {
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            'peak_rss_bytes': rss.peak,
+            'output_bytes': sum(os.path.getsize(p) for p in files if os.path.exists(p)),
+            'ops_per_second': round(concurrency / wall, 4) if wall else None,
+            'failed': failed
+        }
+    finally:
+        for work_dir in work_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def run_all(operations, clips, concurrency_levels, repeat):
+    results = {}
+    for clip in clips:
+        path = generate_clip(clip)
+        for operation in operations:
+            for concurrency in concurrency_levels:
+                key = f"{operation}/{clip}/c{concurrency}"
+                runs = [await run_case(operation, clip, path, concurrency) for _ in range(repeat)]
+                # Keep the fastest successful run; the slower ones mostly measure
+                # noise, and a failed one is usually fastest for doing nothing
+                succeeded = [r for r in runs if not r['failed']]
+                if not succeeded:
+                    results[key] = dict(runs[-1], all_failed=True)
+                    print(f"{key:45} FAILED in all {len(runs)} run(s)")
+                    continue
+                best = min(succeeded, key=lambda r: r['wall_seconds'])
+                results[key] = best
+                print(f"{key:45} {best['wall_seconds']:8.2f}s wall {best['cpu_seconds']:8.2f}s cpu "
+                      f"{best['peak_rss_bytes'] / 1e6:8.1f} MB rss {best['output_bytes'] / 1e6:8.2f} MB out"
+                      + (f"  ({len(runs) - len(succeeded)} failed run(s))" if len(succeeded) < len(runs) else ''))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print per-case changes; return the keys that got slower than tolerance allows"""
+    regressions = []
+    for key, result in sorted(results.items()):
+        before = baseline.get('results', {}).get(key)
+        if not before or before.get('all_failed') or result.get('all_failed'):
+            continue
+        change = result['wall_seconds'] / before['wall_seconds'] - 1 if before['wall_seconds'] else 0
+        size_change = (result['output_bytes'] / before['output_bytes'] - 1) if before['output_bytes'] else 0
+        flag = ''
+        if change > tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print(f"{key:45} wall {change:+7.1%}  output {size_change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--operations', nargs='+', choices=sorted(OPERATIONS), default=sorted(OPERATIONS))
+    parser.add_argument('--clips', nargs='+', choices=sorted(CLIPS))
+    parser.add_argument('--concurrency', nargs='+', type=int)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="small clip and low concurrency only")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed wall time slowdown over the baseline, as a fraction")
+    args = parser.parse_args()
+
+    clips = args.clips or (QUICK_CLIPS if args.quick else list(CLIPS))
+    concurrency_levels = args.concurrency or (QUICK_CONCURRENCY if args.quick else CONCURRENCY)
+    results = asyncio.run(run_all(args.operations, clips, concurrency_levels, args.repeat))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'machine': {
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpus': psutil.cpu_count(logical=True),
+                    'memory_bytes': psutil.virtual_memory().total
+                },
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': results
+            }, f, indent=2)
+            f.write('\n')
+        print(f"results written to {args.output}")
+
+    failed = sorted(key for key, result in results.items() if result.get('all_failed'))
+    if failed:
+        print(f"FAIL: every run failed for {', '.join(failed)}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
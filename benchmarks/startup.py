@@ -0,0 +1,109 @@
+"""Startup import-time benchmark.
+
+Imports bot.py in fresh interpreters and fails (exit status 1) when the
+median import time exceeds the budget, regresses past the recorded
+baseline, or a heavy library gets loaded at import time again.
+
+    python benchmarks/startup.py              # check
+    python benchmarks/startup.py --update     # record a new baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config.config import STARTUP_IMPORT_BUDGET  # noqa: E402
+
+BASELINE_PATH = os.path.join(ROOT, 'benchmarks', 'startup_baseline.json')
+
+# Libraries that must only be imported once an operation needs them
+LAZY_MODULES = [
+    'moviepy', 'numpy', 'imageio', 'PIL', 'celery', 'redis',
+    'py7zr', 'pysrt', 'pymediainfo', 'ffmpeg'
+]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import bot
+elapsed = time.perf_counter() - start
+loaded = sorted(m for m in {modules!r} if m in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'loaded': loaded}}))
+"""
+
+
+def measure_once():
+    result = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(modules=LAZY_MODULES)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(runs):
+    # The first run warms the bytecode and filesystem caches
+    measure_once()
+    samples = [measure_once() for _ in range(runs)]
+    return {
+        'median': statistics.median(s['seconds'] for s in samples),
+        'min': min(s['seconds'] for s in samples),
+        'loaded': sorted({m for s in samples for m in s['loaded']})
+    }
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget', type=float, default=STARTUP_IMPORT_BUDGET,
+                        help="maximum median import time in seconds")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown over the baseline, as a fraction")
+    parser.add_argument('--update', action='store_true', help="record the result as the new baseline")
+    args = parser.parse_args()
+
+    result = measure(args.runs)
+    print(f"import bot: median {result['median'] * 1000:.0f} ms, min {result['min'] * 1000:.0f} ms "
+          f"(budget {args.budget * 1000:.0f} ms)")
+
+    failures = []
+    if result['loaded']:
+        failures.append(f"heavy modules imported at startup: {', '.join(result['loaded'])}")
+    if result['median'] > args.budget:
+        failures.append(f"median import time {result['median']:.3f}s is over the {args.budget:.3f}s budget")
+
+    baseline = load_baseline()
+    if baseline and not args.update:
+        limit = baseline['median'] * (1 + args.tolerance)
+        print(f"baseline: median {baseline['median'] * 1000:.0f} ms (limit {limit * 1000:.0f} ms)")
+        if result['median'] > limit:
+            failures.append(f"median import time {result['median']:.3f}s regressed past {limit:.3f}s")
+    elif not args.update:
+        failures.append(f"no baseline at {BASELINE_PATH}; record one with --update")
+
+    if args.update:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump({'median': result['median'], 'min': result['min']}, f, indent=2)
+            f.write('\n')
+        print(f"baseline written to {BASELINE_PATH}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
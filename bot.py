@@ -1,3 +1,4 @@
+import importlib
 import os
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -5,20 +6,15 @@ from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
     ContextTypes, filters
 )
-from config.config import BOT_TOKEN, REDIS_URL
-from handlers.video_handlers import (
-    handle_video_message, thumbnail_callback, trim_callback,
-    merge_callback, split_callback, optimize_callback,
-    subtitle_callback, screenshot_callback
+from config.config import (
+    BOT_TOKEN, REDIS_URL, TELEGRAM_API_URL, TELEGRAM_FILE_URL, TELEGRAM_LOCAL_MODE,
+    ensure_dirs
 )
-from handlers.audio_handlers import (
-    audio_extract_callback, audio_convert_callback,
-    remove_audio_callback, video_to_audio_callback
-)
-from handlers.archive_handlers import (
-    archive_callback, extract_callback, bundle_callback
-)
-from utils.file_utils import cleanup_temp_files
+from utils.file_utils import cleanup_temp_files, workspace_manager
+from utils.file_registry import file_registry
+from utils.result_cache import result_cache
+from utils.job_registry import job_registry
+from utils import metrics
 
 # Setup logging
 logging.basicConfig(
@@ -27,6 +23,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def lazy(module, name):
+    """Handler callback that imports its module on first use
+
+    Handler modules pull in ffmpeg, archive and subtitle libraries; loading
+    them when the first matching update arrives keeps startup fast.
+    """
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        handler = getattr(importlib.import_module(module), name)
+        return await handler(update, context)
+    callback.__name__ = name
+    return callback
+
+VIDEO = 'handlers.video_handlers'
+AUDIO = 'handlers.audio_handlers'
+ARCHIVE = 'handlers.archive_handlers'
+METADATA = 'handlers.metadata_handlers'
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message with main menu"""
     keyboard = [
@@ -90,6 +103,16 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         text = "📦 **Archive Tools**\nChoose an option:"
         
+    elif query.data == "metadata_tools":
+        keyboard = [
+            [InlineKeyboardButton("📋 Show Metadata", callback_data="metadata_show")],
+            [InlineKeyboardButton("✏️ Edit Tags", callback_data="metadata_tags")],
+            [InlineKeyboardButton("🔄 Rotate", callback_data="metadata_rotate")],
+            [InlineKeyboardButton("🖼️ Set Cover", callback_data="metadata_cover")],
+            [InlineKeyboardButton("🔙 Back", callback_data="main_back")]
+        ]
+        text = "⚙️ **Metadata Editor**\nEdits apply to the file you sent last and never re-encode it.\nChoose an option:"
+        
     elif query.data == "main_back":
         keyboard = [
             [InlineKeyboardButton("🎥 Video Tools", callback_data="video_tools")],
@@ -128,62 +151,134 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Show main menu
 /help - This help message
 /status - Check processing status
+/done - Merge the videos sent for 🔀 Merge Videos
 /cancel - Cancel current operation
     """
     await update.message.reply_text(help_text)
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show current processing status"""
-    # Implement status checking logic
-    await update.message.reply_text("🔄 Checking processing status...")
+    jobs = job_registry.for_user(update.effective_user.id)
+    if not jobs:
+        await update.message.reply_text("✅ Nothing is being processed right now.")
+        return
+    
+    lines = [job.describe() for job in jobs]
+    await update.message.reply_text("📊 **Processing Status**\n\n" + "\n".join(lines))
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel current operation"""
-    # Implement cancellation logic
-    await update.message.reply_text("❌ Operation cancelled.")
+    cancelled = await job_registry.cancel(update.effective_user.id)
+    
+    # Also drop any half-finished multi-step flow
+    for key in ('awaiting_trim', 'awaiting_merge', 'awaiting_split', 'awaiting_subtitles', 'audio_batch',
+                'archive_files', 'awaiting_extract', 'awaiting_metadata', 'awaiting_cover'):
+        context.user_data.pop(key, None)
+    context.user_data.pop('merging_videos', None)
+    
+    if cancelled:
+        await update.message.reply_text(f"❌ Cancelled {cancelled} running operation(s).")
+    else:
+        await update.message.reply_text("❌ Operation cancelled.")
+
+async def post_init(application: Application):
+    """Clear leftovers from a previous run and start the orphan sweeper"""
+    ensure_dirs()
+    freed = cleanup_temp_files()
+    if freed:
+        logger.info(f"Removed {freed} bytes left over from a previous run")
+    application.create_task(workspace_manager.run_sweeper())
+    
+    # Imported here: the scheduler pulls in ffmpeg-python, which startup avoids
+    from utils.encode_scheduler import encode_scheduler
+    metrics.jobs_in_flight.set_function(lambda: len(job_registry.active_jobs()))
+    metrics.encodes_running.set_function(lambda: len(encode_scheduler.running))
+    metrics.encodes_waiting.set_function(lambda: encode_scheduler.waiting)
+    # Walking the directories is slow, so report the sweeper's latest figure
+    metrics.temp_disk_bytes.set_function(lambda: workspace_manager.last_usage)
+    application.bot_data['metrics_server'] = await metrics.start_metrics_server()
+
+async def post_shutdown(application: Application):
+    """Write out index changes still waiting to be batched"""
+    await file_registry.flush()
+    await result_cache.flush()
 
 def main():
     """Start the bot"""
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Concurrent updates keep /status and /cancel responsive while jobs run
+    builder = Application.builder().token(BOT_TOKEN).concurrent_updates(True).post_init(post_init).post_shutdown(post_shutdown)
+    # Multi-step flows (trim, merge) keep their state across restarts and replicas
+    from utils.persistence import build_persistence
+    builder = builder.persistence(build_persistence())
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL).local_mode(TELEGRAM_LOCAL_MODE)
+        if TELEGRAM_FILE_URL:
+            builder = builder.base_file_url(TELEGRAM_FILE_URL)
+    application = builder.build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("cancel", cancel_command))
+    application.add_handler(CommandHandler("done", lazy(VIDEO, 'merge_done_command')))
     
     # Main menu handlers
     application.add_handler(CallbackQueryHandler(main_menu, pattern="^(video_tools|audio_tools|archive_tools|metadata_tools|main_back)$"))
     
     # Video tool handlers
-    application.add_handler(CallbackQueryHandler(thumbnail_callback, pattern="^thumbnail$"))
-    application.add_handler(CallbackQueryHandler(trim_callback, pattern="^trim$"))
-    application.add_handler(CallbackQueryHandler(merge_callback, pattern="^merge$"))
-    application.add_handler(CallbackQueryHandler(split_callback, pattern="^split$"))
-    application.add_handler(CallbackQueryHandler(optimize_callback, pattern="^optimize$"))
-    application.add_handler(CallbackQueryHandler(subtitle_callback, pattern="^subtitle$"))
-    application.add_handler(CallbackQueryHandler(screenshot_callback, pattern="^screenshot$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'thumbnail_callback'), pattern="^thumbnail$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'smart_thumbnail_callback'), pattern="^thumb_smart$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'trim_callback'), pattern="^trim$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'merge_callback'), pattern="^merge$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'split_callback'), pattern="^split$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'split_method_callback'), pattern="^split_(time|parts|size)$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'optimize_callback'), pattern="^optimize$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'subtitle_callback'), pattern="^subtitle$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'subtitle_mode_callback'), pattern="^subtitle_(burn|soft|multi)$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'subtitle_done_callback'), pattern="^subtitle_done$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'screenshot_callback'), pattern="^screenshot$"))
+    application.add_handler(CallbackQueryHandler(lazy(VIDEO, 'quick_action_callback'), pattern="^quick_(thumb|trim|extract|optimize)_"))
     
     # Audio tool handlers
-    application.add_handler(CallbackQueryHandler(audio_extract_callback, pattern="^extract_audio$"))
-    application.add_handler(CallbackQueryHandler(audio_convert_callback, pattern="^convert_audio$"))
-    application.add_handler(CallbackQueryHandler(remove_audio_callback, pattern="^remove_audio$"))
-    application.add_handler(CallbackQueryHandler(video_to_audio_callback, pattern="^video_to_audio$"))
+    application.add_handler(CallbackQueryHandler(lazy(AUDIO, 'audio_extract_callback'), pattern="^extract_audio$"))
+    application.add_handler(CallbackQueryHandler(lazy(AUDIO, 'audio_convert_callback'), pattern="^convert_audio$"))
+    application.add_handler(CallbackQueryHandler(lazy(AUDIO, 'remove_audio_callback'), pattern="^remove_audio$"))
+    application.add_handler(CallbackQueryHandler(lazy(AUDIO, 'video_to_audio_callback'), pattern="^video_to_audio$"))
+    application.add_handler(CallbackQueryHandler(lazy(AUDIO, 'video_to_audio_format_callback'), pattern="^v2a_(mp3|m4a|opus|flac|wav)$"))
+    application.add_handler(CallbackQueryHandler(lazy(AUDIO, 'audio_format_callback'), pattern="^audio_fmt_(mp3|m4a|opus|flac|wav)$"))
     
     # Archive tool handlers
-    application.add_handler(CallbackQueryHandler(archive_callback, pattern="^create_archive$"))
-    application.add_handler(CallbackQueryHandler(extract_callback, pattern="^extract_archive$"))
-    application.add_handler(CallbackQueryHandler(bundle_callback, pattern="^bundle_files$"))
+    application.add_handler(CallbackQueryHandler(lazy(ARCHIVE, 'archive_callback'), pattern="^create_archive$"))
+    application.add_handler(CallbackQueryHandler(lazy(ARCHIVE, 'extract_callback'), pattern="^extract_archive$"))
+    application.add_handler(CallbackQueryHandler(lazy(ARCHIVE, 'bundle_callback'), pattern="^bundle_files$"))
+    application.add_handler(CallbackQueryHandler(lazy(ARCHIVE, 'archive_format_callback'), pattern="^archive_fmt_(zip|7z|tar\\.gz|bundle)$"))
+    
+    # Metadata handlers
+    application.add_handler(CallbackQueryHandler(lazy(METADATA, 'metadata_show_callback'), pattern="^metadata_show$"))
+    application.add_handler(CallbackQueryHandler(lazy(METADATA, 'metadata_tags_callback'), pattern="^metadata_tags$"))
+    application.add_handler(CallbackQueryHandler(lazy(METADATA, 'metadata_rotate_callback'), pattern="^metadata_rotate$"))
+    application.add_handler(CallbackQueryHandler(lazy(METADATA, 'metadata_rotation_callback'), pattern="^rotate_(cw|ccw|flip|reset)$"))
+    application.add_handler(CallbackQueryHandler(lazy(METADATA, 'metadata_cover_callback'), pattern="^metadata_cover$"))
     
     # File message handler
     application.add_handler(MessageHandler(
         filters.VIDEO | filters.Document.VIDEO | filters.Document.AUDIO | filters.AUDIO,
-        handle_video_message
+        lazy(VIDEO, 'handle_video_message')
+    ))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("srt") | filters.Document.FileExtension("ass") | filters.Document.FileExtension("ssa"),
+        lazy(VIDEO, 'subtitle_file_message')
     ))
+    # Pictures: cover art when one is expected, otherwise handled as documents
+    application.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, lazy(METADATA, 'cover_message')))
+    # Any other document: files to archive, or an archive to extract
+    application.add_handler(MessageHandler(filters.Document.ALL, lazy(ARCHIVE, 'archive_file_message')))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, lazy(VIDEO, 'text_message')))
     
     # Start the bot
-    print("🤖 Bot is running...")
+    logger.info("🤖 Bot is running...")
     application.run_polling()
 
 if __name__ == '__main__':
@@ -6,19 +6,108 @@ load_dotenv()
 # Bot Configuration
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 
+# Optional local Bot API server (https://github.com/tdlib/telegram-bot-api),
+# required to download files over the cloud API's 20MB limit
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # e.g. http://localhost:8081/bot
+TELEGRAM_FILE_URL = os.getenv('TELEGRAM_FILE_URL')  # e.g. http://localhost:8081/file/bot
+TELEGRAM_LOCAL_MODE = os.getenv('TELEGRAM_LOCAL_MODE', 'false').lower() == 'true'
+
 # Redis Configuration
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
+# Persistence Configuration
+PERSISTENCE_FILE = os.getenv('PERSISTENCE_FILE', 'bot_state.pickle')  # used when Redis is unreachable
+PERSISTENCE_PREFIX = os.getenv('PERSISTENCE_PREFIX', 'video_tool_bot')
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', 5))  # seconds between write batches
+
+# Job Queue Configuration
+USE_JOB_QUEUE = os.getenv('USE_JOB_QUEUE', 'false').lower() == 'true'
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', REDIS_URL)
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', REDIS_URL)
+JOB_QUEUE_NAME = os.getenv('JOB_QUEUE_NAME', 'video')
+MAX_JOBS_PER_USER = int(os.getenv('MAX_JOBS_PER_USER', 3))
+
 # File Configuration
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
 TEMP_DIR = "temp"
 OUTPUT_DIR = "output"
 
+# Workspace Configuration
+DISK_QUOTA_BYTES = int(os.getenv('DISK_QUOTA_BYTES', 20 * 1024 * 1024 * 1024))  # 20GB across TEMP_DIR and OUTPUT_DIR
+WORKSPACE_RESERVE_FACTOR = 3  # input + intermediates + output, as multiples of the input size
+ORPHAN_MAX_AGE = int(os.getenv('ORPHAN_MAX_AGE', 6 * 3600))  # seconds
+ORPHAN_SWEEP_INTERVAL = int(os.getenv('ORPHAN_SWEEP_INTERVAL', 600))  # seconds
+
+# Upload Configuration
+UPLOAD_LIMIT = MAX_FILE_SIZE if TELEGRAM_API_URL else 50 * 1024 * 1024  # cloud Bot API limit
+
+# Download Configuration
+DOWNLOAD_LIMIT = MAX_FILE_SIZE if TELEGRAM_API_URL else 20 * 1024 * 1024  # cloud Bot API limit
+DOWNLOAD_CHUNK_SIZE = int(os.getenv('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+DOWNLOAD_STALL_TIMEOUT = int(os.getenv('DOWNLOAD_STALL_TIMEOUT', 60))  # seconds
+
+# Result Cache Configuration
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', 'cache')
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024))  # 5GB
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', 10000))
+# Cache and registry index changes are written together, at most this often
+INDEX_SAVE_DELAY = float(os.getenv('INDEX_SAVE_DELAY', 5))  # seconds
+
+# File Registry (local copies of uploads, file_ids of uploaded results)
+FILE_REGISTRY_DIR = os.getenv('FILE_REGISTRY_DIR', os.path.join(RESULT_CACHE_DIR, 'files'))
+FILE_REGISTRY_MAX_BYTES = int(os.getenv('FILE_REGISTRY_MAX_BYTES', 10 * 1024 * 1024 * 1024))  # 10GB
+FILE_REGISTRY_MAX_RESULTS = int(os.getenv('FILE_REGISTRY_MAX_RESULTS', 50000))
+SOURCE_COPY_TTL = int(os.getenv('SOURCE_COPY_TTL', 6 * 3600))  # seconds
+RESULT_FILE_ID_TTL = int(os.getenv('RESULT_FILE_ID_TTL', 30 * 24 * 3600))  # seconds
+
+# Subtitle Configuration
+SUBTITLE_MAX_SIZE = 2 * 1024 * 1024  # 2MB per subtitle file
+SUBTITLE_MAX_TRACKS = 10
+SUBTITLE_OVERLAY_DIR = os.getenv('SUBTITLE_OVERLAY_DIR', os.path.join(RESULT_CACHE_DIR, 'overlays'))
+SUBTITLE_OVERLAY_MAX_ENTRIES = int(os.getenv('SUBTITLE_OVERLAY_MAX_ENTRIES', 50))
+
 # Supported formats
 VIDEO_FORMATS = ['.mp4', '.avi', '.mkv', '.mov', '.webm', '.flv', '.wmv']
 AUDIO_FORMATS = ['.mp3', '.aac', '.wav', '.opus', '.flac', '.m4a']
 ARCHIVE_FORMATS = ['.zip', '.7z', '.tar.gz', '.rar']
+SUBTITLE_FORMATS = ['.srt', '.ass', '.ssa']
+
+# Archive Configuration (limits guard against zip bombs)
+ARCHIVE_MAX_MEMBERS = int(os.getenv('ARCHIVE_MAX_MEMBERS', 1000))
+ARCHIVE_MAX_UNPACKED_SIZE = int(os.getenv('ARCHIVE_MAX_UNPACKED_SIZE', 4 * 1024 * 1024 * 1024))  # 4GB
+ARCHIVE_MAX_RATIO = int(os.getenv('ARCHIVE_MAX_RATIO', 100))  # unpacked / packed bytes
+ARCHIVE_COMPRESS_LEVEL = int(os.getenv('ARCHIVE_COMPRESS_LEVEL', 6))
+
+# Processing Configuration
+MAX_CONCURRENT_ENCODES = int(os.getenv('MAX_CONCURRENT_ENCODES', 2))
+FFMPEG_TIMEOUT = int(os.getenv('FFMPEG_TIMEOUT', 3600))  # seconds
+PROBE_TIMEOUT = int(os.getenv('PROBE_TIMEOUT', 30))  # seconds
+MEDIA_INFO_CACHE_SIZE = int(os.getenv('MEDIA_INFO_CACHE_SIZE', 256))
+ENCODE_CPU_COUNT = int(os.getenv('ENCODE_CPU_COUNT', 0))  # 0 = every core this process may use
+PRESET_DEGRADE_QUEUE_DEPTH = int(os.getenv('PRESET_DEGRADE_QUEUE_DEPTH', 2))  # waiting encodes per faster step
+MAX_PRESET_DEGRADE = int(os.getenv('MAX_PRESET_DEGRADE', 3))  # steps
+PARALLEL_ENCODE_MIN_DURATION = int(os.getenv('PARALLEL_ENCODE_MIN_DURATION', 300))  # seconds
+PARALLEL_CHUNK_MIN_SECONDS = int(os.getenv('PARALLEL_CHUNK_MIN_SECONDS', 20))
+CHUNK_ENCODE_THREADS = int(os.getenv('CHUNK_ENCODE_THREADS', 2))  # threads per chunk encoder
+
+# Admission Control (cost units ~ megapixel-seconds of x264 'medium' encoding)
+GLOBAL_COST_BUDGET = float(os.getenv('GLOBAL_COST_BUDGET', 2000))  # in flight at once
+USER_COST_BURST = float(os.getenv('USER_COST_BURST', 1000))  # per user bucket size
+USER_COST_RATE = float(os.getenv('USER_COST_RATE', 2))  # per user refill per second
+
+# Progress Reporting
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 5))  # seconds per message
+PROGRESS_EDITS_PER_SECOND = float(os.getenv('PROGRESS_EDITS_PER_SECOND', 20))  # across all chats
+
+# Metrics
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9400))  # 0 disables the endpoint
+
+# Startup
+STARTUP_IMPORT_BUDGET = float(os.getenv('STARTUP_IMPORT_BUDGET', 0.8))  # seconds to import bot.py
+
 
-# Create directories if they don't exist
-os.makedirs(TEMP_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+def ensure_dirs():
+    """Create the working directories; call once at startup, not on import"""
+    for path in (TEMP_DIR, OUTPUT_DIR, RESULT_CACHE_DIR):
+        os.makedirs(path, exist_ok=True)
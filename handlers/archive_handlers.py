@@ -0,0 +1,170 @@
+import os
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from utils.archive_processor import (
+    create_archive, extract_archive, ArchiveError, CREATE_FORMATS
+)
+from handlers.video_handlers import process_upload, process_uploads
+from config.config import DOWNLOAD_LIMIT, UPLOAD_LIMIT, ARCHIVE_FORMATS
+
+MAX_ARCHIVE_FILES = 20
+
+# Extracted files sent back per archive; the rest are listed as skipped
+MAX_EXTRACT_SEND = 30
+
+FORMAT_LABELS = {
+    'zip': "ZIP",
+    '7z': "7z",
+    'tar.gz': "TAR.GZ"
+}
+
+def _upload_from_document(document):
+    return {
+        'file_id': document.file_id,
+        'file_unique_id': document.file_unique_id,
+        'file_size': document.file_size or 0,
+        'file_name': document.file_name
+    }
+
+def _collect_keyboard(mode):
+    if mode == 'bundle':
+        buttons = [[InlineKeyboardButton("📚 Bundle", callback_data="archive_fmt_bundle")]]
+    else:
+        buttons = [[
+            InlineKeyboardButton(label, callback_data=f"archive_fmt_{fmt}")
+            for fmt, label in FORMAT_LABELS.items()
+        ]]
+    buttons.append([InlineKeyboardButton("🔙 Back", callback_data="archive_tools")])
+    return InlineKeyboardMarkup(buttons)
+
+async def archive_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle archive creation request"""
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data['archive_files'] = {'mode': 'create', 'files': []}
+    await query.edit_message_text(
+        f"📦 **Create Archive**\nSend up to {MAX_ARCHIVE_FILES} files, then choose the archive format.\n"
+        "Videos, music and images are stored as they are; everything else is compressed."
+    )
+
+async def bundle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle file bundling request"""
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data['archive_files'] = {'mode': 'bundle', 'files': []}
+    await query.edit_message_text(
+        f"📚 **Bundle Files**\nSend up to {MAX_ARCHIVE_FILES} files and I'll put them in one ZIP "
+        "without compressing anything, which is quick for media."
+    )
+
+async def extract_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle archive extraction request"""
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data.pop('archive_files', None)
+    context.user_data['awaiting_extract'] = True
+    formats = ', '.join(ext.lstrip('.') for ext in ARCHIVE_FORMATS)
+    await query.edit_message_text(f"📤 **Extract Archive**\nSend the archive ({formats}).")
+
+async def archive_file_message(update: Update, context: ContextTypes.DEFAULT_TYPE, upload=None):
+    """Handle a document for a pending archive, bundle or extraction"""
+    message = update.message
+    if upload is None:
+        upload = _upload_from_document(message.document)
+
+    if upload['file_size'] > DOWNLOAD_LIMIT:
+        await message.reply_text(
+            f"📁 File is too large. I can download files up to {DOWNLOAD_LIMIT // (1024 * 1024)}MB."
+        )
+        return
+
+    pending = context.user_data.get('archive_files')
+    if pending is not None:
+        if len(pending['files']) >= MAX_ARCHIVE_FILES:
+            await message.reply_text(f"❌ Up to {MAX_ARCHIVE_FILES} files per archive. Choose a format to continue.")
+            return
+        pending['files'].append(upload)
+        await message.reply_text(
+            f"➕ {len(pending['files'])} file(s) ready. Send more or choose:",
+            reply_markup=_collect_keyboard(pending['mode'])
+        )
+        return
+
+    name = (upload.get('file_name') or '').lower()
+    if context.user_data.get('awaiting_extract') or name.endswith(tuple(ARCHIVE_FORMATS) + ('.tar', '.tgz')):
+        done = await _extract_upload(context, message.chat_id, message.from_user.id, upload)
+        if done:
+            context.user_data.pop('awaiting_extract', None)
+
+async def archive_format_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pack the collected files in the chosen format"""
+    query = update.callback_query
+    await query.answer()
+
+    pending = context.user_data.get('archive_files')
+    if not pending or not pending['files']:
+        await query.edit_message_text("📦 Send the files to pack first.")
+        return
+
+    choice = query.data[len('archive_fmt_'):]
+    bundle = choice == 'bundle'
+    fmt = 'zip' if bundle else choice
+    files = pending['files']
+    names = [f.get('file_name') or f"file_{i + 1}" for i, f in enumerate(files)]
+    output_name = ("bundle" if bundle else "archive") + CREATE_FORMATS[fmt]
+
+    problem = None
+
+    async def run(input_paths, work_dir):
+        nonlocal problem
+        output_path = os.path.join(work_dir, output_name)
+        ok = await create_archive(input_paths, output_path, fmt, names=names, compress=not bundle)
+        if not ok:
+            return [], None
+        if os.path.getsize(output_path) > UPLOAD_LIMIT:
+            problem = f"The archive is over the {UPLOAD_LIMIT // (1024 * 1024)}MB I can upload. Try fewer files."
+            return [], None
+        label = "📚 Bundled" if bundle else f"📦 Packed as {FORMAT_LABELS[fmt]}"
+        return [output_path], f"{label}: {len(files)} file(s)"
+
+    await query.edit_message_text(f"📦 Packing {len(files)} file(s)...")
+    done = await process_uploads(
+        context, query.message.chat_id, query.from_user.id, files,
+        'bundle_files' if bundle else 'create_archive', {'format': fmt, 'names': names}, run,
+        kind='document', status_text="📦 Packing...", probe=False
+    )
+    if problem:
+        await context.bot.send_message(query.message.chat_id, f"❌ {problem}")
+    if done:
+        context.user_data.pop('archive_files', None)
+
+async def _extract_upload(context, chat_id, user_id, upload):
+    """Extract an uploaded archive and send back its files"""
+    problem = None
+
+    async def run(input_path, work_dir):
+        nonlocal problem
+        output_dir = os.path.join(work_dir, "extracted")
+        os.makedirs(output_dir, exist_ok=True)
+        try:
+            files = await extract_archive(input_path, output_dir)
+        except ArchiveError as e:
+            problem = str(e)
+            return [], None
+        sendable = [f for f in files if os.path.getsize(f) <= UPLOAD_LIMIT]
+        skipped = len(files) - len(sendable[:MAX_EXTRACT_SEND])
+        caption = f"📤 Extracted from {upload.get('file_name') or 'archive'}"
+        if skipped:
+            caption += f" ({skipped} file(s) too large or over the {MAX_EXTRACT_SEND} file limit not sent)"
+        return sendable[:MAX_EXTRACT_SEND], caption
+
+    done = await process_upload(
+        context, chat_id, user_id, upload, 'extract_archive', {}, run,
+        kind='document', status_text="📤 Extracting...", probe=False
+    )
+    if problem:
+        await context.bot.send_message(chat_id, f"❌ {problem}")
+    return done
@@ -0,0 +1,157 @@
+import os
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from utils.audio_processor import extract_audio, convert_audio, remove_audio
+from handlers.video_handlers import process_upload, process_uploads
+
+MAX_AUDIO_BATCH = 20
+
+# Formats offered to the user: callback suffix -> button label
+FORMAT_CHOICES = {
+    'mp3': "MP3",
+    'm4a': "AAC (M4A)",
+    'opus': "Opus",
+    'flac': "FLAC (lossless)",
+    'wav': "WAV (uncompressed)"
+}
+
+def _format_keyboard(prefix):
+    buttons = [InlineKeyboardButton(label, callback_data=f"{prefix}{fmt}") for fmt, label in FORMAT_CHOICES.items()]
+    # Two per row
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    rows.append([InlineKeyboardButton("🔙 Back", callback_data="audio_tools")])
+    return InlineKeyboardMarkup(rows)
+
+def _display_name(upload, default='audio'):
+    name = os.path.splitext(os.path.basename(upload.get('file_name') or ''))[0]
+    return name or default
+
+async def audio_extract_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle audio extraction request"""
+    query = update.callback_query
+    await query.answer()
+
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("📹 Send the video first, then choose 🔊 Extract Audio.")
+        return
+
+    await query.edit_message_text("🔊 Extracting the audio track as it is...")
+    await extract_upload(context, query.message.chat_id, query.from_user.id, video)
+
+async def extract_upload(context, chat_id, user_id, video, fmt=None):
+    """Extract an upload's audio, stream copied unless fmt needs a transcode"""
+    async def run(input_path, work_dir):
+        path = await extract_audio(input_path, work_dir, fmt, name=_display_name(video))
+        if not path:
+            return [], None
+        how = "converted" if fmt else "copied without re-encoding"
+        return [path], f"🔊 Audio {how}"
+
+    return await process_upload(
+        context, chat_id, user_id, video, 'extract_audio', {'format': fmt or 'original'}, run,
+        kind='document', status_text="🔊 Extracting audio..."
+    )
+
+async def video_to_audio_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle video to audio request"""
+    query = update.callback_query
+    await query.answer()
+
+    if not context.user_data.get('last_video'):
+        await query.edit_message_text("📹 Send the video first, then choose 🎥 Video to Audio.")
+        return
+
+    await query.edit_message_text(
+        "🎥 **Video to Audio**\nChoose the audio format:",
+        reply_markup=_format_keyboard('v2a_')
+    )
+
+async def video_to_audio_format_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Convert the last upload's audio to the chosen format"""
+    query = update.callback_query
+    await query.answer()
+
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("❌ I no longer have that video. Please send it again.")
+        return
+
+    fmt = query.data[len('v2a_'):]
+    await query.edit_message_text(f"🎥 Converting to {FORMAT_CHOICES[fmt]}...")
+    await extract_upload(context, query.message.chat_id, query.from_user.id, video, fmt)
+
+async def remove_audio_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle audio removal request"""
+    query = update.callback_query
+    await query.answer()
+
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("📹 Send the video first, then choose 🔇 Remove Audio.")
+        return
+
+    async def run(input_path, work_dir):
+        output_path = os.path.join(work_dir, "silent.mp4")
+        ok = await remove_audio(input_path, output_path)
+        return ([output_path] if ok else []), "🔇 Audio removed"
+
+    await query.edit_message_text("🔇 Removing the audio track...")
+    await process_upload(
+        context, query.message.chat_id, query.from_user.id, video, 'remove_audio', {}, run,
+        kind='video', status_text="🔇 Removing audio..."
+    )
+
+async def audio_convert_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle audio conversion request"""
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data['audio_batch'] = []
+    await query.edit_message_text(
+        f"🎵 **Audio Converter**\nSend up to {MAX_AUDIO_BATCH} audio or video files, "
+        "then pick the format to convert them all to."
+    )
+
+async def audio_batch_message(update: Update, context: ContextTypes.DEFAULT_TYPE, upload):
+    """Add an upload to the pending conversion batch"""
+    batch = context.user_data['audio_batch']
+    if len(batch) >= MAX_AUDIO_BATCH:
+        await update.message.reply_text(f"❌ Up to {MAX_AUDIO_BATCH} files per batch. Pick a format to convert these.")
+        return
+
+    batch.append(upload)
+    await update.message.reply_text(
+        f"➕ {len(batch)} file(s) ready. Send more or pick a format:",
+        reply_markup=_format_keyboard('audio_fmt_')
+    )
+
+async def audio_format_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Convert the pending batch to the chosen format"""
+    query = update.callback_query
+    await query.answer()
+
+    batch = context.user_data.get('audio_batch')
+    if not batch:
+        await query.edit_message_text("🎵 Send the files to convert first.")
+        return
+
+    fmt = query.data[len('audio_fmt_'):]
+    names = [_display_name(upload, f"audio_{i + 1}") for i, upload in enumerate(batch)]
+
+    async def run(input_paths, work_dir):
+        paths = await convert_audio(input_paths, work_dir, fmt, names=names)
+        converted = [p for p in paths if p]
+        failed = len(paths) - len(converted)
+        caption = f"🎵 Converted to {FORMAT_CHOICES[fmt]}"
+        if failed:
+            caption += f" ({failed} file(s) failed)"
+        return converted, caption
+
+    await query.edit_message_text(f"🎵 Converting {len(batch)} file(s) to {FORMAT_CHOICES[fmt]}...")
+    done = await process_uploads(
+        context, query.message.chat_id, query.from_user.id, batch, 'convert_audio', {'format': fmt}, run,
+        kind='document', status_text="🎵 Converting..."
+    )
+    if done:
+        context.user_data.pop('audio_batch', None)
@@ -0,0 +1,250 @@
+import os
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from utils.metadata_editor import (
+    write_metadata, describe_metadata, container_extension, normalize_language,
+    MetadataError, EDITABLE_TAGS
+)
+from utils.media_info import media_info
+from utils.file_registry import file_registry
+from utils.downloader import start_download
+from utils.file_utils import QuotaExceeded
+from utils.admission import admission, estimate_cost, RateLimited
+from handlers.video_handlers import process_upload, admitted_job
+from config.config import DOWNLOAD_LIMIT
+
+# Rotation buttons: callback suffix -> (clockwise degrees added, label)
+ROTATIONS = {
+    'cw': (90, "↻ 90° clockwise"),
+    'ccw': (270, "↺ 90° counter-clockwise"),
+    'flip': (180, "🔃 180°"),
+    'reset': (None, "⏹ Reset")
+}
+
+async def _upload_info(context, user_id, video, status):
+    """Probe an upload, downloading it only if nothing has probed it yet
+
+    The download is admitted and tracked like any other job, so it counts
+    against the user's rate and /cancel stops it.
+    Raises RateLimited or QuotaExceeded when it can't start.
+    """
+    info = media_info.peek(video['file_unique_id'])
+    if info:
+        return info
+    cost = estimate_cost(
+        'read_metadata', duration=video.get('duration'),
+        width=video.get('width'), height=video.get('height')
+    )
+    admission.check_rate(user_id, cost)
+    size = video.get('file_size') or 0
+    async with admitted_job(user_id, 'read_metadata', cost, size, video.get('duration'), status) as workspace:
+        path = workspace.file("input")
+        download = await start_download(
+            context.bot, video['file_id'], path, video.get('file_size'),
+            file_unique_id=video['file_unique_id']
+        )
+        try:
+            await download.wait()
+        finally:
+            await download.cancel()
+        # Kept so the edit that usually follows needs no second download
+        await file_registry.add_source(video['file_unique_id'], path)
+        return await media_info.get(path, file_unique_id=video['file_unique_id'])
+
+def _format_metadata(metadata, name):
+    lines = [f"⚙️ **Metadata** of {name}"]
+    for key, value in metadata['tags'].items():
+        lines.append(f"• {key.capitalize()}: {value}")
+    if not metadata['tags']:
+        lines.append("• No tags")
+    if metadata['languages']:
+        lines.append(f"• Audio language: {', '.join(metadata['languages'])}")
+    if metadata['rotation'] is not None:
+        lines.append(f"• Rotation: {metadata['rotation']}° clockwise")
+    lines.append(f"• Cover art: {'yes' if metadata['cover'] else 'no'}")
+    return '\n'.join(lines)
+
+async def metadata_show_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the tags, languages, rotation and cover of the last upload"""
+    query = update.callback_query
+    await query.answer()
+
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("📹 Send the file first, then choose 📋 Show Metadata.")
+        return
+
+    await query.edit_message_text("📋 Reading metadata...")
+    try:
+        info = await _upload_info(context, update.effective_user.id, video, query.message)
+    except RateLimited as e:
+        await query.edit_message_text(
+            f"🐢 You're sending heavy jobs faster than the server can share. "
+            f"Please try again in about {max(1, round(e.retry_after))}s."
+        )
+        return
+    except QuotaExceeded:
+        await query.edit_message_text("💾 The server is short on disk space right now. Please try again in a few minutes.")
+        return
+    except Exception:
+        await query.edit_message_text("❌ Couldn't read this file's metadata.")
+        return
+    await query.edit_message_text(_format_metadata(describe_metadata(info), video.get('file_name') or "your file"))
+
+async def metadata_tags_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ask for the tags to write"""
+    query = update.callback_query
+    await query.answer()
+
+    context.user_data['awaiting_metadata'] = True
+    await query.edit_message_text(
+        "✏️ **Edit Tags**\nSend one tag per line, for the file you sent last (or send the file first):\n\n"
+        "title: My holiday\nartist: Me\nlanguage: en\n\n"
+        f"Tags: {', '.join(EDITABLE_TAGS)}, language (of the audio).\n"
+        "Leave a value empty to remove that tag."
+    )
+
+async def metadata_tags_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Parse the tag lines and write them"""
+    message = update.message
+    video = context.user_data.get('last_video')
+    if not video:
+        await message.reply_text("📹 Now send the file to tag, then the tags again.")
+        return
+
+    tags = {}
+    language = None
+    try:
+        for line in message.text.strip().splitlines():
+            key, sep, value = line.partition(':')
+            key = key.strip().lower()
+            if not sep or (key not in EDITABLE_TAGS and key != 'language'):
+                raise MetadataError(f"Couldn't read \"{line.strip()}\". Write it as tag: value.")
+            if key == 'language':
+                language = normalize_language(value)
+            else:
+                tags[key] = value.strip()
+    except MetadataError as e:
+        await message.reply_text(f"❌ {e}")
+        return
+
+    done = await _edit_upload(
+        context, message.chat_id, message.from_user.id, video,
+        {'tags': tags, 'language': language}, "✏️ Tags updated"
+    )
+    if done:
+        context.user_data.pop('awaiting_metadata', None)
+
+async def metadata_rotate_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Offer rotations for the last upload"""
+    query = update.callback_query
+    await query.answer()
+
+    if not context.user_data.get('last_video'):
+        await query.edit_message_text("📹 Send the video first, then choose 🔄 Rotate.")
+        return
+
+    keyboard = [[InlineKeyboardButton(label, callback_data=f"rotate_{name}")] for name, (_, label) in ROTATIONS.items()]
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="metadata_tools")])
+    await query.edit_message_text(
+        "🔄 **Rotate**\nThe picture isn't re-encoded; players are told to turn it.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def metadata_rotation_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Write the chosen rotation"""
+    query = update.callback_query
+    await query.answer()
+
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("❌ I no longer have that video. Please send it again.")
+        return
+
+    name = query.data[len('rotate_'):]
+    await query.edit_message_text(f"🔄 {ROTATIONS[name][1]}...")
+    await _edit_upload(
+        context, query.message.chat_id, query.from_user.id, video, {'rotate': ROTATIONS[name][0]}, "🔄 Rotated"
+    )
+
+async def metadata_cover_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ask for the cover picture"""
+    query = update.callback_query
+    await query.answer()
+
+    if not context.user_data.get('last_video'):
+        await query.edit_message_text("📹 Send the file first, then choose 🖼️ Set Cover.")
+        return
+
+    context.user_data['awaiting_cover'] = True
+    await query.edit_message_text("🖼️ **Set Cover**\nSend the picture (JPEG or PNG) to use as cover art.")
+
+async def cover_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle a picture, as cover art when one is expected"""
+    message = update.message
+    if not context.user_data.get('awaiting_cover'):
+        if message.document:
+            # Not a cover: an image to archive, like any other document
+            from handlers.archive_handlers import archive_file_message
+            await archive_file_message(update, context)
+        return
+
+    video = context.user_data.get('last_video')
+    picture = message.photo[-1] if message.photo else message.document
+    if not video:
+        await message.reply_text("❌ I no longer have the file. Please send it again.")
+        return
+    if (picture.file_size or 0) > DOWNLOAD_LIMIT:
+        await message.reply_text("❌ That picture is too large.")
+        return
+
+    name = getattr(picture, 'file_name', None) or ''
+    cover = {
+        'file_id': picture.file_id,
+        'file_unique_id': picture.file_unique_id,
+        'extension': '.png' if name.lower().endswith('.png') else '.jpg'
+    }
+    done = await _edit_upload(context, message.chat_id, message.from_user.id, video, {}, "🖼️ Cover set", cover)
+    if done:
+        context.user_data.pop('awaiting_cover', None)
+
+async def _edit_upload(context, chat_id, user_id, video, edit, caption, cover=None):
+    """Rewrite an upload's container with edited metadata and send it back"""
+    problem = None
+
+    async def run(input_path, work_dir):
+        nonlocal problem
+        info = await media_info.get(input_path)
+        extension = container_extension(info, video.get('file_name'))
+        name = os.path.splitext(os.path.basename(video.get('file_name') or 'edited'))[0]
+        output_path = os.path.join(work_dir, name + extension)
+
+        rotation = None
+        if 'rotate' in edit:
+            current = info.video.rotation if info.video else 0
+            rotation = 0 if edit['rotate'] is None else (current + edit['rotate']) % 360
+
+        cover_path = None
+        if cover:
+            cover_path = os.path.join(work_dir, "cover" + cover['extension'])
+            telegram_file = await context.bot.get_file(cover['file_id'])
+            await telegram_file.download_to_drive(cover_path)
+
+        try:
+            ok = await write_metadata(
+                input_path, output_path, tags=edit.get('tags'), language=edit.get('language'),
+                rotation=rotation, cover_path=cover_path
+            )
+        except MetadataError as e:
+            problem = str(e)
+            return [], None
+        return ([output_path] if ok else []), caption
+
+    params = {'edit': edit, 'cover': cover['file_unique_id'] if cover else None}
+    done = await process_upload(
+        context, chat_id, user_id, video, 'edit_metadata', params, run,
+        kind='document', status_text="⚙️ Rewriting the container..."
+    )
+    if problem:
+        await context.bot.send_message(chat_id, f"❌ {problem}")
+    return done
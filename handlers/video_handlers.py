@@ -1,11 +1,44 @@
+import asyncio
+import dataclasses
 import os
+import shutil
 import tempfile
+from contextlib import asynccontextmanager
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 from utils.video_processor import (
     extract_thumbnail, trim_video, merge_videos, split_video,
-    optimize_video, add_subtitles, take_screenshots
+    split_video_by_size, split_video_into_parts,
+    optimize_video, add_subtitles, take_screenshots, smart_thumbnails, parse_time,
+    soft_subtitle_extension
 )
+from utils.media_info import media_info
+from utils.job_registry import job_registry
+from utils.result_cache import result_cache, content_hash
+from utils.file_registry import file_registry
+from utils.downloader import start_download
+from utils.file_utils import workspace_manager, QuotaExceeded
+from utils.metrics import phase_seconds, cache_requests
+from utils.admission import admission, estimate_cost, RateLimited
+from utils.subtitles import SubtitleError, SubtitleTrack, prepare_track
+from config.config import (
+    USE_JOB_QUEUE, DOWNLOAD_LIMIT, UPLOAD_LIMIT, WORKSPACE_RESERVE_FACTOR,
+    SUBTITLE_MAX_SIZE, SUBTITLE_MAX_TRACKS, TEMP_DIR
+)
+
+MAX_SPLIT_PARTS = 50
+MAX_MERGE_VIDEOS = 10
+
+# Frames sent by ✨ Best Frames
+SMART_THUMBNAIL_COUNT = 3
+
+# How trim_video() produced the result, shown to the user
+TRIM_MODE_LABELS = {
+    'copy': "(stream copy, no re-encode)",
+    'smart': "(smart cut, only the edges re-encoded)",
+    'encode': "(re-encoded)"
+}
 
 async def handle_video_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming video files"""
@@ -13,15 +46,61 @@ async def handle_video_message(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = message.from_user.id
     
     # Check if file is too large
-    if message.video:
-        file_size = message.video.file_size
-    elif message.document:
-        file_size = message.document.file_size
-    else:
-        file_size = 0
+    media = message.video or message.document or message.audio
+    file_size = (media.file_size or 0) if media else 0
+    
+    if file_size > DOWNLOAD_LIMIT:
+        await message.reply_text(
+            f"📁 File is too large. I can download files up to {DOWNLOAD_LIMIT // (1024 * 1024)}MB."
+        )
+        return
+    
+    # Remember the upload so follow-up actions can reuse its cached probe
+    info = None
+    if media:
+        context.user_data['last_video'] = {
+            'file_id': media.file_id,
+            'file_unique_id': media.file_unique_id,
+            'file_size': file_size,
+            'duration': getattr(media, 'duration', None),
+            'width': getattr(media, 'width', None),
+            'height': getattr(media, 'height', None),
+            'file_name': getattr(media, 'file_name', None)
+        }
+        info = media_info.peek(media.file_unique_id)
+    
+    if 'archive_files' in context.user_data and media:
+        from handlers.archive_handlers import archive_file_message
+        await archive_file_message(update, context, context.user_data['last_video'])
+        return
+    
+    if 'audio_batch' in context.user_data and media:
+        from handlers.audio_handlers import audio_batch_message
+        await audio_batch_message(update, context, context.user_data['last_video'])
+        return
+    
+    if context.user_data.get('awaiting_merge') and media:
+        merging = context.user_data.setdefault('merging_videos', [])
+        if len(merging) >= MAX_MERGE_VIDEOS:
+            await message.reply_text(f"❌ Up to {MAX_MERGE_VIDEOS} videos per merge. Send /done to merge these.")
+            return
+        merging.append(context.user_data['last_video'])
+        await message.reply_text(f"➕ {len(merging)} video(s) ready. Send more, or /done to merge them.")
+        return
+    
+    if context.user_data.get('awaiting_trim') and media:
+        await message.reply_text(
+            "⏱ Now send the start and end times separated by a space.\n"
+            "Example: 00:01:30 00:02:00 or 90 120"
+        )
+        return
+    
+    if context.user_data.get('awaiting_metadata') and media:
+        await message.reply_text("✏️ Now send the tags, one per line, e.g. title: My holiday")
+        return
     
-    if file_size > 50 * 1024 * 1024:  # 50MB limit for direct processing
-        await message.reply_text("📁 File is large. Please use the specific tools from the menu for better processing.")
+    if context.user_data.get('awaiting_cover') and media:
+        await message.reply_text("🖼️ Now send the picture to use as cover art.")
         return
     
     # Show processing options
@@ -33,17 +112,326 @@ async def handle_video_message(update: Update, context: ContextTypes.DEFAULT_TYP
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await message.reply_text(
-        "🎥 What would you like to do with this video?",
-        reply_markup=reply_markup
+    text = "🎥 What would you like to do with this video?"
+    if info and info.video and info.duration:
+        minutes, seconds = divmod(int(info.duration), 60)
+        text += f"\n\n📐 {info.video.width}x{info.video.height} • ⏱ {minutes}:{seconds:02d}"
+    
+    await message.reply_text(text, reply_markup=reply_markup)
+
+async def process_upload(context, chat_id, user_id, video, operation, params, run,
+                         kind='document', status_text="⏳ Processing...", queue_params=None,
+                         head_only=False, probe=True):
+    """Download an upload, run an operation on it and send back the results
+
+    run: coroutine function (input_path, work_dir) -> (output paths, caption)
+    queue_params: arguments for the job queue; when set and USE_JOB_QUEUE is
+                  on, the operation runs on a worker instead
+    head_only: the operation only reads the start of the file, so it may
+               begin while the download is still running
+    probe: warm the media info cache for the input; off for non-media files
+    
+    Results are cached per upload and normalized parameters, so a repeated
+    request is answered with the earlier file_ids without downloading,
+    processing or uploading anything. Uploads the file registry still holds
+    aren't downloaded again, and an output identical to one already sent
+    goes out by file_id. Returns True on success.
+    """
+    async def run_one(input_paths, work_dir):
+        return await run(input_paths[0], work_dir)
+    
+    return await process_uploads(
+        context, chat_id, user_id, [video], operation, params, run_one, kind=kind,
+        status_text=status_text, queue_params=queue_params, head_only=head_only, probe=probe
+    )
+
+async def process_uploads(context, chat_id, user_id, videos, operation, params, run,
+                          kind='document', status_text="⏳ Processing...", queue_params=None,
+                          head_only=False, probe=True):
+    """process_upload() for an operation over several uploads at once
+
+    run: coroutine function (input paths, work_dir) -> (output paths, caption)
+    
+    All uploads download in parallel into one workspace and count as a
+    single job. head_only applies only to a single upload.
+    """
+    first, others = videos[0], videos[1:]
+    cache_params = dict(params, inputs=[v['file_unique_id'] for v in others]) if others else params
+    cache_key = result_cache.key(first['file_unique_id'], operation, cache_params)
+    cached = result_cache.get(cache_key)
+    cache_requests.inc(result='hit' if cached and cached['file_ids'] else 'miss')
+    if cached and cached['file_ids']:
+        try:
+            for file_id in cached['file_ids']:
+                await _send_result(context.bot, chat_id, file_id, cached['kind'], cached.get('note'))
+            return True
+        except BadRequest:
+            # file_ids are per bot and can go stale; make the result again
+            result_cache.discard(cache_key)
+    
+    cost = sum(_estimate_cost(video, operation, params) for video in videos)
+    try:
+        admission.check_rate(user_id, cost)
+    except RateLimited as e:
+        await context.bot.send_message(
+            chat_id,
+            f"🐢 You're sending heavy jobs faster than the server can share. "
+            f"Please try again in about {max(1, round(e.retry_after))}s."
+        )
+        return False
+    
+    if USE_JOB_QUEUE and queue_params is not None:
+        # Celery and redis are only loaded by deployments that use them
+        from utils.job_queue import submit_async, QueueFull
+        try:
+            await submit_async(
+                user_id, operation, [video['file_id'] for video in videos], params=queue_params,
+                delivery={'chat_id': chat_id}
+            )
+        except QueueFull:
+            admission.refund(user_id, cost)
+            await context.bot.send_message(chat_id, "⏳ You already have several jobs queued. Please wait for them to finish.")
+            return False
+        await context.bot.send_message(chat_id, "📥 Queued. I'll send the result when it's ready.")
+        return True
+    
+    status = await context.bot.send_message(chat_id, status_text)
+    
+    async def on_queued(position):
+        await status.edit_text(f"⏳ The server is busy. You're number {position} in the queue.")
+    
+    # Input, intermediates and results all live in the job's workspace
+    reserve = sum(video.get('file_size') or 0 for video in videos) * WORKSPACE_RESERVE_FACTOR
+    durations = [video.get('duration') for video in videos]
+    duration = sum(durations) if all(durations) else None
+    head_only = head_only and not others
+    try:
+        async with admitted_job(user_id, operation, cost, reserve, duration, status, on_queued) as workspace:
+            if others:
+                input_paths = [workspace.file(f"input_{i + 1}.mp4") for i in range(len(videos))]
+            else:
+                input_paths = [workspace.file("input.mp4")]
+            downloads = await asyncio.gather(*(
+                start_download(
+                    context.bot, video['file_id'], path, video.get('file_size'),
+                    file_unique_id=video['file_unique_id']
+                )
+                for video, path in zip(videos, input_paths)
+            ))
+            try:
+                with phase_seconds.time(operation=operation, phase='download'):
+                    if not (head_only and await downloads[0].wait_for_head()):
+                        await asyncio.gather(*(download.wait() for download in downloads))
+                for video, path, download in zip(videos, input_paths, downloads):
+                    if download.complete:
+                        await file_registry.add_source(video['file_unique_id'], path)
+                for video, path in zip(videos, input_paths):
+                    if probe:
+                        await media_info.get(path, file_unique_id=video['file_unique_id'])
+                outputs, caption = await _run_alongside(downloads[0], run(input_paths, workspace.path))
+            finally:
+                # A head-only job may finish first; the rest isn't needed
+                for download in downloads:
+                    await download.cancel()
+            
+            if not outputs:
+                await status.edit_text("❌ Processing failed.")
+                return False
+            
+            file_ids = []
+            with phase_seconds.time(operation=operation, phase='upload'):
+                for path in outputs:
+                    file_ids.append(await _upload_result(context.bot, chat_id, path, kind, caption))
+            await result_cache.put(cache_key, file_ids, outputs, kind=kind, note=caption)
+        await status.delete()
+        return True
+    except QuotaExceeded:
+        await status.edit_text("💾 The server is short on disk space right now. Please try again in a few minutes.")
+        return False
+
+
+@asynccontextmanager
+async def admitted_job(user_id, operation, cost, reserve=0, duration=None, status=None, on_queued=None):
+    """Run the body as a tracked, admitted job in its own workspace
+
+    Call admission.check_rate() first. Yields the Workspace; /cancel stops
+    the body like any tracked job. Raises QuotaExceeded when there is no
+    disk for the workspace, with the cost refunded.
+    """
+    try:
+        async with job_registry.track(user_id, operation, duration, status):
+            async with admission.admit(user_id, cost, on_queued=on_queued):
+                async with workspace_manager.workspace(operation, reserve) as workspace:
+                    yield workspace
+    except QuotaExceeded:
+        # Refused before any work was done, so it shouldn't count against the user
+        admission.refund(user_id, cost)
+        raise
+
+
+def _estimate_cost(video, operation, params):
+    """Admission cost of an operation, from cached probe data when we have it"""
+    info = media_info.peek(video['file_unique_id'])
+    stream = info.video if info else None
+    return estimate_cost(
+        operation,
+        duration=video.get('duration') or (info.duration if info else None),
+        width=stream.width if stream else video.get('width'),
+        height=stream.height if stream else video.get('height'),
+        preset=params.get('preset')
     )
 
+
+async def _run_alongside(download, coro):
+    """Await coro, aborting it if the download feeding it fails"""
+    task = asyncio.ensure_future(coro)
+    try:
+        await asyncio.wait([task, download.task], return_when=asyncio.FIRST_COMPLETED)
+        if not task.done() and download.task.exception() is not None:
+            raise download.task.exception()
+        return await task
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+async def _upload_result(bot, chat_id, path, kind, caption=None):
+    """Send an output file, by file_id when identical bytes went out before"""
+    digest = await asyncio.to_thread(content_hash, path)
+    file_id = file_registry.result_file_id(digest, kind)
+    if file_id:
+        try:
+            return (await _send_result(bot, chat_id, file_id, kind, caption)).file_id
+        except BadRequest:
+            # file_ids are per bot and can go stale; upload it again
+            file_registry.discard_result(digest, kind)
+
+    with open(path, 'rb') as f:
+        sent = await _send_result(bot, chat_id, f, kind, caption)
+    file_registry.add_result(digest, kind, sent.file_id)
+    # A result forwarded back for another operation needs no download.
+    # Not photos: Telegram recompresses them, so the bytes differ.
+    if kind != 'photo':
+        await file_registry.add_source(sent.file_unique_id, path)
+    return sent.file_id
+
+async def _send_result(bot, chat_id, media, kind, caption=None):
+    """Send a file (or file_id) and return the attachment Telegram made of it"""
+    if kind == 'photo':
+        sent = await bot.send_photo(chat_id, media, caption=caption)
+        return sent.photo[-1]
+    if kind == 'video':
+        sent = await bot.send_video(chat_id, media, caption=caption, supports_streaming=True)
+        # Short silent clips may come back as animations
+        return sent.video or sent.animation or sent.document
+    sent = await bot.send_document(chat_id, media, caption=caption)
+    return sent.document
+
+async def quick_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the quick action buttons shown under an upload"""
+    query = update.callback_query
+    await query.answer()
+    
+    action, _, owner = query.data[len('quick_'):].rpartition('_')
+    if str(query.from_user.id) != owner:
+        return
+    
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("❌ I no longer have that video. Please send it again.")
+        return
+    
+    chat_id = query.message.chat_id
+    user_id = query.from_user.id
+    
+    if action == 'trim':
+        context.user_data['awaiting_trim'] = True
+        await query.edit_message_text(
+            "⏱ Send the start and end times separated by a space.\n"
+            "Example: 00:01:30 00:02:00 or 90 120"
+        )
+    
+    elif action == 'thumb':
+        async def run(input_path, work_dir):
+            output_path = os.path.join(work_dir, "thumbnail.jpg")
+            ok = await extract_thumbnail(input_path, output_path)
+            return ([output_path] if ok else []), "🖼️ Thumbnail"
+        
+        await process_upload(
+            context, chat_id, user_id, video, 'extract_thumbnail', {'time': '00:00:01'}, run,
+            kind='photo', status_text="🖼️ Extracting thumbnail...", queue_params={},
+            head_only=True
+        )
+    
+    elif action == 'extract':
+        from handlers.audio_handlers import extract_upload
+        await query.edit_message_text("🔊 Extracting the audio track as it is...")
+        await extract_upload(context, chat_id, user_id, video)
+    
+    elif action == 'optimize':
+        async def run(input_path, work_dir):
+            output_path = os.path.join(work_dir, "optimized.mp4")
+            ok = await optimize_video(input_path, output_path, 'balanced')
+            return ([output_path] if ok else []), "⚡ Optimized (balanced)"
+        
+        await process_upload(
+            context, chat_id, user_id, video, 'optimize_video', {'preset': 'balanced'}, run,
+            kind='video', status_text="⚡ Optimizing...", queue_params={'args': ['balanced']}
+        )
+
+async def text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route plain text to the flow waiting for it"""
+    if context.user_data.get('awaiting_split'):
+        await split_value_message(update, context)
+    elif context.user_data.get('awaiting_metadata'):
+        from handlers.metadata_handlers import metadata_tags_message
+        await metadata_tags_message(update, context)
+    else:
+        await trim_times_message(update, context)
+
+async def trim_times_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle start/end times for a pending trim"""
+    message = update.message
+    video = context.user_data.get('last_video')
+    if not context.user_data.get('awaiting_trim') or not video:
+        return
+    
+    parts = message.text.split()
+    if len(parts) != 2:
+        await message.reply_text("❌ Please send exactly two times, e.g. 00:01:30 00:02:00")
+        return
+    
+    try:
+        start, end = parse_time(parts[0]), parse_time(parts[1])
+    except ValueError:
+        await message.reply_text("❌ Couldn't read those times. Use HH:MM:SS or seconds.")
+        return
+    
+    async def run(input_path, work_dir):
+        output_path = os.path.join(work_dir, "trimmed.mp4")
+        mode = await trim_video(input_path, output_path, start, end)
+        if not mode:
+            return [], None
+        return [output_path], f"✂️ Trimmed {TRIM_MODE_LABELS.get(mode, '')}"
+    
+    # Progress is measured against the trimmed length, not the whole upload
+    trimmed = dict(video, duration=end - start)
+    done = await process_upload(
+        context, message.chat_id, message.from_user.id, trimmed, 'trim_video',
+        {'start': start, 'end': end}, run,
+        kind='video', status_text="✂️ Trimming...", queue_params={'args': [start, end]},
+        head_only=True
+    )
+    if done:
+        context.user_data['awaiting_trim'] = False
+
 async def thumbnail_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle thumbnail extraction request"""
     query = update.callback_query
     await query.answer()
     
     keyboard = [
+        [InlineKeyboardButton("✨ Best Frames", callback_data="thumb_smart")],
         [InlineKeyboardButton("Single Frame", callback_data="thumb_single")],
         [InlineKeyboardButton("Multiple Frames", callback_data="thumb_multiple")],
         [InlineKeyboardButton("Custom Time", callback_data="thumb_custom")],
@@ -56,6 +444,27 @@ async def thumbnail_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         reply_markup=reply_markup
     )
 
+async def smart_thumbnail_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send the best few frames of the last upload"""
+    query = update.callback_query
+    await query.answer()
+    
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("📹 Send the video first, then choose ✨ Best Frames.")
+        return
+    
+    async def run(input_path, work_dir):
+        paths = await smart_thumbnails(input_path, os.path.join(work_dir, "best"), count=SMART_THUMBNAIL_COUNT)
+        return paths, "✨ Best frames"
+    
+    await query.edit_message_text("✨ Looking for the best frames...")
+    await process_upload(
+        context, query.message.chat_id, query.from_user.id, video, 'smart_thumbnails',
+        {'count': SMART_THUMBNAIL_COUNT}, run, kind='photo', status_text="✨ Scoring frames...",
+        queue_params={'kwargs': {'count': SMART_THUMBNAIL_COUNT}}
+    )
+
 async def trim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle video trim request"""
     query = update.callback_query
@@ -79,6 +488,30 @@ async def merge_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['merging_videos'] = []
     context.user_data['awaiting_merge'] = True
 
+async def merge_done_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Merge the videos collected since 🔀 Merge Videos, in the order sent"""
+    message = update.message
+    videos = context.user_data.get('merging_videos') or []
+    if not context.user_data.get('awaiting_merge'):
+        await message.reply_text("🔀 Choose 🔀 Merge Videos first, then send the videos.")
+        return
+    if len(videos) < 2:
+        await message.reply_text("📹 Send at least two videos to merge, then /done.")
+        return
+    
+    async def run(input_paths, work_dir):
+        output_path = os.path.join(work_dir, "merged.mp4")
+        ok = await merge_videos(input_paths, output_path)
+        return ([output_path] if ok else []), f"🔀 Merged {len(input_paths)} videos"
+    
+    done = await process_uploads(
+        context, message.chat_id, message.from_user.id, videos, 'merge_videos', {}, run,
+        kind='video', status_text="🔀 Merging...", queue_params={}
+    )
+    if done:
+        context.user_data.pop('awaiting_merge', None)
+        context.user_data.pop('merging_videos', None)
+
 async def split_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle video split request"""
     query = update.callback_query
@@ -86,15 +519,93 @@ async def split_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     keyboard = [
         [InlineKeyboardButton("By Time Intervals", callback_data="split_time")],
-        [InlineKeyboardButton("Into Equal Parts", callback_data="split_parts")],
-        [InlineKeyboardButton("By Size", callback_data="split_size")],
-        [InlineKeyboardButton("🔙 Back", callback_data="video_tools")]
+        [InlineKeyboardButton("Into Equal Parts", callback_data="split_parts")]
     ]
+    text = "📏 **Video Splitter**\nChoose split method:"
+    # Splitting by size only helps a file too big to upload back in one piece,
+    # which the cloud Bot API (20MB down, 50MB up) can never receive
+    if _needs_size_split(context.user_data.get('last_video')):
+        keyboard.append([InlineKeyboardButton("By Size", callback_data="split_size")])
+    else:
+        text += f"\n\nSplitting by size isn't needed: the video already fits the {UPLOAD_LIMIT // (1024 * 1024)}MB upload limit."
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="video_tools")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(
-        "📏 **Video Splitter**\nChoose split method:",
-        reply_markup=reply_markup
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+def _needs_size_split(video):
+    return bool(video) and (video.get('file_size') or 0) > UPLOAD_LIMIT
+
+async def split_method_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the split method buttons"""
+    query = update.callback_query
+    await query.answer()
+    
+    method = query.data[len('split_'):]
+    video = context.user_data.get('last_video')
+    if not video:
+        await query.edit_message_text("📹 Send the video first, then choose how to split it.")
+        return
+    
+    if method == 'size':
+        # Parts sized for what the bot can upload back
+        context.user_data.pop('awaiting_split', None)
+        if not _needs_size_split(video):
+            await query.edit_message_text(
+                f"✅ This video already fits the {UPLOAD_LIMIT // (1024 * 1024)}MB upload limit, so there's nothing to split by size."
+            )
+            return
+        await query.edit_message_text("📏 Splitting into parts that fit Telegram's upload limit...")
+        await _split_upload(context, query.message.chat_id, query.from_user.id, video, 'size', UPLOAD_LIMIT)
+    elif method == 'parts':
+        context.user_data['awaiting_split'] = 'parts'
+        await query.edit_message_text(f"🔢 How many parts? Send a number from 2 to {MAX_SPLIT_PARTS}.")
+    else:
+        context.user_data['awaiting_split'] = 'time'
+        await query.edit_message_text("⏱ How long should each part be? Send seconds or HH:MM:SS, e.g. 300 or 00:05:00")
+
+async def split_value_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the part count or part length for a pending split"""
+    message = update.message
+    method = context.user_data.get('awaiting_split')
+    video = context.user_data.get('last_video')
+    if not video:
+        context.user_data.pop('awaiting_split', None)
+        return
+    
+    try:
+        if method == 'parts':
+            value = int(message.text.strip())
+            if not 2 <= value <= MAX_SPLIT_PARTS:
+                raise ValueError
+        else:
+            value = parse_time(message.text)
+            if value <= 0:
+                raise ValueError
+    except ValueError:
+        await message.reply_text("❌ Couldn't read that. Please send a valid number.")
+        return
+    
+    done = await _split_upload(context, message.chat_id, message.from_user.id, video, method, value)
+    if done:
+        context.user_data.pop('awaiting_split', None)
+
+async def _split_upload(context, chat_id, user_id, video, method, value):
+    """Split an upload by size, part count or part length"""
+    operations = {
+        'size': ('split_video_by_size', split_video_by_size, {'max_bytes': value}),
+        'parts': ('split_video_into_parts', split_video_into_parts, {'parts': value}),
+        'time': ('split_video_by_time', split_video, {'segment_duration': value})
+    }
+    operation, split, params = operations[method]
+    
+    async def run(input_path, work_dir):
+        parts = await split(input_path, work_dir, value)
+        return parts, (f"📏 Split into {len(parts)} part(s)" if parts else None)
+    
+    return await process_upload(
+        context, chat_id, user_id, video, operation, params, run,
+        kind='video', status_text="📏 Splitting...", queue_params={'args': [value]}
     )
 
 async def optimize_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -134,6 +645,159 @@ async def subtitle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+async def subtitle_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the burn/soft/multiple languages buttons"""
+    query = update.callback_query
+    await query.answer()
+    
+    mode = query.data[len('subtitle_'):]
+    if not context.user_data.get('last_video'):
+        await query.edit_message_text("📹 Send the video first, then choose how to add subtitles.")
+        return
+    
+    context.user_data['awaiting_subtitles'] = {'mode': mode, 'files': []}
+    if mode == 'multi':
+        await query.edit_message_text(
+            "🌐 Send one .srt or .ass file per language, then tap Done.\n"
+            "Name them like movie.en.srt or movie.es.srt so each track gets its language."
+        )
+    else:
+        await query.edit_message_text("📝 Send the subtitle file (.srt or .ass).")
+
+async def subtitle_file_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle an uploaded subtitle file for a pending subtitle job"""
+    message = update.message
+    if context.user_data.get('archive_files') is not None:
+        # Collecting files to archive: a subtitle file is just one more
+        from handlers.archive_handlers import archive_file_message
+        await archive_file_message(update, context)
+        return
+    
+    pending = context.user_data.get('awaiting_subtitles')
+    video = context.user_data.get('last_video')
+    if not pending or not video:
+        await message.reply_text("📝 To add subtitles, send the video and choose 📝 Add Subtitles first.")
+        return
+    
+    document = message.document
+    if (document.file_size or 0) > SUBTITLE_MAX_SIZE:
+        await message.reply_text(f"❌ Subtitle files can be up to {SUBTITLE_MAX_SIZE // (1024 * 1024)}MB.")
+        return
+    if len(pending['files']) >= SUBTITLE_MAX_TRACKS:
+        await message.reply_text(f"❌ Up to {SUBTITLE_MAX_TRACKS} subtitle tracks per video. Tap Done to continue.")
+        return
+    
+    # Checked now so a broken file is reported before any video work starts.
+    # The validated track is kept for the job; the orphan sweep removes it
+    # if the job never runs.
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    track_dir = tempfile.mkdtemp(prefix='subtitle_', dir=TEMP_DIR)
+    try:
+        track = await _fetch_subtitle(context.bot, document.file_id, document.file_name, track_dir)
+    except SubtitleError as e:
+        shutil.rmtree(track_dir, ignore_errors=True)
+        await message.reply_text(f"❌ {e}")
+        return
+    
+    pending['files'].append({
+        'file_id': document.file_id,
+        'file_unique_id': document.file_unique_id,
+        'file_name': document.file_name,
+        'track': dataclasses.asdict(track)
+    })
+    
+    if pending['mode'] != 'multi':
+        done = await _subtitle_upload(context, message.chat_id, message.from_user.id, video, pending)
+        if done:
+            context.user_data.pop('awaiting_subtitles', None)
+        else:
+            shutil.rmtree(track_dir, ignore_errors=True)
+            pending['files'].pop()
+        return
+    
+    keyboard = [[InlineKeyboardButton("✅ Done", callback_data="subtitle_done")]]
+    await message.reply_text(
+        f"➕ Added {document.file_name} ({track.language or 'language unknown'}, {track.cues} lines). "
+        f"Send another or tap Done.",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def subtitle_done_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mux the collected subtitle tracks"""
+    query = update.callback_query
+    await query.answer()
+    
+    pending = context.user_data.get('awaiting_subtitles')
+    video = context.user_data.get('last_video')
+    if not pending or not pending['files'] or not video:
+        await query.edit_message_text("📝 No subtitle files yet. Send at least one .srt or .ass file.")
+        return
+    
+    await query.edit_message_text(f"🌐 Adding {len(pending['files'])} subtitle track(s)...")
+    done = await _subtitle_upload(context, query.message.chat_id, query.from_user.id, video, pending)
+    if done:
+        context.user_data.pop('awaiting_subtitles', None)
+
+async def _fetch_subtitle(bot, file_id, file_name, work_dir):
+    """Download and validate a subtitle file, returning its SubtitleTrack"""
+    # Keeping the name lets the track pick its language up from it
+    path = os.path.join(work_dir, os.path.basename(file_name or 'subtitles.srt'))
+    telegram_file = await bot.get_file(file_id)
+    await telegram_file.download_to_drive(path)
+    return prepare_track(path, work_dir)
+
+async def _subtitle_upload(context, chat_id, user_id, video, pending):
+    """Burn in or soft-mux the pending subtitle files"""
+    burn = pending['mode'] == 'burn'
+    files = pending['files'][:1] if burn else pending['files']
+    problem = None
+    
+    async def run(input_path, work_dir):
+        nonlocal problem
+        try:
+            tracks = [await _pending_track(context.bot, f, work_dir) for f in files]
+        except SubtitleError as e:
+            problem = str(e)
+            return [], None
+        if burn:
+            output_path = os.path.join(work_dir, "subtitled.mp4")
+        else:
+            info = await media_info.get(input_path)
+            output_path = os.path.join(work_dir, "subtitled" + soft_subtitle_extension(info, tracks))
+        ok = await add_subtitles(input_path, tracks, output_path, burn=burn)
+        if not ok:
+            return [], None
+        if burn:
+            return [output_path], "📝 Subtitles burned in"
+        languages = ', '.join(t.language or '?' for t in tracks)
+        return [output_path], f"📝 {len(tracks)} subtitle track(s) added ({languages})"
+    
+    params = {'mode': 'burn' if burn else 'soft', 'subtitles': [f['file_unique_id'] for f in files]}
+    if burn:
+        params['preset'] = 'medium'
+    done = await process_upload(
+        context, chat_id, user_id, video, 'add_subtitles' if burn else 'mux_subtitles', params, run,
+        kind='video' if burn else 'document', status_text="📝 Adding subtitles..."
+    )
+    if problem:
+        await context.bot.send_message(chat_id, f"❌ {problem}")
+    if done:
+        for f in pending['files']:
+            if f.get('track'):
+                shutil.rmtree(os.path.dirname(f['track']['path']), ignore_errors=True)
+    return done
+
+async def _pending_track(bot, pending_file, work_dir):
+    """The track validated on arrival, or a fresh download when it's gone
+
+    State may have come back from persistence after a restart, or on
+    another replica, where the validated copy isn't on disk.
+    """
+    track = pending_file.get('track')
+    if track and os.path.exists(track['path']):
+        return SubtitleTrack(**track)
+    return await _fetch_subtitle(bot, pending_file['file_id'], pending_file['file_name'], work_dir)
+
 async def screenshot_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle screenshot request"""
     query = update.callback_query
@@ -0,0 +1,52 @@
+import os
+import sys
+
+# Run the job queue in-process: no Redis needed for the broker, results or user slots
+os.environ['CELERY_BROKER_URL'] = 'memory://'
+os.environ['CELERY_RESULT_BACKEND'] = 'cache+memory://'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from utils.ffmpeg_runner import FFmpegRunner  # noqa: E402
+
+
+class RecordingRunner(FFmpegRunner):
+    """Records the ffmpeg commands and creates their output files instead of running them"""
+
+    def __init__(self):
+        super().__init__(max_concurrent=2)
+        self.commands = []
+
+    async def run(self, stream, timeout=None, on_stderr=None, limit=True):
+        args = stream.compile()
+        self.commands.append(args)
+        output = [arg for arg in args if arg != '-y'][-1].replace('%d', '0')
+        with open(output, 'wb') as f:
+            f.write(b'\0')
+        return b'', b''
+
+
+class FakeMedia:
+    """Canned probe results: `info` for every file and `keyframe_times` for every video"""
+
+    def __init__(self, info=None, keyframe_times=()):
+        self.info = info
+        self.keyframe_times = list(keyframe_times)
+
+    async def get(self, path, file_unique_id=None):
+        return self.info
+
+    async def keyframes(self, path, file_unique_id=None, until=None):
+        return [k for k in self.keyframe_times if until is None or k <= until]
+
+
+@pytest.fixture
+def runner():
+    return RecordingRunner()
+
+
+@pytest.fixture
+def media():
+    return FakeMedia()
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from utils.admission import AdmissionController, RateLimited
+from utils.job_registry import EditRateLimiter
+
+
+def test_refund_returns_tokens_of_a_refused_job():
+    controller = AdmissionController(user_rate=0, user_burst=100)
+    controller.check_rate(1, 80)
+    with pytest.raises(RateLimited):
+        controller.check_rate(1, 80)
+
+    controller.refund(1, 80)
+    controller.check_rate(1, 80)
+
+
+def test_queue_updates_are_coalesced_per_waiter():
+    async def main():
+        controller = AdmissionController(budget=10, limiter=EditRateLimiter(per_second=1000), edit_interval=0.2)
+        updates = []
+        release = asyncio.Event()
+
+        async def holder():
+            async with controller.admit(0, 10):
+                await release.wait()
+
+        async def waiter(user_id):
+            async def on_queued(position):
+                updates.append((user_id, position))
+            async with controller.admit(user_id, 10, on_queued=on_queued):
+                pass
+
+        tasks = [asyncio.ensure_future(holder())]
+        await asyncio.sleep(0)
+        tasks += [asyncio.ensure_future(waiter(user_id)) for user_id in (1, 2, 3)]
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(*tasks)
+        return updates
+
+    updates = asyncio.run(main())
+    # One edit each on joining; the moves up happen within edit_interval and
+    # are dropped once the waiter has been admitted
+    assert sorted(updates) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_admitted_job_refunds_a_job_refused_for_disk(monkeypatch, tmp_path):
+    from handlers import video_handlers
+    from utils.file_utils import QuotaExceeded, WorkspaceManager
+
+    controller = AdmissionController(user_rate=0, user_burst=100)
+    monkeypatch.setattr(video_handlers, 'admission', controller)
+    monkeypatch.setattr(video_handlers, 'workspace_manager',
+                        WorkspaceManager(root=str(tmp_path), watched=(), quota_bytes=10))
+
+    async def main():
+        controller.check_rate(1, 80)
+        async with video_handlers.admitted_job(1, 'read_metadata', 80, reserve=100):
+            pass
+
+    with pytest.raises(QuotaExceeded):
+        asyncio.run(main())
+    controller.check_rate(1, 80)
@@ -0,0 +1,18 @@
+import asyncio
+import zipfile
+
+from utils.archive_processor import ArchiveProcessor
+
+
+def test_compressible_member_is_deflated_whatever_the_workspace_name(tmp_path):
+    # Uploads are downloaded as input_N.mp4; the archive name is what counts
+    upload = tmp_path / 'input_1.mp4'
+    upload.write_bytes(b'Meeting notes: nothing to report.\n' * 40000)
+    output = tmp_path / 'files.zip'
+
+    assert asyncio.run(ArchiveProcessor().create_archive([str(upload)], str(output), names=['notes.txt']))
+
+    with zipfile.ZipFile(output) as archive:
+        member = archive.getinfo('notes.txt')
+    assert member.compress_type == zipfile.ZIP_DEFLATED
+    assert member.compress_size < member.file_size // 10
@@ -0,0 +1,21 @@
+import asyncio
+
+from utils.audio_processor import AudioProcessor
+from utils.media_info import MediaInfo, StreamInfo
+
+
+def test_remove_audio_converts_or_drops_subtitles_for_mp4(runner, media, tmp_path):
+    media.info = MediaInfo(path='input.mkv', streams=[
+        StreamInfo(index=0, codec_type='video', codec_name='h264'),
+        StreamInfo(index=1, codec_type='audio', codec_name='aac'),
+        StreamInfo(index=2, codec_type='subtitle', codec_name='subrip'),
+        StreamInfo(index=3, codec_type='subtitle', codec_name='hdmv_pgs_subtitle')
+    ])
+    processor = AudioProcessor(runner=runner, media=media)
+
+    assert asyncio.run(processor.remove_audio('input.mkv', str(tmp_path / 'silent.mp4')))
+
+    args = runner.commands[0]
+    maps = [args[i + 1] for i, arg in enumerate(args) if arg == '-map']
+    assert maps == ['0:v?', '0:2']
+    assert args[args.index('-c:s:0') + 1] == 'mov_text'
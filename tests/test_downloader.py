@@ -0,0 +1,98 @@
+import asyncio
+import os
+
+import pytest
+
+from utils import downloader
+from utils.downloader import StreamingDownload, DownloadIncomplete, head_is_streamable
+from utils.ffmpeg_runner import FFmpegRunner
+
+
+class ChunkedDownload(StreamingDownload):
+    """Writes the given chunks one by one, like a slow network download"""
+
+    def __init__(self, path, chunks, delay=0.05):
+        super().__init__('test://', path)
+        self.chunks = chunks
+        self.delay = delay
+
+    async def _run(self):
+        try:
+            with open(self.path, 'wb') as f:
+                for chunk in self.chunks:
+                    await asyncio.sleep(self.delay)
+                    f.write(chunk)
+                    f.flush()
+                    await self._advance(len(chunk))
+        finally:
+            self.finished.set()
+            downloader.active_downloads.pop(self.path, None)
+            async with self._progress:
+                self._progress.notify_all()
+
+
+class Collector:
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_mpegts_needs_sync_bytes_at_packet_intervals():
+    packet = b'\x47' + b'\x00' * 187
+    assert head_is_streamable(packet * 8)
+    # A GIF also starts with 'G'
+    assert not head_is_streamable(b'GIF89a' + b'\x00' * 2000)
+
+
+def test_feed_copies_the_file_as_it_grows(tmp_path):
+    async def main():
+        download = await ChunkedDownload(str(tmp_path / 'in'), [b'a' * 10, b'b' * 10, b'c' * 5]).start()
+        writer = Collector()
+        await download.feed(writer)
+        return writer
+
+    writer = asyncio.run(main())
+    assert writer.data == b'a' * 10 + b'b' * 10 + b'c' * 5
+    assert writer.closed
+
+
+def test_feed_raises_when_the_download_fails(tmp_path):
+    async def main():
+        # Neither a local file nor a URL httpx can fetch
+        download = await StreamingDownload('missing', str(tmp_path / 'in')).start()
+        await download.feed(Collector())
+
+    with pytest.raises(DownloadIncomplete):
+        asyncio.run(main())
+
+
+def test_runner_pipes_a_growing_input_until_the_download_ends(tmp_path):
+    async def main():
+        download = await ChunkedDownload(str(tmp_path / 'in'), [b'x' * 100] * 5).start()
+        assert downloader.is_growing(download.path)
+        # sh ignores '-i <path>'; cat copies whatever arrives on stdin
+        stdout, _ = await FFmpegRunner().run(['sh', '-c', 'cat', '-i', download.path], timeout=10)
+        return stdout
+
+    assert asyncio.run(main()) == b'x' * 500
+
+
+def test_runner_reads_finished_downloads_from_disk(tmp_path):
+    path = tmp_path / 'in'
+    path.write_bytes(b'done')
+
+    async def main():
+        stdout, _ = await FFmpegRunner().run(['sh', '-c', 'cat "$1"', '-i', str(path)], timeout=10)
+        return stdout
+
+    assert asyncio.run(main()) == b'done'
+    assert os.path.exists(path)
@@ -0,0 +1,25 @@
+import asyncio
+import json
+import os
+
+from utils.file_registry import FileRegistry
+
+
+def test_index_writes_are_batched(tmp_path):
+    registry = FileRegistry(directory=str(tmp_path / 'files'), save_delay=0.05)
+    upload = tmp_path / 'upload.mp4'
+    upload.write_bytes(b'video')
+
+    async def register():
+        await registry.add_source('AgADfirst', str(upload))
+        registry.add_result('digest', 'video', 'file-id')
+        # Nothing written until the delay has passed
+        assert not os.path.exists(registry.index_path)
+        await registry._writer.task
+
+    asyncio.run(register())
+    with open(registry.index_path) as f:
+        index = json.load(f)
+    assert list(index['sources']) == ['AgADfirst']
+    assert index['results']['video:digest']['file_id'] == 'file-id'
+    assert registry.source_path('AgADfirst') is not None
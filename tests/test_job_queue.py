@@ -0,0 +1,100 @@
+import asyncio
+import threading
+
+import pytest
+
+from config.config import MAX_JOBS_PER_USER
+from utils import job_queue
+
+
+@pytest.fixture
+def processed(monkeypatch):
+    """Replace the Telegram round trip with a record of what would run"""
+    calls = []
+
+    async def fake_process(operation, file_ids, params, delivery):
+        calls.append((operation, file_ids, params, delivery))
+        return {'operation': operation, 'result': True, 'outputs': 1, 'file_ids': ['result-file-id']}
+
+    monkeypatch.setattr(job_queue, '_process', fake_process)
+    return calls
+
+
+@pytest.fixture
+def eager(monkeypatch):
+    monkeypatch.setattr(job_queue.app.conf, 'task_always_eager', True)
+    monkeypatch.setattr(job_queue.app.conf, 'task_eager_propagates', True)
+
+
+@pytest.fixture(autouse=True)
+def slots(monkeypatch):
+    fresh = job_queue.UserSlots(url='memory://')
+    monkeypatch.setattr(job_queue, 'user_slots', fresh)
+    return fresh
+
+
+def test_submit_queues_on_the_broker(processed):
+    result = job_queue.submit(1, 'trim_video', ['file-a'], {'args': [0, 5]}, {'chat_id': 10})
+
+    assert result.id
+    assert result.state == 'PENDING'
+    # Nothing runs until a worker picks the job up
+    assert processed == []
+
+
+def test_submit_rejects_unknown_operations(processed, slots):
+    with pytest.raises(ValueError):
+        job_queue.submit(1, 'format_disk', ['file-a'])
+    assert slots._local[1] == 0
+
+
+def test_queue_full_after_max_jobs_per_user(processed, slots):
+    for _ in range(MAX_JOBS_PER_USER):
+        job_queue.submit(1, 'extract_thumbnail', ['file-a'])
+
+    with pytest.raises(job_queue.QueueFull):
+        job_queue.submit(1, 'extract_thumbnail', ['file-a'])
+    # The refused job doesn't hold a slot, and other users are unaffected
+    assert slots._local[1] == MAX_JOBS_PER_USER
+    job_queue.submit(2, 'extract_thumbnail', ['file-b'])
+
+
+def test_result_is_delivered_and_slot_released(processed, eager, slots):
+    result = job_queue.submit(1, 'trim_video', ['file-a'], {'args': [0, 5]}, {'chat_id': 10})
+
+    assert result.get(timeout=10) == {
+        'operation': 'trim_video', 'result': True, 'outputs': 1, 'file_ids': ['result-file-id']
+    }
+    assert processed == [('trim_video', ['file-a'], {'args': [0, 5]}, {'chat_id': 10})]
+    assert slots._local[1] == 0
+
+
+def test_slot_released_when_the_job_fails(monkeypatch, eager, slots):
+    async def failing_process(*args):
+        raise RuntimeError("download failed")
+
+    monkeypatch.setattr(job_queue, '_process', failing_process)
+    with pytest.raises(RuntimeError):
+        job_queue.submit(1, 'trim_video', ['file-a'])
+    assert slots._local[1] == 0
+
+
+def test_submit_async_does_not_block_the_loop(monkeypatch):
+    released = threading.Event()
+
+    def slow_submit(*args, **kwargs):
+        # Stands in for a broker round trip that only ends once the loop has moved on
+        assert released.wait(timeout=5)
+        return 'submitted'
+
+    monkeypatch.setattr(job_queue, 'submit', slow_submit)
+
+    async def main():
+        pending = asyncio.ensure_future(job_queue.submit_async(1, 'optimize_video', ['file-a']))
+        await asyncio.sleep(0.05)
+        # Still running on the loop while the submit waits in its thread
+        assert not pending.done()
+        released.set()
+        return await pending
+
+    assert asyncio.run(main()) == 'submitted'
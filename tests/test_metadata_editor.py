@@ -0,0 +1,21 @@
+import asyncio
+
+from utils.metadata_editor import MetadataEditor
+from utils.media_info import MediaInfo, StreamInfo
+
+
+def test_rotation_edit_leaves_out_data_tracks(runner, media, tmp_path):
+    media.info = MediaInfo(path='IMG_0001.mov', streams=[
+        StreamInfo(index=0, codec_type='video', codec_name='hevc'),
+        StreamInfo(index=1, codec_type='audio', codec_name='aac'),
+        StreamInfo(index=2, codec_type='data', codec_name=None),
+        StreamInfo(index=3, codec_type='data', codec_name=None)
+    ])
+    editor = MetadataEditor(runner=runner, media=media)
+
+    assert asyncio.run(editor.write_metadata('IMG_0001.mov', str(tmp_path / 'rotated.mov'), rotation=90))
+
+    args = runner.commands[0]
+    maps = [args[i + 1] for i, arg in enumerate(args) if arg == '-map']
+    assert maps == ['0:0', '0:1']
+    assert args[args.index('-display_rotation:0') + 1] == '270'
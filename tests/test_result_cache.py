@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+from utils.result_cache import ResultCache, normalize_params
+
+
+def test_times_and_numbers_share_a_key():
+    assert ResultCache.key('src', 'trim_video', {'start': '00:01:30', 'end': 100}) == \
+        ResultCache.key('src', 'trim_video', {'start': 90, 'end': '100.0'})
+
+
+def test_enum_params_ignore_case():
+    assert normalize_params({'format': ' MP3 ', 'mode': 'Burn'}) == {'format': 'mp3', 'mode': 'burn'}
+
+
+def test_identifiers_and_names_keep_their_case():
+    lower = {'inputs': ['agadbq'], 'subtitles': ['agadcq'], 'cover': 'agaddq', 'names': ['a.mp4']}
+    upper = {'inputs': ['AgADbQ'], 'subtitles': ['AgADcQ'], 'cover': 'AgADdQ', 'names': ['A.mp4']}
+    for name in lower:
+        assert ResultCache.key('src', 'op', {name: lower[name]}) != ResultCache.key('src', 'op', {name: upper[name]})
+
+
+def test_metadata_edits_differing_in_case_are_distinct():
+    assert ResultCache.key('src', 'edit_metadata', {'edit': {'tags': {'title': 'Holiday'}}}) != \
+        ResultCache.key('src', 'edit_metadata', {'edit': {'tags': {'title': 'holiday'}}})
+
+
+def test_put_keeps_a_copy_and_batches_the_index(tmp_path):
+    cache = ResultCache(cache_dir=str(tmp_path / 'cache'), save_delay=0.05)
+    output = tmp_path / 'output.mp4'
+    output.write_bytes(b'result')
+    key = ResultCache.key('AgADsource', 'optimize_video', {'preset': 'small'})
+
+    async def put():
+        await cache.put(key, ['file-id'], [str(output)])
+        assert not os.path.exists(cache.index_path)
+        await cache._writer.task
+
+    asyncio.run(put())
+    entry = ResultCache(cache_dir=str(tmp_path / 'cache')).get(key)
+    assert entry['file_ids'] == ['file-id']
+    assert [os.path.basename(p) for p in entry['paths']] == ['output.mp4']
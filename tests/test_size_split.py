@@ -0,0 +1,22 @@
+from utils.video_processor import _part_sizes, _size_cut_points
+
+MB = 1000000
+
+# 100 s of 1 MB packets with a keyframe every 10 s
+PACKETS = [(float(t), MB, 0, t % 10 == 0) for t in range(100)]
+KEYFRAMES = [float(t) for t in range(0, 100, 10)]
+
+
+def _sizes(limit):
+    cut_points = _size_cut_points(PACKETS, KEYFRAMES, limit * MB)
+    return [size // MB for size in _part_sizes(PACKETS, cut_points)]
+
+
+def test_every_part_fits_including_the_last():
+    assert _sizes(15) == [10] * 10
+    assert _sizes(35) == [30, 30, 30, 10]
+    assert _sizes(50) == [40, 40, 20]
+
+
+def test_oversized_gops_get_a_part_of_their_own():
+    assert _sizes(5) == [10] * 10
@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+from utils.encode_scheduler import EncodeScheduler
+from utils.file_utils import WorkspaceManager
+from utils.media_info import MediaInfo, StreamInfo
+from utils.video_processor import VideoProcessor, plan_merge
+
+
+def _processor(tmp_path, runner, media):
+    """A processor for a 10 s H.264 video with a keyframe every 2 s"""
+    media.info = MediaInfo(path='input.mp4', duration=10.0, streams=[
+        StreamInfo(index=0, codec_type='video', codec_name='h264', width=1280, height=720,
+                   pix_fmt='yuv420p', fps=30.0),
+        StreamInfo(index=1, codec_type='audio', codec_name='aac')
+    ])
+    media.keyframe_times = [0.0, 2.0, 4.0, 6.0, 8.0]
+    processor = VideoProcessor(
+        runner=runner,
+        media=media,
+        workspaces=WorkspaceManager(root=str(tmp_path / 'work'), watched=(), quota_bytes=0),
+        scheduler=EncodeScheduler(runner=runner, cpus=4)
+    )
+    return processor, str(tmp_path / 'input.mp4')
+
+
+def _option(args, name):
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+
+
+def test_smart_trim_reencodes_partial_gops_and_copies_the_rest(tmp_path, runner, media):
+    processor, source = _processor(tmp_path, runner, media)
+    output = str(tmp_path / 'trimmed.mp4')
+
+    mode = asyncio.run(processor.trim_video(source, output, 1.5, 5.5))
+
+    assert mode == 'smart'
+    assert os.path.exists(output)
+    # Head edge, whole GOPs, tail edge, then the join
+    head, middle, tail, join = runner.commands
+    for edge, start in ((head, '1.5'), (tail, '4.0')):
+        assert _option(edge, '-ss') == [start]
+        assert _option(edge, '-c:v') == ['libx264']
+        assert _option(edge, '-f') == ['mpegts']
+    assert _option(middle, '-c:v') == ['copy']
+    assert _option(middle, '-segment_times') == ['1.999500']
+    assert _option(join, '-c') == ['copy']
+
+
+def test_smart_trim_on_keyframes_only_copies(tmp_path, runner, media):
+    processor, source = _processor(tmp_path, runner, media)
+
+    mode = asyncio.run(processor.trim_video(source, str(tmp_path / 'trimmed.mp4'), 2, 6))
+
+    assert mode == 'copy'
+    assert all('libx264' not in args for args in runner.commands)
+
+
+def test_optimize_without_a_duration_encodes_in_one_go(tmp_path, runner, media):
+    processor, source = _processor(tmp_path, runner, media)
+    processor.media.info.duration = None
+
+    assert asyncio.run(processor.optimize_video(source, str(tmp_path / 'small.mp4'), 'small'))
+    assert len(runner.commands) == 1
+
+
+def test_optimize_failure_returns_false(tmp_path, runner, media):
+    processor, source = _processor(tmp_path, runner, media)
+
+    async def fail(stream, timeout=None, on_stderr=None, limit=True):
+        raise OSError("No space left on device")
+
+    runner.run = fail
+    assert asyncio.run(processor.optimize_video(source, str(tmp_path / 'small.mp4'))) is False
+
+
+def test_merge_target_never_has_an_unknown_frame_rate():
+    def clip(fps, codec='vp9'):
+        return MediaInfo(path='clip.webm', duration=5.0, streams=[
+            StreamInfo(index=0, codec_type='video', codec_name=codec, width=1280, height=720,
+                       pix_fmt='yuv420p', fps=fps)
+        ])
+
+    target, mismatched = plan_merge([clip(None, 'h264'), clip(None)])
+    assert target.fps == 30
+    assert mismatched == [0, 1]
+
+    target, mismatched = plan_merge([clip(None), clip(25.0)])
+    assert target.fps == 25
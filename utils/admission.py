@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from config.config import GLOBAL_COST_BUDGET, USER_COST_RATE, USER_COST_BURST, PROGRESS_EDIT_INTERVAL
+from utils.job_registry import job_registry
+
+logger = logging.getLogger(__name__)
+
+# Relative CPU cost per megapixel-second of input, x264 'medium' = 1.0
+OPERATION_COSTS = {
+    'extract_thumbnail': 0.01,
+    'extract_multiple_thumbnails': 0.05,
+    'take_screenshots': 0.05,
+    # One downscaled decode pass, keyframes only on long videos
+    'smart_thumbnails': 0.05,
+    'split_video_by_time': 0.02,
+    'split_video_by_size': 0.02,
+    'split_video_into_parts': 0.02,
+    'merge_videos': 0.1,
+    # Audio is copied when it can be, and audio encoders are cheap
+    'extract_audio': 0.01,
+    'remove_audio': 0.01,
+    'convert_audio': 0.02,
+    # Archive work scales with bytes, not pixels; these keep it near MIN_COST
+    'bundle_files': 0.01,
+    'create_archive': 0.02,
+    'extract_archive': 0.02,
+    # Smart cuts copy most of the range and encode only the edges
+    'trim_video': 0.3,
+    # Metadata edits rewrite the container around copied streams
+    'edit_metadata': 0.01,
+    # A download and a probe; nothing is decoded
+    'read_metadata': 0.01,
+    # Soft subtitles are stream copied
+    'mux_subtitles': 0.02,
+    'add_subtitles': 1.0,
+    'optimize_video': 1.0
+}
+
+# Multipliers for the presets handlers pass (optimize names and x264 names)
+PRESET_COSTS = {
+    'small': 0.6, 'balanced': 1.0, 'high': 2.0,
+    'veryfast': 0.4, 'faster': 0.5, 'fast': 0.6, 'medium': 1.0, 'slow': 2.0, 'slower': 3.0
+}
+
+# Assumed when an upload's resolution or duration is unknown
+DEFAULT_PIXELS = 1280 * 720
+DEFAULT_DURATION = 60
+MIN_COST = 1.0
+
+
+def estimate_cost(operation, duration=None, width=None, height=None, preset=None):
+    """Cost units of a request: duration x megapixels x operation x preset"""
+    pixels = width * height if width and height else DEFAULT_PIXELS
+    seconds = duration or DEFAULT_DURATION
+    cost = (
+        seconds * pixels / 1000000
+        * OPERATION_COSTS.get(operation, 1.0)
+        * PRESET_COSTS.get(preset, 1.0)
+    )
+    return max(MIN_COST, cost)
+
+
+class RateLimited(Exception):
+    """Raised when a user's token bucket can't cover a request yet"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills `rate` units per second up to `capacity`"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, cost):
+        """Take cost tokens if the bucket can cover it
+
+        A request bigger than the whole bucket is let through once the
+        bucket is full and leaves it in debt, so it still gets served but
+        pays for it afterwards.
+        """
+        self._refill()
+        if self.tokens < min(cost, self.capacity):
+            return False
+        self.tokens -= cost
+        return True
+
+    def refund(self, cost):
+        """Give back tokens taken for a request that was then refused"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def wait_time(self, cost):
+        self._refill()
+        missing = min(cost, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if self.rate else float('inf')
+
+    @property
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _Waiter:
+    def __init__(self, user_id, cost, seq, future, on_queued):
+        self.user_id = user_id
+        self.cost = cost
+        self.seq = seq
+        self.future = future
+        self.on_queued = on_queued
+        self.position = None
+        # Last position on_queued was called with, and the task calling it
+        self.reported = None
+        self.reporter = None
+
+
+class AdmissionController:
+    """Rate limits each user and caps the total cost of work in flight.
+
+    Each user has a token bucket refilled over time; a request it can't
+    cover is refused with a retry time. Admitted requests then share a
+    global budget of in-flight cost. When that is spent they wait, and the
+    next one admitted is from the user with the least work already
+    running, so a heavy user can't crowd everyone else out.
+
+    Queue position updates go through the same edit rate limiter as job
+    progress, and moves that come faster than edit_interval are merged
+    into one update per waiter.
+    """
+
+    def __init__(self, budget=GLOBAL_COST_BUDGET, user_rate=USER_COST_RATE, user_burst=USER_COST_BURST,
+                 limiter=None, edit_interval=PROGRESS_EDIT_INTERVAL):
+        self.budget = budget
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.limiter = limiter or job_registry.limiter
+        self.edit_interval = edit_interval
+        self.in_flight = 0.0
+        self._user_in_flight = {}
+        self._buckets = {}
+        self._waiters = []
+        self._seq = 0
+
+    def check_rate(self, user_id, cost):
+        """Charge a request to the user's bucket or raise RateLimited"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_burst, self.user_rate)
+        if not bucket.try_take(cost):
+            raise RateLimited(bucket.wait_time(cost))
+        self._prune_buckets()
+
+    def refund(self, user_id, cost):
+        """Return what check_rate charged for a request that was refused afterwards"""
+        bucket = self._buckets.get(user_id)
+        if bucket is not None:
+            bucket.refund(cost)
+
+    def queue_length(self):
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def admit(self, user_id, cost, on_queued=None):
+        """Hold `cost` of the global budget for the block, waiting if needed
+
+        on_queued: coroutine function called with the 1-based queue position
+                   when the request has to wait, and again as it moves up
+        """
+        cost = min(cost, self.budget)
+        if not self._waiters and self._fits(cost):
+            self._start(user_id, cost)
+        else:
+            self._seq += 1
+            waiter = _Waiter(user_id, cost, self._seq, asyncio.get_running_loop().create_future(), on_queued)
+            self._waiters.append(waiter)
+            # Fair share may put a light user's request ahead, and it may fit now
+            self._dispatch()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    self._notify_positions()
+                elif waiter.future.done() and not waiter.future.cancelled():
+                    # Admitted just as we were cancelled
+                    self._finish(user_id, cost)
+                    self._dispatch()
+                raise
+
+        try:
+            yield
+        finally:
+            self._finish(user_id, cost)
+            self._dispatch()
+
+    def _fits(self, cost):
+        return self.in_flight == 0 or self.in_flight + cost <= self.budget
+
+    def _start(self, user_id, cost):
+        self.in_flight += cost
+        self._user_in_flight[user_id] = self._user_in_flight.get(user_id, 0) + cost
+
+    def _finish(self, user_id, cost):
+        self.in_flight = max(0.0, self.in_flight - cost)
+        remaining = self._user_in_flight.get(user_id, 0) - cost
+        if remaining > 1e-9:
+            self._user_in_flight[user_id] = remaining
+        else:
+            self._user_in_flight.pop(user_id, None)
+
+    def _ordered(self):
+        # Fair share: least work in flight first, then arrival order
+        return sorted(self._waiters, key=lambda w: (self._user_in_flight.get(w.user_id, 0), w.seq))
+
+    def _dispatch(self):
+        while self._waiters:
+            head = self._ordered()[0]
+            # Nothing jumps the head, or big requests would never run
+            if not self._fits(head.cost):
+                break
+            self._waiters.remove(head)
+            self._start(head.user_id, head.cost)
+            head.future.set_result(True)
+        self._notify_positions()
+
+    def _notify_positions(self):
+        for position, waiter in enumerate(self._ordered(), 1):
+            waiter.position = position
+            if waiter.on_queued is None or waiter.reported == position or waiter.reporter is not None:
+                continue
+            waiter.reporter = asyncio.ensure_future(self._report(waiter))
+
+    async def _report(self, waiter):
+        """Call on_queued with the waiter's latest position until it is current"""
+        try:
+            while True:
+                await self.limiter.wait()
+                # Admitted meanwhile: the status message now shows job progress
+                if waiter not in self._waiters or waiter.reported == waiter.position:
+                    return
+                position = waiter.position
+                try:
+                    await waiter.on_queued(position)
+                except Exception as e:
+                    logger.debug("Queue position update failed: %s", e)
+                waiter.reported = position
+                await asyncio.sleep(self.edit_interval)
+        finally:
+            waiter.reporter = None
+
+    def _prune_buckets(self):
+        # Full buckets carry no state, so idle users don't accumulate
+        if len(self._buckets) > 1000:
+            for user_id in [u for u, b in self._buckets.items() if b.full]:
+                del self._buckets[user_id]
+
+
+# Global instance
+admission = AdmissionController()
@@ -0,0 +1,424 @@
+"""Create and extract zip, 7z, tar and rar archives.
+
+Members are copied through fixed-size buffers in both directions, so
+memory use doesn't grow with archive or member size. Extraction checks
+member count, unpacked size and compression ratio from the headers before
+anything is written, then counts zip, tar and rar members again while
+writing them, as headers can lie. py7zr never writes more of a 7z member
+than its header size, so for 7z the header check is the cap. Paths that
+would land outside the output directory are refused. The blocking work
+runs in a thread off the event loop.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import zipfile
+import zlib
+
+from config.config import (
+    ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_UNPACKED_SIZE, ARCHIVE_MAX_RATIO, ARCHIVE_COMPRESS_LEVEL
+)
+from utils.encode_scheduler import available_cpus
+from utils.metrics import record_failure
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# Formats already compressed; deflating them again only burns CPU
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.mp4', '.mkv', '.mov', '.webm', '.avi', '.flv', '.wmv', '.m4v', '.ts',
+    '.mp3', '.aac', '.m4a', '.opus', '.ogg', '.flac', '.wma',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.zip', '.7z', '.rar', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.apk', '.docx', '.xlsx', '.pptx', '.pdf'
+}
+
+# Sampled from files with other extensions to judge compressibility
+SAMPLE_SIZE = 256 * 1024
+# Stored when a fast deflate of the sample saves less than this fraction
+MIN_SAVING = 0.05
+
+# Archives are allowed to unpack to at least ARCHIVE_MAX_RATIO times this,
+# so small archives of very compressible text aren't refused
+RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+# Magic bytes -> format, checked in order
+MAGIC = [
+    (0, b'PK\x03\x04', 'zip'),
+    (0, b'PK\x05\x06', 'zip'),
+    (0, b"7z\xbc\xaf\x27\x1c", '7z'),
+    (0, b'Rar!\x1a\x07', 'rar'),
+    (0, b'\x1f\x8b', 'tar'),
+    (0, b'BZh', 'tar'),
+    (0, b'\xfd7zXZ\x00', 'tar'),
+    (257, b'ustar', 'tar')
+]
+
+# Formats create_archive() can write, as output file extensions
+CREATE_FORMATS = {
+    'zip': '.zip',
+    '7z': '.7z',
+    'tar.gz': '.tar.gz'
+}
+
+
+class ArchiveError(Exception):
+    """Raised for an archive that can't be read or written"""
+
+
+class ArchiveLimitExceeded(ArchiveError):
+    """Raised when an archive unpacks to more than the configured limits"""
+
+
+def detect_format(path):
+    """'zip', '7z', 'tar' or 'rar' from the file's magic bytes, or None"""
+    with open(path, 'rb') as f:
+        head = f.read(512)
+    for offset, magic, fmt in MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return fmt
+    return None
+
+
+def is_compressible(path, name=None):
+    """Whether deflating path is likely to be worth the CPU
+
+    name: the file's real name, when path is a workspace copy named otherwise
+    """
+    if os.path.splitext(name or path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if len(sample) < 512:
+        return True
+    return len(zlib.compress(sample, 1)) < len(sample) * (1 - MIN_SAVING)
+
+
+def safe_member_path(output_dir, name):
+    """Where a member named `name` may be written, or None if it would escape"""
+    parts = [p for p in name.replace('\\', '/').split('/') if p not in ('', '.')]
+    if not parts or '..' in parts or ':' in parts[0]:
+        return None
+    path = os.path.join(output_dir, *parts)
+    root = os.path.realpath(output_dir)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        return None
+    return path
+
+
+class _Budget:
+    """Counts what extraction writes against the limits"""
+
+    def __init__(self, archive_size, max_members, max_bytes, max_ratio, cancelled):
+        self.max_members = max_members
+        self.max_bytes = min(max_bytes, max(archive_size, RATIO_CHECK_MIN_BYTES) * max_ratio)
+        self.members = 0
+        self.bytes = 0
+        self.cancelled = cancelled
+
+    def check_declared(self, sizes):
+        """Refuse up front from header sizes, before anything is written"""
+        if len(sizes) > self.max_members:
+            raise ArchiveLimitExceeded(f"Archive has {len(sizes)} files; the limit is {self.max_members}")
+        if sum(sizes) > self.max_bytes:
+            raise ArchiveLimitExceeded(f"Archive unpacks to {sum(sizes)} bytes; the limit is {self.max_bytes}")
+
+    def add_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise ArchiveLimitExceeded(f"Archive has more than {self.max_members} files")
+
+    def add_bytes(self, count):
+        if self.cancelled.is_set():
+            raise ArchiveError("Cancelled")
+        self.bytes += count
+        # Headers can lie; what actually comes out is what counts
+        if self.bytes > self.max_bytes:
+            raise ArchiveLimitExceeded(f"Archive unpacks to more than {self.max_bytes} bytes")
+
+
+def _copy(source, target, budget):
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        budget.add_bytes(len(chunk))
+        target.write(chunk)
+
+
+class ArchiveProcessor:
+    def __init__(self, max_members=ARCHIVE_MAX_MEMBERS, max_unpacked=ARCHIVE_MAX_UNPACKED_SIZE,
+                 max_ratio=ARCHIVE_MAX_RATIO, level=ARCHIVE_COMPRESS_LEVEL):
+        self.max_members = max_members
+        self.max_unpacked = max_unpacked
+        self.max_ratio = max_ratio
+        self.level = level
+
+    async def create_archive(self, paths, output_path, fmt='zip', names=None, compress=True):
+        """Pack files into a zip, 7z or tar.gz archive
+
+        names: names inside the archive, defaulting to the files' basenames
+        compress: False stores every member as is (a quick bundle)
+        Members that are already compressed are stored either way.
+        """
+        names = names or [os.path.basename(p) for p in paths]
+        cancelled = threading.Event()
+        try:
+            await _in_thread(cancelled, self._create, cancelled, paths, output_path, fmt, _unique(names), compress)
+            return True
+        except Exception as e:
+            record_failure('create_archive', "Error creating archive", e)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return False
+
+    async def extract_archive(self, archive_path, output_dir):
+        """Unpack an archive into output_dir and return the extracted file paths
+
+        Raises ArchiveError for an unknown format or an archive over the
+        limits; other failures are logged and return [].
+        """
+        fmt = detect_format(archive_path)
+        if fmt is None:
+            raise ArchiveError("Not a zip, 7z, tar or rar archive")
+        budget = _Budget(
+            os.path.getsize(archive_path), self.max_members, self.max_unpacked,
+            self.max_ratio, threading.Event()
+        )
+        extract = {
+            'zip': self._extract_zip,
+            '7z': self._extract_7z,
+            'tar': self._extract_tar,
+            'rar': self._extract_rar
+        }[fmt]
+        try:
+            return await _in_thread(budget.cancelled, extract, archive_path, output_dir, budget)
+        except ArchiveError:
+            raise
+        except Exception as e:
+            record_failure('extract_archive', "Error extracting archive", e)
+            return []
+
+    # Creation
+
+    def _create(self, cancelled, paths, output_path, fmt, names, compress):
+        members = list(zip(paths, names))
+        if fmt == 'zip':
+            self._create_zip(members, output_path, compress, cancelled)
+        elif fmt == '7z':
+            self._create_7z(members, output_path, compress)
+        elif fmt == 'tar.gz':
+            self._create_tar_gz(members, output_path, compress, cancelled)
+        else:
+            raise ArchiveError(f"Can't create {fmt} archives")
+
+    def _create_zip(self, members, output_path, compress, cancelled):
+        with zipfile.ZipFile(output_path, 'w', allowZip64=True) as archive:
+            for path, name in members:
+                if cancelled.is_set():
+                    raise ArchiveError("Cancelled")
+                # write() streams the file in small blocks
+                if compress and is_compressible(path, name):
+                    archive.write(path, name, zipfile.ZIP_DEFLATED, self.level)
+                else:
+                    archive.write(path, name, zipfile.ZIP_STORED)
+
+    def _create_7z(self, members, output_path, compress):
+        import py7zr
+
+        # A 7z filter chain covers the whole archive, so the choice is made
+        # by where most of the bytes are
+        sizes = [(os.path.getsize(p), compress and is_compressible(p, n)) for p, n in members]
+        compressible = sum(size for size, worth in sizes if worth)
+        if compressible * 2 >= sum(size for size, _ in sizes) and compress:
+            filters = [{'id': py7zr.FILTER_LZMA2, 'preset': min(self.level, 6)}]
+        else:
+            filters = [{'id': py7zr.FILTER_COPY}]
+        with py7zr.SevenZipFile(output_path, 'w', filters=filters) as archive:
+            for path, name in members:
+                archive.write(path, name)
+
+    def _create_tar_gz(self, members, output_path, compress, cancelled):
+        compressible = compress and any(is_compressible(p, n) for p, n in members)
+        # gzip can't store some members and deflate others; level 1 costs
+        # little on data that won't shrink
+        level = self.level if compressible else 1
+        pigz = shutil.which('pigz')
+        with open(output_path, 'wb') as output:
+            if pigz:
+                # pigz deflates blocks on every core
+                process = subprocess.Popen(
+                    [pigz, f'-{level}', '-p', str(available_cpus()), '-c'],
+                    stdin=subprocess.PIPE, stdout=output
+                )
+                try:
+                    with tarfile.open(fileobj=process.stdin, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+                        self._add_to_tar(archive, members, cancelled)
+                finally:
+                    process.stdin.close()
+                    if process.wait() != 0:
+                        raise ArchiveError(f"pigz exited with {process.returncode}")
+            else:
+                with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=level) as compressed, \
+                        tarfile.open(fileobj=compressed, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+                    self._add_to_tar(archive, members, cancelled)
+
+    def _add_to_tar(self, archive, members, cancelled):
+        for path, name in members:
+            if cancelled.is_set():
+                raise ArchiveError("Cancelled")
+            info = archive.gettarinfo(path, name)
+            with open(path, 'rb') as f:
+                archive.addfile(info, f)
+
+    # Extraction
+
+    def _extract_zip(self, archive_path, output_dir, budget):
+        extracted = []
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [m for m in archive.infolist() if not m.is_dir()]
+            budget.check_declared([m.file_size for m in members])
+            for member in members:
+                target = safe_member_path(output_dir, member.filename)
+                if target is None:
+                    logger.warning("Skipping unsafe archive member %r", member.filename)
+                    continue
+                budget.add_member()
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with archive.open(member) as source, open(target, 'wb') as out:
+                    _copy(source, out, budget)
+                extracted.append(target)
+        return extracted
+
+    def _extract_tar(self, archive_path, output_dir, budget):
+        extracted = []
+        # Stream mode reads the (possibly compressed) archive front to back once
+        with tarfile.open(archive_path, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile():
+                    # Links, devices and fifos are never extracted
+                    continue
+                target = safe_member_path(output_dir, member.name)
+                if target is None:
+                    logger.warning("Skipping unsafe archive member %r", member.name)
+                    continue
+                budget.add_member()
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                source = archive.extractfile(member)
+                with open(target, 'wb') as out:
+                    _copy(source, out, budget)
+                extracted.append(target)
+        return extracted
+
+    def _extract_7z(self, archive_path, output_dir, budget):
+        import py7zr
+
+        with py7zr.SevenZipFile(archive_path) as archive:
+            members = [m for m in archive.list() if not m.is_directory]
+            budget.check_declared([m.uncompressed or 0 for m in members])
+            names = []
+            for member in members:
+                if safe_member_path(output_dir, member.filename) is None:
+                    logger.warning("Skipping unsafe archive member %r", member.filename)
+                    continue
+                budget.add_member()
+                names.append(member.filename)
+            # py7zr decompresses folder by folder straight to disk, each
+            # member only up to its header size, which check_declared capped
+            archive.extract(path=output_dir, targets=names)
+        return self._collect(output_dir, names, budget)
+
+    def _extract_rar(self, archive_path, output_dir, budget):
+        # RAR has no free library; 7-Zip's binary reads it when installed
+        seven_zip = shutil.which('7z') or shutil.which('7zz')
+        if seven_zip is None:
+            raise ArchiveError("RAR extraction isn't available on this server")
+        listing = subprocess.run(
+            [seven_zip, 'l', '-slt', '-ba', archive_path],
+            capture_output=True, text=True, check=True
+        ).stdout
+        members, current = [], {}
+        for line in listing.splitlines() + ['']:
+            if not line.strip():
+                if current.get('Path') and 'D' not in current.get('Attributes', ''):
+                    members.append((current['Path'], int(current.get('Size') or 0)))
+                current = {}
+            elif ' = ' in line:
+                key, _, value = line.partition(' = ')
+                current[key] = value
+        budget.check_declared([size for _, size in members])
+        extracted = []
+        for name, _ in members:
+            target = safe_member_path(output_dir, name)
+            if target is None:
+                logger.warning("Skipping unsafe archive member %r", name)
+                continue
+            budget.add_member()
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # One member at a time through stdout, so every byte passes the budget
+            with open(target, 'wb') as out, subprocess.Popen(
+                [seven_zip, 'x', '-so', '-spd', '--', archive_path, name],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            ) as process:
+                try:
+                    _copy(process.stdout, out, budget)
+                except BaseException:
+                    process.kill()
+                    raise
+            if process.returncode != 0:
+                raise ArchiveError(f"7z exited with {process.returncode}")
+            extracted.append(target)
+        return extracted
+
+    def _collect(self, output_dir, names, budget):
+        """Extracted files that exist, with their real sizes counted"""
+        extracted = []
+        for name in names:
+            path = safe_member_path(output_dir, name)
+            if path and os.path.isfile(path) and not os.path.islink(path):
+                budget.add_bytes(os.path.getsize(path))
+                extracted.append(path)
+        return extracted
+
+
+def _unique(names):
+    """Archive member names with repeats numbered, so nothing is overwritten"""
+    seen, result = set(), []
+    for name in names:
+        stem, extension = os.path.splitext(name)
+        unique, n = name, 1
+        while unique in seen:
+            n += 1
+            unique = f"{stem}_{n}{extension}"
+        seen.add(unique)
+        result.append(unique)
+    return result
+
+
+async def _in_thread(cancelled, function, *args):
+    """Run function(*args) in a thread, setting `cancelled` if we're cancelled"""
+    task = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The thread checks the event between chunks; wait so no files are
+        # still being written when the workspace is removed
+        cancelled.set()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+
+
+# Global instance
+archive_processor = ArchiveProcessor()
+
+# Convenience functions
+async def create_archive(*args, **kwargs):
+    return await archive_processor.create_archive(*args, **kwargs)
+
+async def extract_archive(*args, **kwargs):
+    return await archive_processor.extract_archive(*args, **kwargs)
@@ -0,0 +1,210 @@
+import asyncio
+import os
+from dataclasses import dataclass, field
+import ffmpeg
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.job_registry import current_job
+from utils.metrics import record_failure
+from utils.media_info import media_info
+from utils.encode_scheduler import encode_scheduler
+from utils.video_processor import _subtitle_codec
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """An output audio container and what it can hold without transcoding"""
+    extension: str
+    # ffprobe codec names that can be stream copied in; None takes any codec
+    codecs: tuple
+    encoder: str
+    options: dict = field(default_factory=dict)
+    lossless: bool = False
+
+AUDIO_FORMATS = {
+    'mp3': AudioFormat('.mp3', ('mp3',), 'libmp3lame', {'q:a': 2}),
+    'm4a': AudioFormat('.m4a', ('aac', 'alac'), 'aac', {'b:a': '192k'}),
+    'aac': AudioFormat('.aac', ('aac',), 'aac', {'b:a': '192k'}),
+    'opus': AudioFormat('.opus', ('opus',), 'libopus', {'b:a': '128k'}),
+    'ogg': AudioFormat('.ogg', ('vorbis', 'opus', 'flac'), 'libvorbis', {'q:a': 5}),
+    'flac': AudioFormat('.flac', ('flac',), 'flac', lossless=True),
+    'wav': AudioFormat('.wav', ('pcm_s16le', 'pcm_s24le', 'pcm_s32le', 'pcm_f32le', 'pcm_u8'), 'pcm_s16le', lossless=True),
+    # Matroska audio holds anything, for codecs none of the above take
+    'mka': AudioFormat('.mka', None, 'flac', lossless=True)
+}
+
+# The format that keeps each source codec as it is
+NATIVE_FORMATS = {
+    'mp3': 'mp3',
+    'aac': 'm4a',
+    'alac': 'm4a',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+    'flac': 'flac'
+}
+
+def native_format(codec_name):
+    """Format name to stream copy codec_name into"""
+    if codec_name in NATIVE_FORMATS:
+        return NATIVE_FORMATS[codec_name]
+    if codec_name and codec_name in AUDIO_FORMATS['wav'].codecs:
+        return 'wav'
+    return 'mka'
+
+def can_copy(codec_name, audio_format):
+    return audio_format.codecs is None or codec_name in audio_format.codecs
+
+class AudioProcessor:
+    """Audio extraction, conversion and removal.
+
+    Whenever the source codec fits the target container the audio is stream
+    copied, so most requests cost a read and a write rather than an encode.
+    """
+
+    def __init__(self, runner=None, media=None, scheduler=None):
+        self.runner = runner or ffmpeg_runner
+        self.media = media or media_info
+        self.scheduler = scheduler or encode_scheduler
+
+    async def extract_audio(self, input_path, output_dir, fmt=None, bitrate=None, name='audio', track=0):
+        """Write one audio track of a video or audio file to its own file
+
+        fmt: key of AUDIO_FORMATS, or None to keep the source codec
+        bitrate: e.g. '128k'; forces a transcode for lossy formats
+        Returns the output path, or None on failure.
+        """
+        try:
+            return await self._extract(input_path, output_dir, fmt, bitrate, name, track)
+        except Exception as e:
+            record_failure('extract_audio', "Error extracting audio", e)
+            return None
+
+    async def convert_audio(self, input_paths, output_dir, fmt, bitrate=None, names=None):
+        """Convert several files, running transcodes in parallel
+
+        The batch takes one encode slot; the scheduler's thread share for
+        it is how many single-threaded audio encoders run at once. Files
+        that only need a stream copy skip the slot entirely.
+        Returns the output path per input, None where it failed.
+        """
+        names = names or [os.path.splitext(os.path.basename(p))[0] for p in input_paths]
+        try:
+            infos = await asyncio.gather(*(self.media.get(p) for p in input_paths))
+        except Exception as e:
+            record_failure('convert_audio', "Error reading audio", e)
+            return [None] * len(input_paths)
+
+        results = [None] * len(input_paths)
+        # Names are de-duplicated so two inputs never write the same file
+        used = set()
+        jobs = []
+        for index, (path, info, name) in enumerate(zip(input_paths, infos, names)):
+            unique, n = name, 1
+            while unique in used:
+                n += 1
+                unique = f"{name}_{n}"
+            used.add(unique)
+            jobs.append((index, path, info, unique))
+
+        copies, encodes = [], []
+        for j in jobs:
+            try:
+                (copies if self._plan(j[2], fmt, bitrate)[1] else encodes).append(j)
+            except ValueError as e:
+                record_failure('convert_audio', f"Can't convert {os.path.basename(j[1])}", e)
+        job = current_job.get()
+
+        async def convert(index, path, info, name, limit):
+            if job is not None:
+                current_job.set(job.part(index))
+            try:
+                results[index] = await self._extract(path, output_dir, fmt, bitrate, name, 0, info, limit)
+            except Exception as e:
+                record_failure('convert_audio', f"Error converting {os.path.basename(path)}", e)
+
+        await asyncio.gather(*(convert(*j, True) for j in copies))
+        if encodes:
+            audio_format = AUDIO_FORMATS[fmt]
+            async with self.scheduler.encode(audio_format.encoder, None) as settings:
+                pool = asyncio.Semaphore(settings.threads)
+
+                async def pooled(*args):
+                    async with pool:
+                        await convert(*args)
+
+                await asyncio.gather(*(pooled(*j, False) for j in encodes))
+        return results
+
+    async def remove_audio(self, video_path, output_path):
+        """Copy the video and subtitle streams, leaving the audio out
+
+        Subtitles are converted where the output container needs it (SRT
+        to mov_text for MP4) and dropped where it can't hold them at all.
+        """
+        try:
+            info = await self.media.get(video_path)
+            source = ffmpeg.input(video_path)
+            streams = [source['v?']]
+            options = {'c': 'copy'}
+            for stream in info.subtitle_streams:
+                codec = _subtitle_codec(stream.codec_name, output_path)
+                if codec:
+                    options[f'c:s:{len(streams) - 1}'] = codec
+                    streams.append(source[str(stream.index)])
+            stream = ffmpeg.output(*streams, output_path, **options).overwrite_output()
+            await self.runner.run(stream)
+            return True
+        except Exception as e:
+            record_failure('remove_audio', "Error removing audio", e)
+            return False
+
+    def _plan(self, info, fmt, bitrate, track=0):
+        """(stream, copy?, AudioFormat) for writing one audio track"""
+        streams = info.audio_streams
+        if not streams:
+            raise ValueError("No audio stream")
+        stream = streams[min(track, len(streams) - 1)]
+        audio_format = AUDIO_FORMATS[fmt or native_format(stream.codec_name)]
+        copy = can_copy(stream.codec_name, audio_format) and (bitrate is None or audio_format.lossless)
+        return stream, copy, audio_format
+
+    async def _extract(self, input_path, output_dir, fmt, bitrate, name, track, info=None, limit=True):
+        info = info or await self.media.get(input_path)
+        stream, copy, audio_format = self._plan(info, fmt, bitrate, track)
+        output_path = os.path.join(output_dir, name + audio_format.extension)
+
+        options = {'map': f'0:{stream.index}'}
+        if copy:
+            options['c:a'] = 'copy'
+        else:
+            options['c:a'] = audio_format.encoder
+            options.update(audio_format.options)
+            if bitrate and not audio_format.lossless:
+                options.pop('q:a', None)
+                options['b:a'] = bitrate
+        if audio_format.extension == '.m4a':
+            options['movflags'] = '+faststart'
+
+        stream = (
+            ffmpeg
+            .input(input_path)
+            .output(output_path, **options)
+            .overwrite_output()
+        )
+        if copy or not limit:
+            await self.runner.run(stream, limit=limit)
+        else:
+            async with self.scheduler.encode(audio_format.encoder, None):
+                await self.runner.run(stream, limit=False)
+        return output_path
+
+# Global instance
+audio_processor = AudioProcessor()
+
+# Convenience functions
+async def extract_audio(*args, **kwargs):
+    return await audio_processor.extract_audio(*args, **kwargs)
+
+async def convert_audio(*args, **kwargs):
+    return await audio_processor.convert_audio(*args, **kwargs)
+
+async def remove_audio(*args, **kwargs):
+    return await audio_processor.remove_audio(*args, **kwargs)
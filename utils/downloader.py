@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import struct
+
+import aiofiles
+import httpx
+
+from config.config import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_STALL_TIMEOUT
+from utils.file_registry import file_registry, link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Bytes needed before the container layout can be judged
+HEAD_BYTES = 256 * 1024
+
+# MPEG-TS packets are 188 bytes, each starting with this sync byte
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+TS_SYNC_PACKETS = 5
+
+# Absolute path -> StreamingDownload, for files still being written
+active_downloads = {}
+
+
+def is_growing(path):
+    """True while path is still being downloaded"""
+    download = active_downloads.get(os.path.abspath(path))
+    return download is not None and not download.finished.is_set()
+
+
+def growing_download(path):
+    """The StreamingDownload still writing path, or None"""
+    download = active_downloads.get(os.path.abspath(path))
+    if download is None or download.finished.is_set():
+        return None
+    return download
+
+
+class DownloadIncomplete(IOError):
+    """Raised when a download fed to a reader ends before the whole file arrived"""
+
+
+def _is_mpegts(head):
+    """Sync bytes at the start of several consecutive 188-byte packets"""
+    offsets = range(0, TS_PACKET_SIZE * TS_SYNC_PACKETS, TS_PACKET_SIZE)
+    return len(head) > offsets[-1] and all(head[i] == TS_SYNC_BYTE for i in offsets)
+
+
+def head_is_streamable(head):
+    """Whether ffmpeg can open a container from its first bytes alone
+
+    MP4/MOV qualifies only when 'moov' comes before 'mdat' (faststart);
+    Matroska/WebM and MPEG-TS always do.
+    """
+    if head[:4] == b'\x1a\x45\xdf\xa3' or _is_mpegts(head):
+        return True
+    if head[4:8] != b'ftyp':
+        return False
+
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack('>I4s', head[offset:offset + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                return False
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+class StreamingDownload:
+    """Download a Telegram file to disk in bounded chunks.
+
+    The file is readable while it grows: consumers can wait for the head
+    and start ffmpeg long before the last byte arrives. The runner pipes
+    a growing input in through feed(), so ffmpeg sees a real end of file
+    the moment the download completes.
+    """
+
+    def __init__(self, source, path, total=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.source = source
+        self.path = os.path.abspath(path)
+        self.total = total
+        self.chunk_size = chunk_size
+        self.bytes_done = 0
+        self.finished = asyncio.Event()
+        self.task = None
+        self._progress = asyncio.Condition()
+
+    async def start(self):
+        # Create the file up front so readers can open it immediately
+        async with aiofiles.open(self.path, 'wb'):
+            pass
+        active_downloads[self.path] = self
+        self.task = asyncio.ensure_future(self._run())
+        return self
+
+    async def wait(self):
+        """Wait for the whole file"""
+        await self.task
+
+    async def wait_for_head(self):
+        """Wait until processing can start; returns True if it may start early"""
+        async with self._progress:
+            await self._progress.wait_for(
+                lambda: self.bytes_done >= HEAD_BYTES or self.finished.is_set()
+            )
+        if self.task.done():
+            self.task.result()
+            return True
+
+        async with aiofiles.open(self.path, 'rb') as f:
+            head = await f.read(HEAD_BYTES)
+        if head_is_streamable(head):
+            return True
+        await self.wait()
+        return False
+
+    async def feed(self, writer, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Copy the file into writer as it arrives, closing writer at the end
+
+        Returns early when the reader goes away; raises DownloadIncomplete
+        when the download fails part way, so a reader that took the
+        truncated data for the whole file isn't trusted.
+        """
+        position = 0
+        try:
+            async with aiofiles.open(self.path, 'rb') as f:
+                while True:
+                    # Checked before reading, so the read sees every byte once finished
+                    finished = self.finished.is_set()
+                    chunk = await f.read(chunk_size)
+                    if chunk:
+                        writer.write(chunk)
+                        await writer.drain()
+                        position += len(chunk)
+                        continue
+                    if finished:
+                        break
+                    async with self._progress:
+                        await self._progress.wait_for(
+                            lambda: self.bytes_done > position or self.finished.is_set()
+                        )
+        except (BrokenPipeError, ConnectionResetError):
+            # The reader had all it needed
+            return
+        finally:
+            writer.close()
+        # finished is set just before the task itself ends
+        await asyncio.wait([self.task])
+        if not self.complete:
+            raise DownloadIncomplete(f"Download of {self.path} ended after {position} bytes")
+
+    @property
+    def complete(self):
+        """True once the whole file arrived"""
+        return (
+            self.task is not None and self.task.done() and not self.task.cancelled()
+            and self.task.exception() is None
+        )
+
+    async def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self):
+        try:
+            if os.path.isabs(self.source) and os.path.exists(self.source):
+                # Local Bot API server or registry copy: the file is already on this disk
+                await asyncio.get_running_loop().run_in_executor(
+                    None, link_or_copy, self.source, self.path
+                )
+                await self._advance(os.path.getsize(self.path))
+                return
+
+            async with httpx.AsyncClient(timeout=httpx.Timeout(DOWNLOAD_STALL_TIMEOUT)) as client:
+                async with client.stream('GET', self.source) as response:
+                    response.raise_for_status()
+                    async with aiofiles.open(self.path, 'wb') as f:
+                        async for chunk in response.aiter_bytes(self.chunk_size):
+                            await f.write(chunk)
+                            await f.flush()
+                            await self._advance(len(chunk))
+        finally:
+            self.finished.set()
+            active_downloads.pop(self.path, None)
+            async with self._progress:
+                self._progress.notify_all()
+
+    async def _advance(self, size):
+        async with self._progress:
+            self.bytes_done += size
+            self._progress.notify_all()
+
+
+async def start_download(bot, file_id, path, total=None, file_unique_id=None):
+    """Resolve a Telegram file_id and start streaming it to path
+
+    A file the registry already holds locally is linked in instead.
+    """
+    local = file_registry.source_path(file_unique_id) if file_unique_id else None
+    if local:
+        download = StreamingDownload(os.path.abspath(local), path, os.path.getsize(local))
+        return await download.start()
+    telegram_file = await bot.get_file(file_id)
+    download = StreamingDownload(telegram_file.file_path, path, total or telegram_file.file_size)
+    return await download.start()
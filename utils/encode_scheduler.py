@@ -0,0 +1,147 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+
+import psutil
+
+from config.config import ENCODE_CPU_COUNT, PRESET_DEGRADE_QUEUE_DEPTH, MAX_PRESET_DEGRADE
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.job_registry import current_job
+from utils.metrics import phase_seconds, job_operation
+
+logger = logging.getLogger(__name__)
+
+# x264/x265 presets, slowest first
+PRESETS = [
+    'veryslow', 'slower', 'slow', 'medium', 'fast',
+    'faster', 'veryfast', 'superfast', 'ultrafast'
+]
+
+# Degrading never goes past this; below it quality per bit drops sharply
+FASTEST_DEGRADED_PRESET = 'veryfast'
+
+
+def available_cpus():
+    """Cores this process may run on (respects affinity masks and cpusets)"""
+    if ENCODE_CPU_COUNT > 0:
+        return ENCODE_CPU_COUNT
+    try:
+        return len(psutil.Process().cpu_affinity()) or 1
+    except (AttributeError, psutil.Error):
+        # cpu_affinity() is not available on every platform
+        return psutil.cpu_count(logical=True) or 1
+
+
+def degrade_preset(preset, steps):
+    """Move a preset `steps` positions towards faster, stopping at the floor"""
+    if preset not in PRESETS or steps <= 0:
+        return preset
+    floor = PRESETS.index(FASTEST_DEGRADED_PRESET)
+    index = PRESETS.index(preset)
+    return PRESETS[max(index, min(index + steps, floor))]
+
+
+@dataclass
+class EncodeSettings:
+    """Encoder settings chosen for one encode"""
+    encoder: str
+    preset: str
+    requested_preset: str
+    threads: int
+    queue_depth: int = 0
+
+    @property
+    def degraded(self):
+        return self.preset != self.requested_preset
+
+    def with_threads(self, threads):
+        """The same settings for a process given `threads` threads"""
+        return replace(self, threads=threads)
+
+    def output_options(self):
+        """ffmpeg output options applying these settings"""
+        options = {'c:v': self.encoder, 'preset': self.preset, 'threads': self.threads}
+        if self.encoder == 'libx264':
+            # Frame threads do the encoding; lookahead gets a share of them
+            options['x264-params'] = f"threads={self.threads}:lookahead-threads={max(1, self.threads // 4)}"
+        elif self.encoder == 'libx265':
+            options['x265-params'] = f"pools={self.threads}"
+        return options
+
+    def describe(self):
+        text = f"{self.encoder} {self.preset or 'default'}, {self.threads} thread(s)"
+        if self.degraded:
+            text += f" (asked {self.requested_preset}, {self.queue_depth} waiting)"
+        return text
+
+
+class EncodeScheduler:
+    """Shares the host's cores between concurrent encodes.
+
+    Encodes take the runner's semaphore through here, so when an encode
+    starts the scheduler knows how many others are running and waiting.
+    Each one gets an even share of the cores for its thread count instead
+    of every ffmpeg sizing itself for the whole machine, and while encodes
+    queue up the preset is stepped towards faster so the backlog drains.
+    """
+
+    def __init__(self, runner=None, cpus=None,
+                 degrade_depth=PRESET_DEGRADE_QUEUE_DEPTH, max_degrade=MAX_PRESET_DEGRADE):
+        self.runner = runner or ffmpeg_runner
+        self.cpus = cpus or available_cpus()
+        self.degrade_depth = degrade_depth
+        self.max_degrade = max_degrade
+        self.waiting = 0
+        self.running = []
+
+    def plan(self, encoder, preset):
+        """Settings for an encode about to start, given the current load"""
+        # Size the share for the slots that will be busy, not just those
+        # busy right now, so the first encode of a burst doesn't grab every core
+        sharing = min(self.runner.max_concurrent, len(self.running) + 1 + self.waiting)
+        threads = max(1, self.cpus // max(1, sharing))
+
+        steps = 0
+        if self.degrade_depth > 0:
+            steps = min(self.max_degrade, self.waiting // self.degrade_depth)
+        return EncodeSettings(
+            encoder=encoder,
+            preset=degrade_preset(preset, steps),
+            requested_preset=preset,
+            threads=threads,
+            queue_depth=self.waiting
+        )
+
+    @asynccontextmanager
+    async def encode(self, encoder='libx264', preset='medium'):
+        """Wait for an encode slot and yield the EncodeSettings to use
+
+        preset may be None for encoders without presets (audio).
+
+        Run the encode inside the block with runner.run(..., limit=False);
+        the slot is already held.
+        """
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await self.runner.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            phase_seconds.observe(time.monotonic() - started, operation=job_operation(), phase='queue_wait')
+
+        settings = self.plan(encoder, preset)
+        self.running.append(settings)
+        job = current_job.get()
+        if job is not None:
+            job.encode_settings = settings
+        logger.info("Encoding with %s", settings.describe())
+        try:
+            yield settings
+        finally:
+            self.running.remove(settings)
+            self.runner.semaphore.release()
+
+
+# Global instance
+encode_scheduler = EncodeScheduler()
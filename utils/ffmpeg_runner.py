@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+import ffmpeg
+
+from config.config import MAX_CONCURRENT_ENCODES, FFMPEG_TIMEOUT, PROBE_TIMEOUT
+from utils.downloader import growing_download, DownloadIncomplete
+from utils.job_registry import current_job
+from utils.metrics import phase_seconds, ffmpeg_failures, classify_ffmpeg_error
+
+logger = logging.getLogger(__name__)
+
+
+class FFmpegTimeout(ffmpeg.Error):
+    """Raised when an ffmpeg process runs past its timeout"""
+
+
+class FFmpegRunner:
+    """Run ffmpeg and ffprobe as asyncio subprocesses.
+
+    Encodes are capped by a semaphore so a burst of heavy jobs queues up
+    instead of starving the bot's event loop and the CPU. Probes skip the
+    semaphore because they are cheap and handlers wait on them directly.
+
+    An input that is still downloading when the process starts is piped
+    in on stdin as it arrives, so ffmpeg reaches a real end of file as
+    soon as the download completes.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_ENCODES, timeout=FFMPEG_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Created lazily so it is bound to the loop run_polling() starts
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def run(self, stream, timeout=None, on_stderr=None, limit=True):
+        """Run an ffmpeg-python stream (or argument list) and return (stdout, stderr)"""
+        job = current_job.get()
+        if isinstance(stream, (list, tuple)):
+            args = list(stream)
+        else:
+            cmd = ['ffmpeg', '-hide_banner', '-nostdin']
+            if job is not None:
+                # Machine-readable progress, interleaved with the log on stderr
+                cmd += ['-progress', 'pipe:2', '-nostats']
+            args = stream.compile(cmd=cmd)
+
+        if not limit:
+            return await self._execute(args, timeout or self.timeout, on_stderr, job)
+
+        async with self.semaphore:
+            return await self._execute(args, timeout or self.timeout, on_stderr, job)
+
+    async def probe(self, path, timeout=PROBE_TIMEOUT, **kwargs):
+        """Async equivalent of ffmpeg.probe()"""
+        args = ['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json']
+        for key, value in kwargs.items():
+            args += [f'-{key}', str(value)]
+        args.append(path)
+
+        stdout, stderr = await self._execute(args, timeout)
+        return json.loads(stdout.decode('utf-8'))
+
+    async def _execute(self, args, timeout, on_stderr=None, job=None):
+        operation = getattr(job or current_job.get(), 'operation', None) or 'unknown'
+        phase = 'probe' if args[0] == 'ffprobe' else 'encode'
+        started = time.monotonic()
+        args, download = await self._pipe_growing_input(args)
+        logger.debug("Running %s", ' '.join(args))
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if download else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        if job is not None:
+            job.state = 'running'
+            job.processes.add(process)
+
+        stderr_tail = deque(maxlen=200)
+        stdout_task = asyncio.ensure_future(process.stdout.read())
+        stderr_task = asyncio.ensure_future(
+            self._read_stderr(process.stderr, stderr_tail, on_stderr, job)
+        )
+        tasks = [stdout_task, stderr_task]
+        feed_task = None
+        if download:
+            feed_task = asyncio.ensure_future(download.feed(process.stdin))
+            tasks.append(feed_task)
+
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+            stdout = await stdout_task
+            await stderr_task
+            if feed_task is not None:
+                await self._finish_feed(download, feed_task)
+        except DownloadIncomplete as e:
+            ffmpeg_failures.inc(operation=operation, error='download')
+            raise ffmpeg.Error(args[0], b'', str(e).encode('utf-8'))
+        except asyncio.TimeoutError:
+            await self._kill(process, *tasks)
+            ffmpeg_failures.inc(operation=operation, error='timeout')
+            stderr = '\n'.join(stderr_tail).encode('utf-8')
+            raise FFmpegTimeout(args[0], b'', stderr)
+        except asyncio.CancelledError:
+            await self._kill(process, *tasks)
+            raise
+        finally:
+            if job is not None:
+                job.processes.discard(process)
+            phase_seconds.observe(time.monotonic() - started, operation=operation, phase=phase)
+
+        stderr = '\n'.join(stderr_tail).encode('utf-8')
+        if process.returncode != 0:
+            ffmpeg_failures.inc(operation=operation, error=classify_ffmpeg_error(stderr))
+            raise ffmpeg.Error(args[0], stdout, stderr)
+        return stdout, stderr
+
+    async def _pipe_growing_input(self, args):
+        """Swap an input that is still downloading for stdin
+
+        Returns (args, download to feed in, or None). Only one input can
+        come in on stdin, so when several are still growing (or one file
+        is opened twice) they are all waited for and read from disk.
+        """
+        if args[0] == 'ffprobe':
+            positions = [len(args) - 1]
+        else:
+            positions = [i + 1 for i, arg in enumerate(args[:-1]) if arg == '-i']
+        growing = [(i, growing_download(args[i])) for i in positions]
+        growing = [(i, download) for i, download in growing if download is not None]
+        if len(growing) == 1:
+            i, download = growing[0]
+            return args[:i] + ['pipe:0'] + args[i + 1:], download
+        for _, download in growing:
+            await download.finished.wait()
+        return args, None
+
+    async def _finish_feed(self, download, feed_task):
+        """Settle the stdin feed of a process that has exited"""
+        if not download.finished.is_set():
+            # The process stopped reading before the end (a head-only job)
+            feed_task.cancel()
+        results = await asyncio.gather(feed_task, return_exceptions=True)
+        if isinstance(results[0], DownloadIncomplete):
+            raise results[0]
+
+    async def _read_stderr(self, reader, tail, on_stderr, job=None):
+        # ffmpeg terminates its stats line with '\r', so split on both
+        buffer = b''
+        while True:
+            chunk = await reader.read(4096)
+            if not chunk:
+                break
+            buffer += chunk.replace(b'\r', b'\n')
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                self._handle_line(line, tail, on_stderr, job)
+        if buffer:
+            self._handle_line(buffer, tail, on_stderr, job)
+
+    def _handle_line(self, line, tail, on_stderr, job=None):
+        text = line.decode('utf-8', errors='replace').strip()
+        if not text:
+            return
+        if job is not None:
+            key, sep, value = text.partition('=')
+            if sep and key.isidentifier():
+                # -progress output, keep it out of the error tail
+                job.update_progress(key, value)
+                return
+        tail.append(text)
+        if on_stderr:
+            try:
+                on_stderr(text)
+            except Exception:
+                logger.exception("stderr callback failed")
+
+    async def _kill(self, process, *tasks):
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Global instance
+ffmpeg_runner = FFmpegRunner()
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+
+from config.config import (
+    FILE_REGISTRY_DIR, FILE_REGISTRY_MAX_BYTES, FILE_REGISTRY_MAX_RESULTS,
+    SOURCE_COPY_TTL, RESULT_FILE_ID_TTL, INDEX_SAVE_DELAY
+)
+from utils.file_utils import IndexWriter
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(source, target):
+    """Hard-link source to target (replacing it), copying across filesystems"""
+    partial = f"{target}.{os.getpid()}.tmp"
+    try:
+        os.link(source, partial)
+    except OSError:
+        shutil.copyfile(source, partial)
+    os.replace(partial, target)
+
+
+class FileRegistry:
+    """What the bot already has of each Telegram file.
+
+    sources: file_unique_id -> a local copy of that upload (or of a result
+             the bot sent, so one forwarded back needs no download). Copies
+             are hard links to the job's input, so registering one costs
+             no I/O. They expire after SOURCE_COPY_TTL and the least
+             recently used go first once FILE_REGISTRY_MAX_BYTES is reached.
+    results: (kind, content hash) -> file_id of an upload with exactly
+             those bytes, so an identical output is sent by file_id
+             instead of being uploaded again.
+
+    Changes to the index are written out together, at most once per
+    save_delay seconds and off the event loop.
+    """
+
+    def __init__(self, directory=FILE_REGISTRY_DIR, max_bytes=FILE_REGISTRY_MAX_BYTES,
+                 max_results=FILE_REGISTRY_MAX_RESULTS, source_ttl=SOURCE_COPY_TTL,
+                 result_ttl=RESULT_FILE_ID_TTL, save_delay=INDEX_SAVE_DELAY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_results = max_results
+        self.source_ttl = source_ttl
+        self.result_ttl = result_ttl
+        self.index_path = os.path.join(directory, 'index.json')
+        self._index = None
+        self._writer = IndexWriter(self.index_path, self._snapshot, save_delay)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._load()
+        return self._index
+
+    def source_path(self, file_unique_id):
+        """Local copy of a Telegram file, or None"""
+        entry = self.index['sources'].get(file_unique_id)
+        if entry is None:
+            return None
+        path = self._source_file(file_unique_id)
+        if time.time() - entry['stored'] > self.source_ttl or not os.path.exists(path):
+            self.discard_source(file_unique_id)
+            return None
+        entry['last_used'] = time.time()
+        return path
+
+    async def add_source(self, file_unique_id, path):
+        """Keep `path` as the local copy of a Telegram file"""
+        target = self._source_file(file_unique_id)
+        # A copy across filesystems can take a while
+        await asyncio.get_running_loop().run_in_executor(None, self._store, path, target)
+        now = time.time()
+        self.index['sources'][file_unique_id] = {
+            'size': os.path.getsize(target),
+            'stored': now,
+            'last_used': now
+        }
+        self._evict()
+        self._save()
+
+    def discard_source(self, file_unique_id):
+        if self.index['sources'].pop(file_unique_id, None) is not None:
+            self._remove(self._source_file(file_unique_id))
+            self._save()
+
+    def result_file_id(self, digest, kind):
+        """file_id of an earlier upload with this content hash, or None"""
+        entry = self.index['results'].get(f"{kind}:{digest}")
+        if entry is None:
+            return None
+        if time.time() - entry['stored'] > self.result_ttl:
+            self.discard_result(digest, kind)
+            return None
+        entry['last_used'] = time.time()
+        return entry['file_id']
+
+    def add_result(self, digest, kind, file_id):
+        now = time.time()
+        self.index['results'][f"{kind}:{digest}"] = {'file_id': file_id, 'stored': now, 'last_used': now}
+        self._evict()
+        self._save()
+
+    def discard_result(self, digest, kind):
+        if self.index['results'].pop(f"{kind}:{digest}", None) is not None:
+            self._save()
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self.index['sources'].values())
+
+    @staticmethod
+    def _store(path, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        link_or_copy(path, target)
+
+    def _source_file(self, file_unique_id):
+        return os.path.join(self.directory, file_unique_id[:2], file_unique_id)
+
+    def _evict(self):
+        now = time.time()
+        sources = self.index['sources']
+        for file_unique_id, entry in list(sources.items()):
+            if now - entry['stored'] > self.source_ttl:
+                del sources[file_unique_id]
+                self._remove(self._source_file(file_unique_id))
+        total = self.total_bytes()
+        for file_unique_id, entry in sorted(sources.items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            del sources[file_unique_id]
+            self._remove(self._source_file(file_unique_id))
+            total -= entry['size']
+
+        results = self.index['results']
+        for key, entry in list(results.items()):
+            if now - entry['stored'] > self.result_ttl:
+                del results[key]
+        excess = len(results) - self.max_results
+        if excess > 0:
+            for key, _ in sorted(results.items(), key=lambda item: item[1]['last_used'])[:excess]:
+                del results[key]
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            return {'sources': index.get('sources', {}), 'results': index.get('results', {})}
+        except FileNotFoundError:
+            return {'sources': {}, 'results': {}}
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable file registry index: %s", e)
+            return {'sources': {}, 'results': {}}
+
+    def _save(self):
+        self._writer.save()
+
+    async def flush(self):
+        """Write out index changes still waiting to be batched"""
+        await self._writer.flush()
+
+    def _snapshot(self):
+        if self._index is None:
+            return None
+        # Entries only ever have existing keys updated, so copying the two
+        # tables is enough to serialise them from another thread
+        return {'sources': dict(self._index['sources']), 'results': dict(self._index['results'])}
+
+
+# Global instance
+file_registry = FileRegistry()
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+from config.config import (
+    TEMP_DIR, OUTPUT_DIR, DISK_QUOTA_BYTES, ORPHAN_MAX_AGE, ORPHAN_SWEEP_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(Exception):
+    """Raised when a new workspace would push disk usage over the quota"""
+
+
+def directory_size(path):
+    """Total size in bytes of all files below path"""
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            # Removed by a finishing job while we were looking
+            continue
+    return total
+
+
+class IndexWriter:
+    """Writes a JSON index off the event loop, batching changes
+
+    snapshot: callable returning the data to write, copied enough that it
+              can be serialised from another thread, or None for nothing
+    save() joins a write already pending, so a burst of changes costs one
+    write at most `delay` seconds later.
+    """
+
+    def __init__(self, path, snapshot, delay):
+        self.path = path
+        self.snapshot = snapshot
+        self.delay = delay
+        self.task = None
+
+    def save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Outside the bot's loop (scripts, workers) there is nothing to block
+            self._write(self.snapshot())
+            return
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        """Write now; call on shutdown so no change is lost"""
+        data = self.snapshot()
+        if data is None:
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        except OSError as e:
+            logger.warning("Could not save %s: %s", self.path, e)
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # Write-then-rename so a crash never leaves a truncated index
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+
+class Workspace:
+    """A private directory for one job"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def subdir(self, name):
+        path = os.path.join(self.path, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+
+class WorkspaceManager:
+    """Hands out per-job directories and keeps TEMP_DIR/OUTPUT_DIR in check.
+
+    Every job gets its own directory that is removed when the job ends,
+    however it ends. New workspaces are refused once the watched
+    directories plus the space reserved by running jobs would exceed the
+    quota, and a background sweep removes anything orphaned by a crash.
+    """
+
+    def __init__(self, root=TEMP_DIR, watched=(TEMP_DIR, OUTPUT_DIR),
+                 quota_bytes=DISK_QUOTA_BYTES, orphan_max_age=ORPHAN_MAX_AGE):
+        self.root = root
+        self.watched = watched
+        self.quota_bytes = quota_bytes
+        self.orphan_max_age = orphan_max_age
+        # usage() as of the latest sweep or quota check, for cheap reporting
+        self.last_usage = 0
+        self._active = {}
+
+    def usage(self):
+        """Bytes currently used across the watched directories"""
+        return sum(directory_size(path) for path in self.watched)
+
+    def reserved(self):
+        return sum(self._active.values())
+
+    @asynccontextmanager
+    async def workspace(self, prefix='job', reserve=0):
+        """Create a job directory, removed on completion, failure or cancel
+
+        reserve: bytes the job expects to write, counted against the quota
+                 until it finishes
+        """
+        loop = asyncio.get_running_loop()
+        used = self.last_usage = await loop.run_in_executor(None, self.usage)
+        if self.quota_bytes and used + self.reserved() + reserve > self.quota_bytes:
+            raise QuotaExceeded(
+                f"{used + self.reserved()} bytes in use, {reserve} more would exceed the quota"
+            )
+
+        os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f"{prefix}_", dir=self.root)
+        self._active[path] = reserve
+        try:
+            yield Workspace(path)
+        finally:
+            self._active.pop(path, None)
+            await loop.run_in_executor(None, shutil.rmtree, path, True)
+
+    def sweep(self, max_age=None):
+        """Remove files and directories untouched for max_age seconds
+
+        Active workspaces are never touched. Returns the number of bytes freed.
+        """
+        max_age = self.orphan_max_age if max_age is None else max_age
+        cutoff = time.time() - max_age
+        freed = 0
+        for directory in self.watched:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.path in self._active:
+                    continue
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        size = directory_size(entry.path)
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        size = entry.stat(follow_symlinks=False).st_size
+                        os.remove(entry.path)
+                    freed += size
+                except FileNotFoundError:
+                    continue
+        if freed:
+            logger.info("Swept %d bytes of orphaned temp files", freed)
+        return freed
+
+    async def run_sweeper(self, interval=ORPHAN_SWEEP_INTERVAL):
+        """Periodically sweep orphans; run as a background task"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.sweep)
+                self.last_usage = await loop.run_in_executor(None, self.usage)
+            except Exception:
+                logger.exception("Orphan sweep failed")
+            await asyncio.sleep(interval)
+
+
+# Global instance
+workspace_manager = WorkspaceManager()
+
+
+def cleanup_temp_files(max_age=None):
+    """Remove orphaned files from TEMP_DIR and OUTPUT_DIR"""
+    return workspace_manager.sweep(max_age)
@@ -0,0 +1,86 @@
+"""Pick good thumbnail frames out of a batch of small grayscale frames.
+
+Everything is computed over the whole (frames, height, width) array at
+once, so scoring a few hundred candidates takes milliseconds. The frames
+come from a single downscaled decode pass (see
+VideoProcessor.smart_thumbnails()); only the winners are grabbed again at
+full size.
+"""
+import numpy as np
+
+# Size candidates are decoded at; plenty for judging focus and exposure
+SCORE_WIDTH = 160
+SCORE_HEIGHT = 90
+
+# Mean luma outside this range is a black/white frame or a fade
+MIN_BRIGHTNESS = 24
+MAX_BRIGHTNESS = 232
+# Below this luma standard deviation a frame is flat (title cards, fades)
+MIN_CONTRAST = 12
+# Mean absolute luma difference to the previous candidate that starts a new scene
+SCENE_THRESHOLD = 30
+
+
+def decode_frames(raw, width=SCORE_WIDTH, height=SCORE_HEIGHT):
+    """(frames, height, width) uint8 array from rawvideo gray bytes"""
+    frame_size = width * height
+    count = len(raw) // frame_size
+    return np.frombuffer(raw, dtype=np.uint8, count=count * frame_size).reshape(count, height, width)
+
+
+def score_frames(frames):
+    """Score every frame and split them into scenes
+
+    Returns (scores, scene ids): a score is 0 for unusable frames and grows
+    with sharpness, balanced exposure, contrast and stability, i.e. not
+    being in the middle of a cut, dissolve or fast pan.
+    """
+    x = frames.astype(np.float32)
+    brightness = x.mean(axis=(1, 2))
+    contrast = x.std(axis=(1, 2))
+
+    # Variance of the Laplacian: high for in-focus detail, low for blur
+    laplacian = (
+        4 * x[:, 1:-1, 1:-1]
+        - x[:, :-2, 1:-1] - x[:, 2:, 1:-1]
+        - x[:, 1:-1, :-2] - x[:, 1:-1, 2:]
+    )
+    sharpness = laplacian.var(axis=(1, 2))
+
+    # Change to the previous candidate; the first frame starts a scene
+    change = np.zeros(len(x), dtype=np.float32)
+    if len(x) > 1:
+        change[1:] = np.abs(x[1:] - x[:-1]).mean(axis=(1, 2))
+    scenes = np.cumsum(change > SCENE_THRESHOLD)
+    # A frame that differs from both neighbours is mid-transition
+    following = np.append(change[1:], 0)
+    motion = np.minimum(change, following) if len(x) > 1 else change
+
+    exposure = 1 - np.abs(brightness - 128) / 128
+    scores = (
+        np.sqrt(sharpness / max(sharpness.max(), 1e-6))
+        * exposure
+        * np.minimum(contrast / 64, 1)
+        / (1 + motion / 8)
+    )
+    usable = (
+        (brightness >= MIN_BRIGHTNESS) & (brightness <= MAX_BRIGHTNESS)
+        & (contrast >= MIN_CONTRAST)
+    )
+    return np.where(usable, scores, 0), scenes
+
+
+def pick_frames(scores, scenes, count):
+    """Indices of up to `count` frames, best first per scene, in time order
+
+    Each scene gives at most its best frame until every scene has been
+    used; only then do scenes give a second frame. Unusable frames are
+    taken only when nothing else is left.
+    """
+    order = np.lexsort((-scores, scenes))
+    # Rank of each frame within its scene, best first
+    starts = np.searchsorted(scenes[order], scenes[order], side='left')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - starts
+    chosen = np.lexsort((-scores, rank, scores <= 0))[:count]
+    return sorted(int(i) for i in chosen)
@@ -0,0 +1,225 @@
+"""Distributed job queue for heavy VideoProcessor operations.
+
+The bot enqueues jobs by Telegram file_id; workers download the inputs,
+run the operation and deliver the results straight back to the chat, so
+they can live on any machine that can reach the broker and the Bot API.
+
+Start a worker with:
+
+    celery -A utils.job_queue worker -Q video -l info
+
+Set CELERY_BROKER_URL=memory:// and CELERY_RESULT_BACKEND=cache+memory://
+to run everything in-process without Redis.
+"""
+import asyncio
+import logging
+import os
+from collections import Counter
+from functools import partial
+
+import redis
+from celery import Celery
+
+from config.config import (
+    BOT_TOKEN, CELERY_BROKER_URL, CELERY_RESULT_BACKEND,
+    JOB_QUEUE_NAME, MAX_JOBS_PER_USER
+)
+
+logger = logging.getLogger(__name__)
+
+app = Celery('video_tool_bot', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+app.conf.update(
+    task_default_queue=JOB_QUEUE_NAME,
+    task_serializer='json',
+    result_serializer='json',
+    accept_content=['json'],
+    # Long jobs: hand out one at a time and only ack when done
+    task_acks_late=True,
+    worker_prefetch_multiplier=1,
+    task_reject_on_worker_lost=True,
+    task_queue_max_priority=10,
+    task_default_priority=5,
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'queue_order_strategy': 'priority'
+    },
+    result_expires=3600
+)
+
+# Operation name -> (output kind, extension, base priority). With the
+# Redis transport 0 is served first, so cheap operations sit near the top.
+OPERATIONS = {
+    'extract_thumbnail': ('file', '.jpg', 1),
+    'extract_multiple_thumbnails': ('dir', None, 2),
+    'take_screenshots': ('dir', None, 2),
+    'smart_thumbnails': ('dir', None, 2),
+    'trim_video': ('file', '.mp4', 3),
+    'split_video_by_time': ('dir', None, 3),
+    'split_video_by_size': ('dir', None, 3),
+    'split_video_into_parts': ('dir', None, 3),
+    'merge_videos': ('file', '.mp4', 4),
+    'add_subtitles': ('file', '.mp4', 6),
+    'optimize_video': ('file', '.mp4', 6)
+}
+
+# Operations whose first argument is a list of inputs
+LIST_INPUT_OPERATIONS = {'merge_videos'}
+
+# Each queued job a user already has pushes the next one further back
+USER_PRIORITY_PENALTY = 2
+
+
+class UserSlots:
+    """Per-user in-flight job counter shared by the bot and the workers.
+
+    Lives in Redis when the broker is Redis, otherwise in process memory
+    (in-memory broker setups run bot and worker in one process anyway).
+    """
+
+    def __init__(self, url=CELERY_BROKER_URL):
+        self._redis = redis.Redis.from_url(url) if url.startswith('redis') else None
+        self._local = Counter()
+
+    def _key(self, user_id):
+        return f"jobs:inflight:{user_id}"
+
+    def acquire(self, user_id):
+        if self._redis is None:
+            self._local[user_id] += 1
+            return self._local[user_id]
+        count = self._redis.incr(self._key(user_id))
+        # Guard against counters leaked by crashed workers
+        self._redis.expire(self._key(user_id), 6 * 3600)
+        return count
+
+    def release(self, user_id):
+        if self._redis is None:
+            self._local[user_id] = max(0, self._local[user_id] - 1)
+            return
+        if self._redis.decr(self._key(user_id)) < 0:
+            self._redis.set(self._key(user_id), 0)
+
+
+user_slots = UserSlots()
+
+
+class QueueFull(Exception):
+    """Raised when a user already has MAX_JOBS_PER_USER jobs queued"""
+
+
+def submit(user_id, operation, file_ids, params=None, delivery=None):
+    """Queue an operation and return its Celery AsyncResult
+
+    file_ids: Telegram file_ids of the inputs, in argument order
+    params: extra positional/keyword arguments, {'args': [...], 'kwargs': {...}}
+    delivery: where to send results, {'chat_id': ..., 'caption': ...}
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation: {operation}")
+
+    inflight = user_slots.acquire(user_id)
+    if inflight > MAX_JOBS_PER_USER:
+        user_slots.release(user_id)
+        raise QueueFull(f"User {user_id} already has {MAX_JOBS_PER_USER} jobs queued")
+
+    priority = min(9, OPERATIONS[operation][2] + (inflight - 1) * USER_PRIORITY_PENALTY)
+    try:
+        return process_video.apply_async(
+            args=[user_id, operation, list(file_ids), params or {}, delivery or {}],
+            priority=priority
+        )
+    except Exception:
+        user_slots.release(user_id)
+        raise
+
+
+async def submit_async(*args, **kwargs):
+    """submit() without blocking the event loop on broker I/O"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(submit, *args, **kwargs))
+
+
+_worker_loop = None
+
+
+def _run(coro):
+    # One loop per worker process, so loop-bound primitives in the shared
+    # VideoProcessor (semaphores, caches) survive from task to task
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+    return _worker_loop.run_until_complete(coro)
+
+
+@app.task(name='video.process', bind=True)
+def process_video(self, user_id, operation, file_ids, params, delivery):
+    """Download inputs, run a VideoProcessor operation, deliver the results"""
+    try:
+        return _run(_process(operation, file_ids, params, delivery))
+    finally:
+        user_slots.release(user_id)
+
+
+async def _process(operation, file_ids, params, delivery):
+    from telegram import Bot
+    from utils.file_utils import workspace_manager
+    from utils.video_processor import video_processor
+
+    kind, extension, _ = OPERATIONS[operation]
+    async with workspace_manager.workspace(operation) as workspace:
+        work_dir = workspace.path
+        async with Bot(BOT_TOKEN) as bot:
+            inputs = []
+            for i, file_id in enumerate(file_ids):
+                telegram_file = await bot.get_file(file_id)
+                path = os.path.join(work_dir, f"input_{i}{_suffix(telegram_file.file_path)}")
+                await telegram_file.download_to_drive(path)
+                inputs.append(path)
+
+            if kind == 'dir':
+                output = os.path.join(work_dir, 'output')
+                os.makedirs(output, exist_ok=True)
+            else:
+                output = os.path.join(work_dir, f"output{extension}")
+
+            first = [inputs] if operation in LIST_INPUT_OPERATIONS else inputs
+            method = getattr(video_processor, operation)
+            result = await method(*first, output, *params.get('args', []), **params.get('kwargs', {}))
+
+            if kind == 'dir':
+                outputs = result or []
+            else:
+                outputs = [output] if result and os.path.exists(output) else []
+
+            file_ids_out = []
+            chat_id = delivery.get('chat_id')
+            if chat_id:
+                if not outputs:
+                    await bot.send_message(chat_id, f"❌ {operation.replace('_', ' ').capitalize()} failed.")
+                for path in outputs:
+                    file_ids_out.append(await _deliver(bot, chat_id, path, delivery.get('caption')))
+
+            return {
+                'operation': operation,
+                'result': result if isinstance(result, (bool, str)) else bool(result),
+                'outputs': len(outputs),
+                'file_ids': file_ids_out
+            }
+
+
+async def _deliver(bot, chat_id, path, caption=None):
+    """Upload one result file and return its Telegram file_id"""
+    with open(path, 'rb') as f:
+        if path.endswith('.jpg'):
+            message = await bot.send_photo(chat_id, f, caption=caption)
+            return message.photo[-1].file_id
+        if path.endswith('.mp4'):
+            message = await bot.send_video(chat_id, f, caption=caption, supports_streaming=True)
+            return message.video.file_id
+        message = await bot.send_document(chat_id, f, caption=caption)
+        return message.document.file_id
+
+
+def _suffix(file_path):
+    suffix = os.path.splitext(file_path or '')[1]
+    return suffix if suffix else '.mp4'
@@ -0,0 +1,300 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import os
+import shutil
+import time
+from contextlib import asynccontextmanager
+
+from config.config import PROGRESS_EDIT_INTERVAL, PROGRESS_EDITS_PER_SECOND
+from utils.metrics import operation_seconds
+
+logger = logging.getLogger(__name__)
+
+# The job the running coroutine belongs to; FFmpegRunner reads it to
+# attach processes and progress without threading a job argument through
+# every VideoProcessor method
+current_job = contextvars.ContextVar('current_job', default=None)
+
+ACTIVE_STATES = ('pending', 'running')
+
+
+class Job:
+    """A tracked operation and its live ffmpeg progress"""
+
+    def __init__(self, job_id, user_id, operation, duration=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.operation = operation
+        self.duration = duration
+        self.state = 'pending'
+        self.created = time.monotonic()
+        self.finished = None
+        self.out_time = 0.0
+        self.fps = None
+        self.speed = None
+        self.task = None
+        self.processes = set()
+        self.temp_paths = []
+        # EncodeSettings of the latest encode, set by the encode scheduler
+        self.encode_settings = None
+        self._parts = {}
+
+    def add_temp(self, path):
+        """Register a file or directory to delete if the job fails or is cancelled"""
+        self.temp_paths.append(path)
+
+    def update_progress(self, key, value):
+        """Feed one key=value line of ffmpeg -progress output"""
+        if key in ('out_time_us', 'out_time_ms'):
+            # Both are microseconds, out_time_ms is misnamed in ffmpeg
+            try:
+                self.out_time = max(0.0, int(value) / 1000000)
+            except ValueError:
+                pass
+        elif key == 'fps':
+            self.fps = _float(value)
+        elif key == 'speed':
+            self.speed = _float(value.rstrip('x'))
+
+    def part(self, key, counted=True):
+        """A progress sink for one of several processes working on this job
+
+        Set it as current_job in the task running that process; the job then
+        reports the summed position and speed of all its parts. A part that
+        isn't counted covers the same timeline as the others (say the audio
+        next to video chunks): it is cancelled with the job, but its
+        position would count the same seconds twice.
+        """
+        return JobPart(self, key, counted)
+
+    def _update_part(self, key, out_time=None, fps=None, speed=None, counted=True):
+        part = self._parts.setdefault(key, {'out_time': 0.0, 'fps': 0.0, 'speed': 0.0, 'counted': counted})
+        for name, value in (('out_time', out_time), ('fps', fps), ('speed', speed)):
+            if value is not None:
+                part[name] = value
+        parts = [p for p in self._parts.values() if p['counted']]
+        self.out_time = sum(p['out_time'] for p in parts)
+        self.fps = sum(p['fps'] for p in parts) or None
+        self.speed = sum(p['speed'] for p in parts) or None
+
+    @property
+    def percent(self):
+        if not self.duration:
+            return None
+        return min(100.0, self.out_time / self.duration * 100)
+
+    @property
+    def eta(self):
+        """Seconds left, estimated from encode speed"""
+        if not self.duration or not self.speed:
+            return None
+        return max(0.0, (self.duration - self.out_time) / self.speed)
+
+    @property
+    def active(self):
+        return self.state in ACTIVE_STATES
+
+    def describe(self):
+        """One-line human readable status"""
+        name = self.operation.replace('_', ' ').capitalize()
+        if self.state == 'pending':
+            return f"⏳ {name} — waiting"
+        if self.state != 'running':
+            return f"{name} — {self.state}"
+
+        parts = [f"🔄 {name}"]
+        if self.percent is not None:
+            parts.append(f"{self.percent:.0f}%")
+        else:
+            parts.append(_format_seconds(self.out_time))
+        if self.fps:
+            parts.append(f"{self.fps:.0f} fps")
+        if self.eta is not None:
+            parts.append(f"ETA {_format_seconds(self.eta)}")
+        if self.encode_settings is not None:
+            settings = self.encode_settings
+            parts.append(f"{settings.preset or settings.encoder}/{settings.threads}t")
+        return " • ".join(parts)
+
+
+class JobPart:
+    """Stands in for a Job in one of its concurrent processes"""
+
+    def __init__(self, job, key, counted=True):
+        self.job = job
+        self.key = key
+        self.counted = counted
+        self.operation = job.operation
+        self.processes = job.processes
+
+    @property
+    def state(self):
+        return self.job.state
+
+    @state.setter
+    def state(self, value):
+        self.job.state = value
+
+    @property
+    def encode_settings(self):
+        return self.job.encode_settings
+
+    @encode_settings.setter
+    def encode_settings(self, value):
+        self.job.encode_settings = value
+
+    def part(self, key, counted=True):
+        return self.job.part((self.key, key), counted and self.counted)
+
+    def update_progress(self, key, value):
+        if key in ('out_time_us', 'out_time_ms'):
+            try:
+                self.job._update_part(self.key, out_time=max(0.0, int(value) / 1000000), counted=self.counted)
+            except ValueError:
+                pass
+        elif key == 'fps':
+            self.job._update_part(self.key, fps=_float(value), counted=self.counted)
+        elif key == 'speed':
+            self.job._update_part(self.key, speed=_float(value.rstrip('x')), counted=self.counted)
+
+
+class EditRateLimiter:
+    """Spaces Telegram message edits across all jobs"""
+
+    def __init__(self, per_second=PROGRESS_EDITS_PER_SECOND):
+        self.interval = 1.0 / per_second
+        self._next = 0.0
+        self._lock = None
+
+    async def wait(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = time.monotonic() + self.interval
+
+
+class JobRegistry:
+    """Tracks running VideoProcessor operations per user"""
+
+    def __init__(self, edit_interval=PROGRESS_EDIT_INTERVAL, keep_finished=50):
+        self.edit_interval = edit_interval
+        self.keep_finished = keep_finished
+        self.limiter = EditRateLimiter()
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+    @asynccontextmanager
+    async def track(self, user_id, operation, duration=None, status_message=None):
+        """Run the body as a tracked job
+
+        status_message: a Telegram message to keep edited with progress
+        """
+        job = Job(next(self._ids), user_id, operation, duration)
+        job.task = asyncio.current_task()
+        self._jobs[job.id] = job
+        token = current_job.set(job)
+        reporter = None
+        if status_message is not None:
+            reporter = asyncio.ensure_future(self._report(job, status_message))
+
+        try:
+            yield job
+            job.state = 'done'
+        except asyncio.CancelledError:
+            job.state = 'cancelled'
+            raise
+        except Exception:
+            job.state = 'failed'
+            raise
+        finally:
+            job.finished = time.monotonic()
+            operation_seconds.observe(job.finished - job.created, operation=operation, outcome=job.state)
+            current_job.reset(token)
+            if reporter:
+                reporter.cancel()
+            if job.state != 'done':
+                _remove_paths(job.temp_paths)
+            self._prune()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def for_user(self, user_id, active_only=True):
+        return [
+            job for job in self._jobs.values()
+            if job.user_id == user_id and (job.active or not active_only)
+        ]
+
+    def active_jobs(self):
+        return [job for job in self._jobs.values() if job.active]
+
+    async def cancel(self, user_id, job_id=None):
+        """Cancel a user's jobs (or one of them) and return how many were stopped"""
+        jobs = [j for j in self.for_user(user_id) if job_id is None or j.id == job_id]
+        for job in jobs:
+            if job.task and not job.task.done():
+                job.task.cancel()
+            for process in list(job.processes):
+                if process.returncode is None:
+                    process.kill()
+        if jobs:
+            # Let the cancelled tasks unwind and clean up
+            await asyncio.sleep(0)
+        return len(jobs)
+
+    async def _report(self, job, message):
+        last_text = None
+        while True:
+            await asyncio.sleep(self.edit_interval)
+            text = job.describe()
+            if text == last_text or job.state != 'running':
+                continue
+            await self.limiter.wait()
+            try:
+                await message.edit_text(text)
+                last_text = text
+            except Exception as e:
+                logger.debug("Progress edit failed: %s", e)
+
+    def _prune(self):
+        finished = sorted(
+            (j for j in self._jobs.values() if not j.active),
+            key=lambda j: j.finished or 0
+        )
+        for job in finished[:-self.keep_finished or None]:
+            self._jobs.pop(job.id, None)
+
+
+def _remove_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+# Global instance
+job_registry = JobRegistry()
@@ -0,0 +1,290 @@
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from config.config import MEDIA_INFO_CACHE_SIZE
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.downloader import is_growing
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate(value):
+    """Parse an ffprobe rational such as '30000/1001'"""
+    if not value or value == '0/0':
+        return None
+    num, _, den = str(value).partition('/')
+    num, den = _float(num), _float(den or 1)
+    if not num or not den:
+        return None
+    return num / den
+
+
+def _rotation(stream):
+    """Clockwise display rotation of a probed stream, 0-270"""
+    for side_data in stream.get('side_data_list', []):
+        angle = _float(side_data.get('rotation'))
+        if angle is not None:
+            # The display matrix angle is counter-clockwise
+            return int(round(-angle)) % 360
+    # Older muxers wrote a clockwise 'rotate' tag instead
+    return (_int(stream.get('tags', {}).get('rotate')) or 0) % 360
+
+
+@dataclass
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: str = None
+    profile: str = None
+    width: int = None
+    height: int = None
+    pix_fmt: str = None
+    fps: float = None
+    time_base: str = None
+    sample_rate: int = None
+    channels: int = None
+    bit_rate: int = None
+    duration: float = None
+    language: str = None
+    attached_pic: bool = False
+    # Clockwise degrees a player turns the picture by, from the display matrix
+    rotation: int = 0
+
+    @classmethod
+    def from_probe(cls, stream):
+        tags = stream.get('tags', {})
+        return cls(
+            index=stream.get('index', 0),
+            codec_type=stream.get('codec_type'),
+            codec_name=stream.get('codec_name'),
+            profile=stream.get('profile'),
+            width=_int(stream.get('width')),
+            height=_int(stream.get('height')),
+            pix_fmt=stream.get('pix_fmt'),
+            fps=_rate(stream.get('avg_frame_rate')) or _rate(stream.get('r_frame_rate')),
+            time_base=stream.get('time_base'),
+            sample_rate=_int(stream.get('sample_rate')),
+            channels=_int(stream.get('channels')),
+            bit_rate=_int(stream.get('bit_rate')),
+            duration=_float(stream.get('duration')),
+            language=tags.get('language'),
+            attached_pic=bool(stream.get('disposition', {}).get('attached_pic')),
+            rotation=_rotation(stream)
+        )
+
+
+@dataclass
+class MediaInfo:
+    path: str
+    format_name: str = None
+    duration: float = None
+    # Timestamp of the first packet; ffmpeg's -ss and cut times count from here
+    start_time: float = None
+    size: int = None
+    bit_rate: int = None
+    streams: list = field(default_factory=list)
+    tags: dict = field(default_factory=dict)
+    # Keyframe timestamps of the first video stream, filled in lazily
+    keyframes: list = None
+
+    @classmethod
+    def from_probe(cls, path, probe):
+        fmt = probe.get('format', {})
+        streams = [StreamInfo.from_probe(s) for s in probe.get('streams', [])]
+
+        duration = _float(fmt.get('duration'))
+        if duration is None:
+            # Some containers only report duration per stream
+            durations = [s.duration for s in streams if s.duration]
+            duration = max(durations) if durations else None
+
+        return cls(
+            path=path,
+            format_name=fmt.get('format_name'),
+            duration=duration,
+            start_time=_float(fmt.get('start_time')),
+            size=_int(fmt.get('size')),
+            bit_rate=_int(fmt.get('bit_rate')),
+            streams=streams,
+            tags=fmt.get('tags', {})
+        )
+
+    @property
+    def video(self):
+        """First real video stream (cover art excluded), or None"""
+        for stream in self.streams:
+            if stream.codec_type == 'video' and not stream.attached_pic:
+                return stream
+        return None
+
+    @property
+    def audio(self):
+        """First audio stream, or None"""
+        for stream in self.streams:
+            if stream.codec_type == 'audio':
+                return stream
+        return None
+
+    @property
+    def audio_streams(self):
+        return [s for s in self.streams if s.codec_type == 'audio']
+
+    @property
+    def subtitle_streams(self):
+        return [s for s in self.streams if s.codec_type == 'subtitle']
+
+
+class MediaInfoCache:
+    """Bounded LRU of parsed probe results.
+
+    Entries are keyed on (path, size, mtime) so a rewritten file is probed
+    again, and optionally on a Telegram file_unique_id so a re-sent upload
+    skips the probe even when it lands at a different path.
+    """
+
+    def __init__(self, max_entries=MEDIA_INFO_CACHE_SIZE, runner=None):
+        self.max_entries = max_entries
+        self.runner = runner or ffmpeg_runner
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    @staticmethod
+    def _path_key(path):
+        stat = os.stat(path)
+        return ('path', os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    def peek(self, file_unique_id):
+        """Return cached info for a Telegram upload without probing"""
+        return self._lookup(('tg', file_unique_id))
+
+    async def get(self, path, file_unique_id=None):
+        """Return MediaInfo for path, probing only on a cache miss"""
+        if is_growing(path):
+            # A partial file may report a short or missing duration, so its
+            # probe is not cached at all, and least of all under the upload's
+            # identity where every later full-file operation would reuse it
+            info = self.peek(file_unique_id) if file_unique_id else None
+            return info or await self._probe(path)
+
+        keys = [self._path_key(path)]
+        if file_unique_id:
+            keys.insert(0, ('tg', file_unique_id))
+
+        for key in keys:
+            info = self._lookup(key)
+            if info is not None:
+                self._store(keys, info)
+                return info
+
+        # Concurrent callers for the same file share one ffprobe
+        pending = self._pending.get(keys[-1])
+        if pending is None:
+            pending = asyncio.ensure_future(self._probe(path))
+            self._pending[keys[-1]] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(keys[-1], None))
+        info = await asyncio.shield(pending)
+        self._store(keys, info)
+        return info
+
+    async def keyframes(self, path, file_unique_id=None, until=None):
+        """Return keyframe timestamps of the first video stream.
+
+        Reads packet flags only, so nothing is decoded. With `until`, only
+        the head of the file up to that timestamp is read (and the partial
+        list is not cached). Timestamps are relative to the start of the
+        file, like the times -ss and the segment muxer take.
+        """
+        info = await self.get(path, file_unique_id)
+        if info.keyframes is not None:
+            if until is None:
+                return info.keyframes
+            return [k for k in info.keyframes if k <= until]
+        offset = info.start_time or 0
+
+        args = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0']
+        if until is not None:
+            # Intervals are in container time
+            args += ['-read_intervals', f"%{until + offset:.3f}"]
+        args.append(path)
+
+        stdout, _ = await self.runner.run(args, limit=False)
+        keyframes = []
+        for line in stdout.decode('utf-8', errors='replace').splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and _float(pts_time) is not None:
+                keyframes.append(float(pts_time) - offset)
+        keyframes.sort()
+
+        if until is None and not is_growing(path):
+            info.keyframes = keyframes
+        return keyframes
+
+    async def packets(self, path, file_unique_id=None):
+        """Return (pts_time, size, stream_index, is_key) for every packet, by time
+
+        One pass over the packet headers of all streams, without decoding;
+        the video keyframes found on the way are cached like keyframes().
+        Not cached itself, since long files have hundreds of thousands.
+        Times are relative to the start of the file, as in keyframes().
+        """
+        info = await self.get(path, file_unique_id)
+        offset = info.start_time or 0
+        video_index = info.video.index if info.video else None
+
+        args = ['ffprobe', '-v', 'error', '-show_entries', 'packet=stream_index,pts_time,size,flags', '-of', 'csv=p=0', path]
+
+        stdout, _ = await self.runner.run(args, limit=False)
+        packets = []
+        for line in stdout.decode('utf-8', errors='replace').splitlines():
+            fields = line.split(',')
+            if len(fields) < 4:
+                continue
+            stream_index, pts_time, size = _int(fields[0]), _float(fields[1]), _int(fields[2])
+            if pts_time is None or size is None:
+                continue
+            packets.append((pts_time - offset, size, stream_index, 'K' in fields[3]))
+        packets.sort()
+
+        if info.keyframes is None and video_index is not None and not is_growing(path):
+            info.keyframes = [p[0] for p in packets if p[2] == video_index and p[3]]
+        return packets
+
+    def invalidate(self, path):
+        abspath = os.path.abspath(path)
+        for key in [k for k, v in self._entries.items() if os.path.abspath(v.path) == abspath]:
+            del self._entries[key]
+
+    async def _probe(self, path):
+        probe = await self.runner.probe(path)
+        return MediaInfo.from_probe(path, probe)
+
+    def _lookup(self, key):
+        info = self._entries.get(key)
+        if info is not None:
+            self._entries.move_to_end(key)
+        return info
+
+    def _store(self, keys, info):
+        for key in keys:
+            self._entries[key] = info
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Global instance
+media_info = MediaInfoCache()
@@ -0,0 +1,157 @@
+import os
+import ffmpeg
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.metrics import record_failure
+from utils.media_info import media_info
+from utils.subtitles import LANGUAGE_CODES
+
+# Container-level tags users can edit
+EDITABLE_TAGS = ('title', 'artist', 'album', 'date', 'genre', 'comment')
+
+# Containers whose index is moved to the front after a rewrite
+FASTSTART_EXTENSIONS = {'.mp4', '.m4v', '.m4a', '.mov'}
+
+# Containers that can carry cover art without re-encoding anything
+COVER_EXTENSIONS = {'.mp4', '.m4v', '.m4a', '.mov', '.mkv', '.mka', '.mp3', '.flac'}
+
+# Containers where cover art is an attachment rather than a picture stream
+ATTACHMENT_EXTENSIONS = {'.mkv', '.mka'}
+
+# Stream types a rewrite carries over; data tracks (timed metadata such as
+# the mebx tracks in iPhone videos) have no codec tag the muxer can write
+MAPPED_STREAM_TYPES = {'video', 'audio', 'subtitle', 'attachment'}
+
+# ffprobe format names to the extension the rewrite keeps
+FORMAT_EXTENSIONS = {
+    'mov,mp4,m4a,3gp,3g2,mj2': '.mp4',
+    'matroska,webm': '.mkv',
+    'mp3': '.mp3',
+    'flac': '.flac',
+    'ogg': '.ogg',
+    'wav': '.wav',
+    'avi': '.avi'
+}
+
+
+class MetadataError(Exception):
+    """Raised for an edit the file can't take without re-encoding"""
+
+
+def normalize_language(value):
+    """ISO 639-2 code from a two- or three-letter language code"""
+    code = (value or '').strip().lower()
+    if len(code) == 2 and code in LANGUAGE_CODES:
+        return LANGUAGE_CODES[code]
+    if len(code) == 3 and code.isalpha():
+        return code
+    raise MetadataError(f"'{value}' isn't a language code. Use one like en or eng.")
+
+
+def container_extension(info, file_name=None):
+    """Extension to write an edited copy with, so the container stays the same"""
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension:
+        return extension
+    extension = FORMAT_EXTENSIONS.get(info.format_name, '.mkv')
+    if extension == '.mp4' and not info.video:
+        return '.m4a'
+    return extension
+
+
+def _image_mimetype(path):
+    return 'image/png' if path.lower().endswith('.png') else 'image/jpeg'
+
+
+def describe_metadata(info):
+    """What the editor can change, read from probe data"""
+    tags = {key.lower(): value for key, value in (info.tags or {}).items()}
+    return {
+        'tags': {key: tags[key] for key in EDITABLE_TAGS if tags.get(key)},
+        'languages': [s.language or 'und' for s in info.audio_streams],
+        'rotation': info.video.rotation if info.video else None,
+        'cover': any(s.attached_pic for s in info.streams)
+    }
+
+
+class MetadataEditor:
+    """Tag, language, rotation and cover art edits by container rewrite.
+
+    Every stream is copied as it is; only the container's headers change.
+    Rotation is written to the display matrix, so players turn the picture
+    without a single frame being decoded. Even multi-GB files take about
+    as long as copying them once (twice for MP4, where the index is moved
+    to the front so the result streams before it has fully downloaded).
+    """
+
+    def __init__(self, runner=None, media=None):
+        self.runner = runner or ffmpeg_runner
+        self.media = media or media_info
+
+    async def read_metadata(self, path):
+        """describe_metadata() for a local file"""
+        return describe_metadata(await self.media.get(path))
+
+    async def write_metadata(self, input_path, output_path, tags=None, language=None,
+                             rotation=None, cover_path=None):
+        """Write an edited copy of a file
+
+        tags: {tag: value} of EDITABLE_TAGS; an empty value removes the tag
+        language: ISO 639-2 code for every audio stream
+        rotation: clockwise display rotation (0, 90, 180 or 270) of the video
+        cover_path: image that replaces any existing cover art
+        Raises MetadataError for an edit the container can't take; returns
+        False if ffmpeg fails.
+        """
+        info = await self.media.get(input_path)
+        extension = os.path.splitext(output_path)[1].lower()
+        if cover_path and extension not in COVER_EXTENSIONS:
+            raise MetadataError(f"{extension.lstrip('.').upper() or 'This'} files can't hold cover art.")
+        if rotation is not None and not info.video:
+            raise MetadataError("Only videos can be rotated.")
+
+        input_kwargs = {}
+        if rotation is not None:
+            # Counter-clockwise, and set on the input so it survives the copy
+            input_kwargs[f'display_rotation:{info.video.index}'] = -rotation % 360
+        source = ffmpeg.input(input_path, **input_kwargs)
+
+        # A new cover replaces the old one rather than adding a second
+        streams = [
+            source[str(s.index)] for s in info.streams
+            if s.codec_type in MAPPED_STREAM_TYPES and not (cover_path and s.attached_pic)
+        ]
+        options = {'c': 'copy', 'map_metadata': 0}
+        if cover_path and extension in ATTACHMENT_EXTENSIONS:
+            # Matroska keeps cover art as a file attachment, after the mapped streams
+            options['attach'] = cover_path
+            options[f'metadata:s:{len(streams)}'] = f"mimetype={_image_mimetype(cover_path)}"
+        elif cover_path:
+            streams.append(ffmpeg.input(cover_path)['0'])
+            options[f'disposition:{len(streams) - 1}'] = 'attached_pic'
+            if extension == '.mp3':
+                options['id3v2_version'] = 3
+        # The index only keeps the option names distinct; all are global tags
+        for key, value in (tags or {}).items():
+            options[f'metadata:g:{EDITABLE_TAGS.index(key)}'] = f"{key}={value}"
+        if language:
+            options['metadata:s:a'] = f"language={language}"
+        if extension in FASTSTART_EXTENSIONS:
+            options['movflags'] = '+faststart'
+
+        try:
+            stream = ffmpeg.output(*streams, output_path, **options).overwrite_output()
+            await self.runner.run(stream)
+            return True
+        except ffmpeg.Error as e:
+            record_failure('edit_metadata', "Error writing metadata", e)
+            return False
+
+# Global instance
+metadata_editor = MetadataEditor()
+
+# Convenience functions
+async def read_metadata(*args, **kwargs):
+    return await metadata_editor.read_metadata(*args, **kwargs)
+
+async def write_metadata(*args, **kwargs):
+    return await metadata_editor.write_metadata(*args, **kwargs)
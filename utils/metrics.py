@@ -0,0 +1,278 @@
+"""In-process metrics with a Prometheus text-format endpoint.
+
+Metrics live in plain dicts keyed by label values, so recording is a dict
+update on the hot path. The endpoint renders them on request:
+
+    curl http://127.0.0.1:9400/metrics
+"""
+import asyncio
+import logging
+import math
+import time
+from contextlib import contextmanager
+
+from config.config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a quick probe up to an hour-long encode
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        return [
+            f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is computed when scraped"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Compute the (unlabelled) value with function() at scrape time"""
+        self.function = function
+
+    def _samples(self):
+        if self.function is None:
+            return super()._samples()
+        try:
+            value = self.function()
+        except Exception:
+            logger.exception("Gauge %s failed", self.name)
+            return []
+        return [f"{self.name} {_number(value)}"]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry['counts'][i] += 1
+                break
+        entry['sum'] += value
+        entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, whether or not it raises"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        for key, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry['counts']):
+                cumulative += count
+                le = (('le', _number(bound)),)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(entry['sum'])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {entry['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+phase_seconds = registry.register(Histogram(
+    'video_bot_phase_seconds',
+    "Time spent per operation phase (queue_wait, download, probe, encode, upload)",
+    labels=('operation', 'phase')
+))
+operation_seconds = registry.register(Histogram(
+    'video_bot_operation_seconds',
+    "End-to-end time of tracked jobs",
+    labels=('operation', 'outcome')
+))
+ffmpeg_failures = registry.register(Counter(
+    'video_bot_ffmpeg_failures_total',
+    "Failed ffmpeg/ffprobe runs by error class",
+    labels=('operation', 'error')
+))
+operation_failures = registry.register(Counter(
+    'video_bot_operation_failures_total',
+    "Media and archive operations that returned a failure",
+    labels=('operation',)
+))
+cache_requests = registry.register(Counter(
+    'video_bot_result_cache_requests_total',
+    "Result cache lookups",
+    labels=('result',)
+))
+jobs_in_flight = registry.register(Gauge(
+    'video_bot_jobs_in_flight',
+    "Tracked jobs that are pending or running"
+))
+encodes_running = registry.register(Gauge(
+    'video_bot_encodes_running',
+    "Encodes holding a scheduler slot"
+))
+encodes_waiting = registry.register(Gauge(
+    'video_bot_encodes_waiting',
+    "Encodes waiting for a scheduler slot"
+))
+temp_disk_bytes = registry.register(Gauge(
+    'video_bot_temp_disk_bytes',
+    "Bytes used in TEMP_DIR and OUTPUT_DIR, as of the latest sweep or quota check"
+))
+
+# stderr fragment -> error class, first match wins
+FFMPEG_ERROR_CLASSES = [
+    ('No space left on device', 'disk_full'),
+    ('No such file or directory', 'missing_input'),
+    ('Invalid data found when processing input', 'invalid_data'),
+    ('moov atom not found', 'invalid_data'),
+    ('Unknown encoder', 'codec'),
+    ('Encoder not found', 'codec'),
+    ('Decoder not found', 'codec'),
+    ('not currently supported in container', 'codec'),
+    ('Error initializing filter', 'filter'),
+    ('No such filter', 'filter'),
+    ('Permission denied', 'io'),
+    ('Input/output error', 'io'),
+    ('Connection timed out', 'io'),
+    ('Killed', 'killed')
+]
+
+
+def classify_ffmpeg_error(stderr):
+    """Short error class for an ffmpeg failure, from its stderr"""
+    text = stderr.decode('utf-8', errors='replace') if isinstance(stderr, bytes) else (stderr or '')
+    for fragment, error_class in FFMPEG_ERROR_CLASSES:
+        if fragment in text:
+            return error_class
+    return 'other'
+
+
+def record_failure(operation, message, error):
+    """Log and count an operation that is about to return a failure"""
+    logger.error("%s: %s", message, error)
+    operation_failures.inc(operation=operation)
+
+
+def job_operation():
+    """Operation label for the job the current task belongs to"""
+    from utils.job_registry import current_job
+    job = current_job.get()
+    return getattr(job, 'operation', None) or 'unknown'
+
+
+async def _handle(reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        # Drain the headers; nothing in them matters here
+        while (await asyncio.wait_for(reader.readline(), 5)).strip():
+            pass
+        parts = request.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', registry.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            status, body, content_type = '404 Not Found', b'not found\n', 'text/plain'
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics on the running loop; returns the server, or None if disabled"""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("Metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,205 @@
+"""Conversation state that survives restarts and is shared between replicas.
+
+RedisPersistence keeps user_data, chat_data and conversation states in
+Redis hashes. Each replica holds a local copy and only goes back to Redis
+for an entry another replica has changed, which it learns about over a
+pub/sub channel, so ordinary updates cost no round trip. Writes from one
+persistence cycle are batched into a single pipeline.
+
+build_persistence() falls back to a local pickle file when Redis is not
+reachable.
+"""
+import asyncio
+import logging
+import pickle
+import uuid
+from collections import defaultdict
+
+from telegram.ext import BasePersistence, PersistenceInput, PicklePersistence
+
+from config.config import (
+    REDIS_URL, PERSISTENCE_FILE, PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_PREFIX
+)
+
+logger = logging.getLogger(__name__)
+
+# bot_data holds live objects (servers, tasks); only per-user/chat state is kept
+STORE_DATA = PersistenceInput(bot_data=False, chat_data=True, user_data=True, callback_data=False)
+
+
+def _dumps(value):
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(value):
+    return pickle.loads(value)
+
+
+class RedisPersistence(BasePersistence):
+    """BasePersistence on Redis with pub/sub invalidation and batched writes"""
+
+    def __init__(self, url=REDIS_URL, prefix=PERSISTENCE_PREFIX, store_data=STORE_DATA,
+                 update_interval=PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        import redis.asyncio as aioredis
+        self._redis = aioredis.Redis.from_url(url)
+        self.prefix = prefix
+        self.instance = uuid.uuid4().hex
+        self.channel = f"{prefix}:invalidate"
+        # Last bytes written or read per (kind, id), to skip writes that change nothing
+        self._written = {}
+        self._stale = set()
+        self._pending = {}
+        self._flush_task = None
+        self._listener = None
+
+    def _key(self, kind):
+        return f"{self.prefix}:{kind}"
+
+    async def _load_hash(self, kind):
+        self._start_listener()
+        raw = await self._redis.hgetall(self._key(kind))
+        data = {}
+        for field, value in raw.items():
+            entity_id = _loads(field)
+            data[entity_id] = _loads(value)
+            self._written[(kind, entity_id)] = value
+        return data
+
+    async def get_user_data(self):
+        return defaultdict(dict, await self._load_hash('user_data'))
+
+    async def get_chat_data(self):
+        return defaultdict(dict, await self._load_hash('chat_data'))
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await self._load_hash(f"conversations:{name}")
+
+    async def update_user_data(self, user_id, data):
+        self._queue('user_data', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._queue('chat_data', chat_id, data)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._queue(f"conversations:{name}", key, new_state, drop=new_state is None)
+
+    async def drop_user_data(self, user_id):
+        self._queue('user_data', user_id, None, drop=True)
+
+    async def drop_chat_data(self, chat_id):
+        self._queue('chat_data', chat_id, None, drop=True)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh('user_data', user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh('chat_data', chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        await self._write_pending()
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await self._redis.aclose()
+
+    async def _refresh(self, kind, entity_id, data):
+        # Only entries another replica changed are fetched again
+        if (kind, entity_id) not in self._stale:
+            return
+        self._stale.discard((kind, entity_id))
+        value = await self._redis.hget(self._key(kind), _dumps(entity_id))
+        data.clear()
+        if value is not None:
+            data.update(_loads(value))
+            self._written[(kind, entity_id)] = value
+        else:
+            self._written.pop((kind, entity_id), None)
+
+    def _queue(self, kind, entity_id, data, drop=False):
+        value = None if drop else _dumps(data)
+        if not drop and self._written.get((kind, entity_id)) == value:
+            return
+        self._pending[(kind, entity_id)] = value
+        if self._flush_task is None or self._flush_task.done():
+            # PTB updates every changed entry in one gather(); writing once
+            # they have all queued turns the cycle into a single pipeline
+            self._flush_task = asyncio.ensure_future(self._write_soon())
+
+    async def _write_soon(self):
+        await asyncio.sleep(0)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for (kind, entity_id), value in pending.items():
+                field = _dumps(entity_id)
+                if value is None:
+                    pipe.hdel(self._key(kind), field)
+                    self._written.pop((kind, entity_id), None)
+                else:
+                    pipe.hset(self._key(kind), field, value)
+                    self._written[(kind, entity_id)] = value
+                pipe.publish(self.channel, _dumps((self.instance, kind, entity_id)))
+            try:
+                await pipe.execute()
+            except Exception:
+                # Keep the writes for the next cycle rather than losing them
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+                raise
+
+    def _start_listener(self):
+        if self._listener is None:
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message.get('type') != 'message':
+                            continue
+                        instance, kind, entity_id = _loads(message['data'])
+                        if instance != self.instance:
+                            self._stale.add((kind, entity_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Persistence invalidation listener failed, retrying: %s", e)
+                # Whatever changed meanwhile is unknown, so distrust every copy
+                self._stale.update(self._written)
+                await asyncio.sleep(5)
+
+
+def build_persistence():
+    """Redis persistence when REDIS_URL answers, a local pickle file otherwise"""
+    import redis
+    try:
+        redis.Redis.from_url(REDIS_URL, socket_connect_timeout=2).ping()
+        logger.info("Persisting conversation state in Redis")
+        return RedisPersistence()
+    except (redis.RedisError, OSError) as e:
+        logger.warning("Redis unavailable (%s), persisting to %s", e, PERSISTENCE_FILE)
+        return PicklePersistence(
+            PERSISTENCE_FILE, store_data=STORE_DATA, update_interval=PERSISTENCE_UPDATE_INTERVAL
+        )
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+from config.config import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES, INDEX_SAVE_DELAY
+from utils.file_utils import IndexWriter
+
+logger = logging.getLogger(__name__)
+
+_TIME_PATTERN = re.compile(r'^\d+(:\d{1,2}){1,2}(\.\d+)?$')
+
+
+# Parameters naming a choice from a fixed set, which match case-insensitively
+ENUM_PARAMS = {'format', 'mode', 'preset'}
+
+# Parameters holding Telegram file_unique_ids, file names or user text,
+# where case and spelling matter and values are kept exactly as they are
+VERBATIM_PARAMS = {'inputs', 'subtitles', 'cover', 'names', 'edit'}
+
+
+def normalize_params(params, name=None):
+    """Canonical form of operation parameters, so equivalent requests share a key
+
+    '00:01:30' and 90 both become 90.0, numbers are rounded to milliseconds
+    and strings are trimmed. Only enum-like parameters (ENUM_PARAMS) are
+    lower-cased; identifiers and free text (VERBATIM_PARAMS) are left alone.
+    """
+    if name in VERBATIM_PARAMS:
+        return params
+    if isinstance(params, dict):
+        return {str(k): normalize_params(v, str(k)) for k, v in sorted(params.items())}
+    if isinstance(params, (list, tuple)):
+        return [normalize_params(v, name) for v in params]
+    if isinstance(params, bool) or params is None:
+        return params
+    if isinstance(params, (int, float)):
+        return round(float(params), 3)
+    value = str(params).strip()
+    if name in ENUM_PARAMS:
+        return value.lower()
+    if _TIME_PATTERN.match(value):
+        seconds = 0.0
+        for part in value.split(':'):
+            seconds = seconds * 60 + float(part)
+        return round(seconds, 3)
+    try:
+        return round(float(value), 3)
+    except ValueError:
+        return value
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, for inputs without a Telegram file_unique_id"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Size-bounded, LRU-evicted cache of operation results.
+
+    Each entry maps (source identity, operation, normalized parameters) to
+    the Telegram file_ids of the uploaded results, plus optional local
+    copies. A hit lets the bot resend by file_id, skipping download,
+    processing and upload entirely. Copies are made and the index is
+    written off the event loop, the index batched like the file registry's.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES,
+                 max_entries=RESULT_CACHE_MAX_ENTRIES, save_delay=INDEX_SAVE_DELAY):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._index = None
+        self._writer = IndexWriter(self.index_path, self._snapshot, save_delay)
+
+    @staticmethod
+    def key(source_id, operation, params=None):
+        payload = json.dumps(
+            {'source': source_id, 'operation': operation, 'params': normalize_params(params or {})},
+            sort_keys=True, separators=(',', ':')
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._load()
+        return self._index
+
+    def get(self, key):
+        """Return the cached entry for key or None"""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        # Local copies may have been removed behind our back
+        entry['paths'] = [p for p in entry.get('paths', []) if os.path.exists(p)]
+        entry['last_used'] = time.time()
+        return entry
+
+    async def put(self, key, file_ids, paths=None, kind='document', note=None):
+        """Record the uploaded results of an operation
+
+        paths: local result files to keep a copy of (hard-linked when possible)
+        note: free-form extra info to return on a hit, e.g. trim mode
+        """
+        # A copy across filesystems can take a while
+        stored, size = await asyncio.get_running_loop().run_in_executor(
+            None, self._store, key, paths or []
+        )
+        self.index[key] = {
+            'file_ids': list(file_ids),
+            'paths': stored,
+            'size': size,
+            'kind': kind,
+            'note': note,
+            'last_used': time.time()
+        }
+        self._evict()
+        self._save()
+
+    def _store(self, key, paths):
+        entry_dir = os.path.join(self.cache_dir, key[:2], key)
+        stored, size = [], 0
+        for path in paths:
+            os.makedirs(entry_dir, exist_ok=True)
+            target = os.path.join(entry_dir, os.path.basename(path))
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+            stored.append(target)
+            size += os.path.getsize(target)
+        return stored, size
+
+    def discard(self, key):
+        entry = self.index.pop(key, None)
+        if entry:
+            self._remove_files(key)
+            self._save()
+
+    def total_bytes(self):
+        return sum(entry.get('size', 0) for entry in self.index.values())
+
+    def _evict(self):
+        by_age = sorted(self.index.items(), key=lambda item: item[1].get('last_used', 0))
+        total = self.total_bytes()
+        count = len(self.index)
+        for key, entry in by_age:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            self.index.pop(key, None)
+            self._remove_files(key)
+            total -= entry.get('size', 0)
+            count -= 1
+
+    def _remove_files(self, key):
+        shutil.rmtree(os.path.join(self.cache_dir, key[:2], key), ignore_errors=True)
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable result cache index: %s", e)
+            return {}
+
+    def _save(self):
+        self._writer.save()
+
+    async def flush(self):
+        """Write out index changes still waiting to be batched"""
+        await self._writer.flush()
+
+    def _snapshot(self):
+        if self._index is None:
+            return None
+        # Entries only ever have existing keys updated, so a shallow copy
+        # is enough to serialise the index from another thread
+        return dict(self._index)
+
+
+# Global instance
+result_cache = ResultCache()
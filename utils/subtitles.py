@@ -0,0 +1,248 @@
+"""Subtitle tracks: validation, language tags and cached burn-in overlays"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+
+from config.config import (
+    SUBTITLE_FORMATS, SUBTITLE_OVERLAY_DIR, SUBTITLE_OVERLAY_MAX_ENTRIES, ORPHAN_MAX_AGE
+)
+
+logger = logging.getLogger(__name__)
+
+# Frame rate of pre-rendered overlays; cue changes snap to 1/OVERLAY_FPS s
+OVERLAY_FPS = 10
+
+# Two-letter codes (as in "movie.en.srt") to the ISO 639-2 codes containers use
+LANGUAGE_CODES = {
+    'en': 'eng', 'es': 'spa', 'fr': 'fra', 'de': 'deu', 'it': 'ita', 'pt': 'por',
+    'ru': 'rus', 'ar': 'ara', 'hi': 'hin', 'bn': 'ben', 'pa': 'pan', 'ur': 'urd',
+    'zh': 'zho', 'ja': 'jpn', 'ko': 'kor', 'tr': 'tur', 'fa': 'fas', 'id': 'ind',
+    'nl': 'nld', 'pl': 'pol', 'uk': 'ukr', 'vi': 'vie', 'th': 'tha', 'he': 'heb'
+}
+
+# Encodings tried in order for SRT files that aren't UTF-8
+SRT_ENCODINGS = ('utf-8-sig', 'cp1252', 'latin-1')
+
+_LANGUAGE_SUFFIX = re.compile(r'[._-]([a-z]{2,3})$', re.IGNORECASE)
+_ASS_TIME = re.compile(r'^(\d+):(\d{2}):(\d{2})[.,](\d{1,3})$')
+
+
+class SubtitleError(Exception):
+    """Raised for a subtitle file that can't be used"""
+
+
+@dataclass
+class SubtitleTrack:
+    path: str
+    format: str
+    language: str = None
+    title: str = None
+    cues: int = 0
+    # When the last cue ends, in seconds
+    end: float = 0.0
+
+
+def guess_language(filename):
+    """ISO 639-2 language from a name like 'movie.en.srt', or None"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    match = _LANGUAGE_SUFFIX.search(stem)
+    if not match:
+        return None
+    code = match.group(1).lower()
+    if len(code) == 3 and code in LANGUAGE_CODES.values():
+        return code
+    return LANGUAGE_CODES.get(code)
+
+
+def validate_srt(path, output_path):
+    """Parse an SRT file strictly and write it back as clean UTF-8
+
+    Returns (cue count, end of the last cue in seconds). Raises
+    SubtitleError if the file can't be parsed, has no cues or has cues
+    that end before they start.
+    """
+    import pysrt
+
+    items = None
+    for encoding in SRT_ENCODINGS:
+        try:
+            items = pysrt.open(path, encoding=encoding, error_handling=pysrt.ERROR_RAISE)
+            break
+        except UnicodeDecodeError:
+            continue
+        except pysrt.Error as e:
+            block = e.args[0] if e.args else '?'
+            raise SubtitleError(f"Invalid SRT: couldn't read subtitle block {block}")
+    if items is None:
+        raise SubtitleError("Couldn't detect the SRT file's text encoding")
+    if not items:
+        raise SubtitleError("The SRT file has no subtitles")
+
+    for item in items:
+        if item.end < item.start:
+            raise SubtitleError(f"Subtitle {item.index} ends before it starts")
+    # Players cope badly with out-of-order cues
+    items.sort()
+    items.clean_indexes()
+    items.save(output_path, encoding='utf-8')
+    return len(items), max(item.end.ordinal for item in items) / 1000
+
+
+def _ass_seconds(value):
+    match = _ASS_TIME.match(value.strip())
+    if not match:
+        raise SubtitleError(f"Invalid ASS time: {value.strip()}")
+    hours, minutes, seconds, fraction = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(fraction) / 10 ** len(fraction)
+
+
+def validate_ass(path):
+    """Check an ASS/SSA file's header and events
+
+    Returns (cue count, end of the last cue in seconds).
+    """
+    with open(path, 'rb') as f:
+        text = f.read().decode('utf-8-sig', errors='replace')
+    if '[Script Info]' not in text:
+        raise SubtitleError("Invalid ASS: missing [Script Info]")
+
+    # Event fields are named by the section's Format line; Start/End are standard
+    fields = ['layer', 'start', 'end']
+    cues, end = 0, 0.0
+    in_events = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            in_events = line.lower() == '[events]'
+        elif in_events and line.lower().startswith('format:'):
+            fields = [name.strip().lower() for name in line[len('format:'):].split(',')]
+        elif in_events and line.startswith('Dialogue:'):
+            values = line[len('Dialogue:'):].split(',', len(fields) - 1)
+            try:
+                start = _ass_seconds(values[fields.index('start')])
+                stop = _ass_seconds(values[fields.index('end')])
+            except (ValueError, IndexError):
+                raise SubtitleError(f"Invalid ASS event: {line[:60]}")
+            if stop < start:
+                raise SubtitleError(f"ASS event ends before it starts: {line[:60]}")
+            cues += 1
+            end = max(end, stop)
+    if not cues:
+        raise SubtitleError("The ASS file has no subtitles")
+    return cues, end
+
+
+def prepare_track(path, work_dir, name=None, language=None, title=None):
+    """Validate a subtitle file and return a SubtitleTrack ready to mux or burn"""
+    name = name or os.path.basename(path)
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in SUBTITLE_FORMATS:
+        raise SubtitleError(f"Unsupported subtitle format: {extension or name}")
+
+    if extension == '.srt':
+        fmt = 'srt'
+        clean_path = os.path.join(work_dir, f"{hashlib.sha1(path.encode()).hexdigest()[:12]}.srt")
+        cues, end = validate_srt(path, clean_path)
+        path = clean_path
+    else:
+        fmt = 'ass'
+        cues, end = validate_ass(path)
+
+    return SubtitleTrack(
+        path=path,
+        format=fmt,
+        language=language or guess_language(name),
+        title=title,
+        cues=cues,
+        end=end
+    )
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class OverlayCache:
+    """Pre-rendered subtitle overlays, keyed by subtitle content and frame size.
+
+    An overlay is the subtitles alone, drawn on a transparent canvas as a
+    QuickTime RLE video. Burning the same subtitles into several videos of
+    one resolution then renders them once and only overlays afterwards.
+    """
+
+    def __init__(self, directory=SUBTITLE_OVERLAY_DIR, max_entries=SUBTITLE_OVERLAY_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._pending = {}
+
+    def key(self, track, width, height, rotation=0):
+        return f"{file_digest(track.path)[:32]}_{width}x{height}_r{rotation}_{OVERLAY_FPS}"
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.mov")
+
+    def get(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        # mtime doubles as last-used time for eviction
+        os.utime(path)
+        return path
+
+    async def get_or_render(self, key, render):
+        """Cached overlay for key, or the one render(path) writes
+
+        Concurrent requests for the same overlay share one render.
+        """
+        cached = self.get(key)
+        if cached:
+            return cached
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._render(key, render))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def _render(self, key, render):
+        os.makedirs(self.directory, exist_ok=True)
+        # Rendered beside the cache and moved in whole, so readers never see a partial file
+        partial = os.path.join(self.directory, f"{key}.{os.getpid()}.{time.monotonic_ns()}.tmp.mov")
+        try:
+            await render(partial)
+            os.replace(partial, self.path(key))
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self._evict()
+        return self.path(key)
+
+    def _evict(self):
+        overlays, stale = [], []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            mtime = entry.stat().st_mtime
+            if '.tmp.' not in entry.name:
+                overlays.append((mtime, entry.path))
+            elif now - mtime > ORPHAN_MAX_AGE:
+                # Left behind by a render that died with its process
+                stale.append(entry.path)
+        overlays.sort()
+        stale.extend(path for _, path in overlays[:max(0, len(overlays) - self.max_entries)])
+        for path in stale:
+            try:
+                os.remove(path)
+                logger.debug("Evicted subtitle overlay %s", path)
+            except OSError:
+                pass
+
+
+# Global instance
+overlay_cache = OverlayCache()
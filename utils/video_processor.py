@@ -1,121 +1,719 @@
+import asyncio
 import os
-import subprocess
-import tempfile
-from pathlib import Path
+import re
+import uuid
+from dataclasses import dataclass
 import ffmpeg
-from moviepy.editor import VideoFileClip
+from config.config import (
+    PARALLEL_ENCODE_MIN_DURATION, PARALLEL_CHUNK_MIN_SECONDS, CHUNK_ENCODE_THREADS,
+    UPLOAD_LIMIT
+)
+from utils.ffmpeg_runner import ffmpeg_runner
+from utils.job_registry import current_job
+from utils.metrics import record_failure
+from utils.media_info import media_info
+from utils.file_utils import workspace_manager
+from utils.encode_scheduler import encode_scheduler
+from utils.subtitles import OVERLAY_FPS, SubtitleTrack, overlay_cache, prepare_track
+
+# Above this many timestamps a single decode pass beats per-timestamp seeking
+SEEK_BATCH_LIMIT = 8
+
+# Smart thumbnails: candidates scored per video, and the closest they get
+SMART_THUMBNAIL_CANDIDATES = 240
+SMART_THUMBNAIL_MIN_INTERVAL = 0.5  # seconds
+# Above this duration only keyframes are decoded for candidates
+SMART_THUMBNAIL_KEYFRAME_DURATION = 600  # seconds
+_SHOWINFO_TIME = re.compile(r'\bn:\s*\d+\s+pts:\s*-?\d+\s+pts_time:(-?[\d.]+)')
+
+# Encoders able to produce parts that splice into a stream-copied GOP run
+SMART_CUT_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265'
+}
+KEYFRAME_TOLERANCE = 0.01  # seconds
+# Cut times are moved this far back so rounding can't put them past their keyframe
+CUT_TIME_EPSILON = 0.0005  # seconds
+
+# Headroom left under a size limit for container overhead
+SIZE_SPLIT_MARGIN = 0.03
+
+# Audio codecs a merge can normalize to, by ffprobe codec name
+AUDIO_ENCODERS = {
+    'aac': 'aac',
+    'mp3': 'libmp3lame',
+    'opus': 'libopus',
+    'vorbis': 'libvorbis',
+    'ac3': 'ac3',
+    'flac': 'flac'
+}
+
+# ffprobe profile names the encoders accept, as encoder profile names
+ENCODER_PROFILES = {
+    'baseline': 'baseline',
+    'constrained baseline': 'baseline',
+    'main': 'main',
+    'high': 'high',
+    'main 10': 'main10'
+}
+
+@dataclass(frozen=True)
+class MergeTarget:
+    """Stream parameters every part of a stream-copy merge has to share"""
+    codec: str
+    profile: str
+    width: int
+    height: int
+    pix_fmt: str
+    fps: float
+    time_base: str
+    audio_codec: str = None
+    sample_rate: int = None
+    channels: int = None
+
+    @classmethod
+    def from_info(cls, info):
+        video, audio = info.video, info.audio
+        return cls(
+            codec=video.codec_name,
+            profile=(video.profile or '').lower() or None,
+            width=video.width,
+            height=video.height,
+            pix_fmt=video.pix_fmt,
+            fps=round(video.fps, 3) if video.fps else None,
+            time_base=video.time_base,
+            audio_codec=audio.codec_name if audio else None,
+            sample_rate=audio.sample_rate if audio else None,
+            channels=audio.channels if audio else None
+        )
+
+    @property
+    def encodable(self):
+        # Without a probed frame rate there is no rate to normalize the others to
+        return self.codec in SMART_CUT_ENCODERS and self.fps is not None and (
+            self.audio_codec is None or self.audio_codec in AUDIO_ENCODERS
+        )
+
+
+def plan_merge(infos):
+    """Pick the merge target and the inputs that must be re-encoded to match it
+
+    The target is the parameter set covering the most running time among
+    those we can encode to, so as much as possible is stream-copied.
+    Returns (MergeTarget, indices of inputs to normalize).
+    """
+    weights = {}
+    targets = []
+    for info in infos:
+        target = MergeTarget.from_info(info) if info.video else None
+        targets.append(target)
+        if target is not None and target.encodable:
+            weights[target] = weights.get(target, 0) + (info.duration or 0) + 1
+
+    if weights:
+        chosen = max(weights, key=weights.get)
+    else:
+        # Nothing to copy: re-encode everything as H.264/AAC, shaped like the
+        # first video and at the first probed frame rate (VFR and some WebM
+        # files have none)
+        first = next(info.video for info in infos if info.video)
+        fps = next((info.video.fps for info in infos if info.video and info.video.fps), 30)
+        has_audio = any(info.audio for info in infos)
+        chosen = MergeTarget(
+            codec='h264', profile='high', width=first.width, height=first.height,
+            pix_fmt='yuv420p', fps=round(fps, 3), time_base=None,
+            audio_codec='aac' if has_audio else None,
+            sample_rate=48000 if has_audio else None,
+            channels=2 if has_audio else None
+        )
+    return chosen, [i for i, target in enumerate(targets) if target != chosen]
+
+def parse_time(value):
+    """Convert seconds or [HH:]MM:SS[.ms] to float seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def _keyframe_cut_points(duration, segment_duration, keyframes):
+    """Snap every multiple of segment_duration to its nearest keyframe"""
+    if not duration or not keyframes or segment_duration <= 0:
+        return []
+    cut_points = []
+    target = segment_duration
+    while target < duration:
+        nearest = min(keyframes, key=lambda k: abs(k - target))
+        if nearest > (cut_points[-1] if cut_points else 0) + KEYFRAME_TOLERANCE:
+            cut_points.append(nearest)
+        target += segment_duration
+    return cut_points
+
+def _segment_times(cut_points):
+    """segment_times value that cuts on each keyframe in cut_points"""
+    return ','.join(f"{max(0, t - CUT_TIME_EPSILON):.6f}" for t in cut_points)
+
+def _bytes_before(packets, times):
+    """Total packet bytes before each of the (sorted) times"""
+    result = []
+    total = 0
+    i = 0
+    for t in times:
+        while i < len(packets) and packets[i][0] < t - KEYFRAME_TOLERANCE:
+            total += packets[i][1]
+            i += 1
+        result.append(total)
+    return result
+
+def _size_cut_points(packets, keyframes, max_bytes):
+    """Cut at the last keyframe before each part would outgrow max_bytes
+
+    A GOP bigger than max_bytes on its own can't be split by stream copy,
+    so that part is cut at the next keyframe and comes out oversized.
+    """
+    budget = max_bytes * (1 - SIZE_SPLIT_MARGIN)
+    keyframes = [k for k in keyframes if k > KEYFRAME_TOLERANCE]
+    offsets = _bytes_before(packets, keyframes)
+    
+    cut_points = []
+    part_start = 0
+    candidate = None
+    for keyframe, offset in zip(keyframes, offsets):
+        if offset - part_start <= budget:
+            candidate = (keyframe, offset)
+            continue
+        cut, cut_offset = candidate or (keyframe, offset)
+        cut_points.append(cut)
+        part_start = cut_offset
+        candidate = None
+        if cut != keyframe:
+            if offset - part_start <= budget:
+                candidate = (keyframe, offset)
+            else:
+                # The GOP right after the cut is oversized too
+                cut_points.append(keyframe)
+                part_start = offset
+    # The bytes after the last keyframe have to fit in the final part too
+    total = sum(p[1] for p in packets)
+    if total - part_start > budget and candidate and candidate[1] > part_start:
+        cut_points.append(candidate[0])
+    return cut_points
+
+def _sync_points(packets, info):
+    """Keyframe times of the video stream, or of any stream without video"""
+    if info.keyframes:
+        return info.keyframes
+    index = info.video.index if info.video else None
+    return [p[0] for p in packets if p[3] and (index is None or p[2] == index)]
+
+def _part_sizes(packets, cut_points):
+    total = sum(p[1] for p in packets)
+    offsets = [0] + _bytes_before(packets, cut_points) + [total]
+    return [b - a for a, b in zip(offsets, offsets[1:])]
+
+# Subtitle codecs that are text, and so convert between containers losslessly
+TEXT_SUBTITLE_CODECS = {'subrip', 'srt', 'ass', 'ssa', 'mov_text', 'webvtt', 'text'}
+
+def _subtitle_codec(codec_name, output_path):
+    """Codec for a subtitle stream in the output, or None if it can't go there
+
+    MP4 only carries mov_text; Matroska takes SRT and ASS as they are.
+    """
+    if output_path.lower().endswith(('.mp4', '.m4v', '.mov')):
+        return 'mov_text' if codec_name in TEXT_SUBTITLE_CODECS else None
+    if codec_name == 'mov_text':
+        return 'srt'
+    return 'copy'
+
+def soft_subtitle_extension(info, tracks):
+    """'.mp4' when the video and every track fit in MP4, '.mkv' otherwise
+
+    ASS styling doesn't survive conversion to mov_text, so it needs Matroska.
+    """
+    mp4 = (info.format_name or '').startswith('mov')
+    if not mp4 or any(track.format == 'ass' for track in tracks):
+        return '.mkv'
+    return '.mp4'
+
+def _numbered_files(output_dir, prefix, count):
+    """prefix_1.jpg ... prefix_<count>.jpg, as the image2 muxer numbers them"""
+    return [os.path.join(output_dir, f"{prefix}_{i}.jpg") for i in range(1, count + 1)]
 
 class VideoProcessor:
-    def __init__(self):
-        self.temp_dir = "temp"
-        os.makedirs(self.temp_dir, exist_ok=True)
+    def __init__(self, runner=None, media=None, workspaces=None, scheduler=None):
+        self.runner = runner or ffmpeg_runner
+        self.media = media or media_info
+        self.workspaces = workspaces or workspace_manager
+        self.scheduler = scheduler or encode_scheduler
     
     async def extract_thumbnail(self, video_path, output_path, time='00:00:01'):
         """Extract thumbnail from video at specific time"""
         try:
-            (
+            stream = (
                 ffmpeg
                 .input(video_path, ss=time)
                 .output(output_path, vframes=1)
                 .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
             )
+            await self.runner.run(stream)
             return True
         except ffmpeg.Error as e:
-            print(f"Error extracting thumbnail: {e}")
+            record_failure('extract_thumbnail', "Error extracting thumbnail", e)
             return False
     
-    async def extract_multiple_thumbnails(self, video_path, output_dir, intervals=5):
+    async def extract_frames(self, video_path, output_dir, times=None, interval=None,
+                             prefix='frame', mode='auto', contact_sheet=None, width=None):
+        """Extract many frames with a single ffmpeg process
+
+        times: timestamps (seconds or HH:MM:SS) to grab
+        interval: grab one frame every `interval` seconds instead of `times`
+        mode: 'seek' opens one fast-seeked input per timestamp, 'select' decodes
+              the video once and keeps the matching frames, 'keyframes' decodes
+              keyframes only, 'auto' seeks for a handful of timestamps
+        contact_sheet: (columns, rows) to tile the frames into contact sheets
+        """
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            seconds = [parse_time(t) for t in times or []]
+
+            if mode == 'auto':
+                few = 0 < len(seconds) <= SEEK_BATCH_LIMIT
+                mode = 'seek' if few and not interval and not contact_sheet else 'select'
+
+            if mode == 'seek':
+                # One process, one demuxer per timestamp, no full decode
+                outputs = []
+                output_files = _numbered_files(output_dir, prefix, len(seconds))
+                for ts, output_file in zip(seconds, output_files):
+                    output_kwargs = {'vframes': 1}
+                    if width:
+                        output_kwargs['vf'] = f"scale={width}:-2"
+                    outputs.append(
+                        ffmpeg.input(video_path, ss=ts)['v:0'].output(output_file, **output_kwargs)
+                    )
+                for output_file in output_files:
+                    # A file left over from an earlier run must not pass for this one's
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+                await self.runner.run(ffmpeg.merge_outputs(*outputs).overwrite_output())
+                # A seek past the end writes nothing for that timestamp
+                return [path for path in output_files if os.path.exists(path)]
+
+            if interval:
+                expr = f"isnan(prev_selected_t)+gte(t-prev_selected_t\\,{float(interval)})"
+            elif seconds:
+                # First frame at or after each timestamp
+                expr = '+'.join(
+                    f"gte(t\\,{ts})*(isnan(prev_pts)+lt(prev_pts*TB\\,{ts}))"
+                    for ts in seconds
+                )
+            else:
+                raise ValueError("times or interval is required")
+
+            filters = [f"select='{expr}'"]
+            if contact_sheet:
+                columns, rows = contact_sheet
+                filters.append(f"scale={width or 320}:-2")
+                filters.append(f"tile={columns}x{rows}")
+                prefix = f"{prefix}_sheet"
+            elif width:
+                filters.append(f"scale={width}:-2")
+            # One showinfo line per image written, so the files are known exactly
+            filters.append('showinfo')
+            written = []
+
+            def on_stderr(line):
+                if _SHOWINFO_TIME.search(line):
+                    written.append(line)
+
+            input_kwargs = {'skip_frame': 'nokey'} if mode == 'keyframes' else {}
+            stream = (
+                ffmpeg
+                .input(video_path, **input_kwargs)
+                .output(os.path.join(output_dir, f"{prefix}_%d.jpg"), **{
+                    'vf': ','.join(filters),
+                    'fps_mode': 'vfr'
+                })
+                .overwrite_output()
+            )
+            await self.runner.run(stream, on_stderr=on_stderr)
+            return _numbered_files(output_dir, prefix, len(written))
+        except Exception as e:
+            record_failure('extract_frames', "Error extracting frames", e)
+            return []
+    
+    async def extract_multiple_thumbnails(self, video_path, output_dir, intervals=5, contact_sheet=None):
         """Extract multiple thumbnails at regular intervals"""
         try:
             # Get video duration
-            probe = ffmpeg.probe(video_path)
-            duration = float(probe['streams'][0]['duration'])
+            info = await self.media.get(video_path)
+            duration = info.duration
             
             interval = duration / intervals
+            times = [i * interval for i in range(intervals)]
             
-            thumbnails = []
-            for i in range(intervals):
-                time = i * interval
-                output_file = os.path.join(output_dir, f"thumb_{i+1}.jpg")
-                
-                (
-                    ffmpeg
-                    .input(video_path, ss=time)
-                    .output(output_file, vframes=1)
-                    .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
-                thumbnails.append(output_file)
-            
-            return thumbnails
+            return await self.extract_frames(
+                video_path, output_dir, times=times, prefix='thumb', contact_sheet=contact_sheet
+            )
         except Exception as e:
-            print(f"Error extracting multiple thumbnails: {e}")
+            record_failure('extract_multiple_thumbnails', "Error extracting multiple thumbnails", e)
             return []
-    
-    async def trim_video(self, video_path, output_path, start_time, end_time):
-        """Trim video from start_time to end_time"""
+
+    async def smart_thumbnails(self, video_path, output_dir, count=3, width=None):
+        """Pick the best `count` frames and save them at full size
+
+        Candidates are sampled in one decode pass, downscaled to gray and
+        piped straight into NumPy, then scored for sharpness, exposure and
+        scene changes (see utils.frame_scoring). Long videos are sampled
+        from keyframes only so the pass never decodes every frame. The
+        winners are grabbed with one more process.
+        """
+        # NumPy is only loaded once someone asks for smart thumbnails
+        from utils import frame_scoring
+
         try:
-            (
+            info = await self.media.get(video_path)
+            duration = info.duration or 0
+            interval = max(duration / SMART_THUMBNAIL_CANDIDATES, SMART_THUMBNAIL_MIN_INTERVAL)
+            input_kwargs = {'skip_frame': 'nokey'} if duration > SMART_THUMBNAIL_KEYFRAME_DURATION else {}
+
+            times = []
+
+            def on_stderr(line):
+                # showinfo logs one "n: <i> pts: <pts> pts_time:<seconds>" line per frame
+                match = _SHOWINFO_TIME.search(line)
+                if match:
+                    times.append(float(match.group(1)))
+
+            filters = ','.join([
+                f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval})'",
+                'showinfo',
+                f"scale={frame_scoring.SCORE_WIDTH}:{frame_scoring.SCORE_HEIGHT}:flags=fast_bilinear"
+            ])
+            stream = (
                 ffmpeg
-                .input(video_path, ss=start_time, to=end_time)
-                .output(output_path)
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
+                .input(video_path, **input_kwargs)
+                .output('pipe:', **{
+                    'vf': filters,
+                    'fps_mode': 'vfr',
+                    'format': 'rawvideo',
+                    'pix_fmt': 'gray',
+                    'an': None,
+                    'sn': None
+                })
             )
-            return True
-        except ffmpeg.Error as e:
-            print(f"Error trimming video: {e}")
+            raw, _ = await self.runner.run(stream, on_stderr=on_stderr)
+
+            frames = frame_scoring.decode_frames(raw)[:len(times)]
+            if not len(frames):
+                raise ValueError("No frames decoded")
+            scores, scenes = frame_scoring.score_frames(frames)
+            picked = frame_scoring.pick_frames(scores, scenes, count)
+            return await self.extract_frames(
+                video_path, output_dir, times=[times[i] for i in picked], prefix='best', width=width
+            )
+        except Exception as e:
+            record_failure('smart_thumbnails', "Error picking thumbnails", e)
+            return []
+
+    async def trim_video(self, video_path, output_path, start_time, end_time, mode='auto'):
+        """Trim video from start_time to end_time
+
+        mode: 'copy' stream-copies (fast, start snaps to the previous keyframe),
+              'encode' re-encodes everything, 'smart' copies the whole GOPs
+              inside the range and re-encodes only the partial GOPs at each
+              end, 'auto' uses smart cutting whenever the codec allows it.
+
+        Returns the mode actually used, or False on failure.
+        """
+        try:
+            start = parse_time(start_time)
+            end = parse_time(end_time)
+            
+            if mode in ('auto', 'smart'):
+                info = await self.media.get(video_path)
+                video = info.video
+                encoder = SMART_CUT_ENCODERS.get(video.codec_name) if video else None
+                if encoder:
+                    # Only the keyframes up to the cut matter, so a trim near the
+                    # start of a long (or still downloading) file reads just the head
+                    keyframes = await self.media.keyframes(video_path, until=end + 1)
+                    return await self._smart_trim(video_path, output_path, start, end, video, encoder, keyframes)
+                mode = 'encode'
+            
+            source = ffmpeg.input(video_path, ss=start, to=end)
+            if mode == 'copy':
+                stream = source.output(output_path, c='copy', avoid_negative_ts='make_zero').overwrite_output()
+                await self.runner.run(stream)
+                return mode
+            
+            async with self.scheduler.encode('libx264', 'medium') as settings:
+                stream = source.output(output_path, **settings.output_options()).overwrite_output()
+                await self.runner.run(stream, limit=False)
+            return mode
+        except Exception as e:
+            record_failure('trim_video', "Error trimming video", e)
             return False
     
-    async def merge_videos(self, video_paths, output_path):
-        """Merge multiple videos"""
-        try:
-            # Create concat file
-            concat_file = os.path.join(self.temp_dir, "concat.txt")
+    async def _smart_trim(self, video_path, output_path, start, end, video, encoder, keyframes):
+        """Copy whole GOPs between start and end, re-encode the partial ones"""
+        inner = [k for k in keyframes if start - KEYFRAME_TOLERANCE <= k <= end + KEYFRAME_TOLERANCE]
+        if len(inner) < 2:
+            # No complete GOP inside the range, nothing to copy
+            async with self.scheduler.encode(encoder, 'fast') as settings:
+                stream = (
+                    ffmpeg
+                    .input(video_path, ss=start, to=end)
+                    .output(output_path, **settings.output_options())
+                    .overwrite_output()
+                )
+                await self.runner.run(stream, limit=False)
+            return 'encode'
+        
+        first_key, last_key = inner[0], inner[-1]
+        async with self.workspaces.workspace('smartcut') as workspace:
+            work_dir = workspace.path
+            encode_kwargs = {
+                'c:v': encoder,
+                'pix_fmt': video.pix_fmt or 'yuv420p',
+                'crf': 18,
+                'an': None
+            }
+            # MPEG-TS parts carry their parameter sets in-band, so the
+            # re-encoded and copied parts concatenate cleanly
+            parts = []
+            if first_key - start > KEYFRAME_TOLERANCE:
+                parts.append((start, first_key, encode_kwargs))
+            parts.append((first_key, last_key, {'c:v': 'copy', 'an': None}))
+            if end - last_key > KEYFRAME_TOLERANCE:
+                parts.append((last_key, end, encode_kwargs))
+            
+            part_files = []
+            for i, (part_start, part_end, kwargs) in enumerate(parts):
+                part_file = os.path.join(work_dir, f"part_{i}.ts")
+                length = part_end - part_start
+                if kwargs['c:v'] == 'copy':
+                    # -t lets reordered B-frame packets spill past the end, the
+                    # segment muxer cuts exactly on the closing keyframe instead
+                    stream = (
+                        ffmpeg
+                        .input(video_path, ss=part_start)
+                        .output(os.path.join(work_dir, f"part_{i}_%d.ts"), **kwargs, **{
+                            't': length + 1,
+                            'f': 'segment',
+                            'segment_format': 'mpegts',
+                            'segment_times': _segment_times([length])
+                        })
+                        .overwrite_output()
+                    )
+                    await self.runner.run(stream)
+                    os.rename(os.path.join(work_dir, f"part_{i}_0.ts"), part_file)
+                else:
+                    async with self.scheduler.encode(encoder, 'fast') as settings:
+                        stream = (
+                            ffmpeg
+                            .input(video_path, ss=part_start)
+                            .output(part_file, t=length, f='mpegts', **dict(kwargs, **settings.output_options()))
+                            .overwrite_output()
+                        )
+                        await self.runner.run(stream, limit=False)
+                part_files.append(part_file)
+            
+            concat_file = os.path.join(work_dir, "concat.txt")
             with open(concat_file, 'w') as f:
-                for path in video_paths:
+                for path in part_files:
                     f.write(f"file '{os.path.abspath(path)}'\n")
             
-            (
+            # Audio packets are all sync points, so it can be copied exactly
+            joined = ffmpeg.input(concat_file, format='concat', safe=0)
+            source = ffmpeg.input(video_path, ss=start, to=end)
+            stream = (
                 ffmpeg
-                .input(concat_file, format='concat', safe=0)
-                .output(output_path, c='copy')
+                .output(joined['v:0'], source['a?'], output_path, c='copy')
                 .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
             )
+            await self.runner.run(stream)
+            return 'smart' if len(parts) > 1 else 'copy'
+    
+    async def merge_videos(self, video_paths, output_path):
+        """Merge multiple videos
+
+        Inputs whose codec, resolution, frame rate, timebase and audio
+        layout match the merge target are stream-copied as they are; only
+        the others are re-encoded to match, in parallel, before the concat.
+        """
+        try:
+            infos = await asyncio.gather(*(self.media.get(path) for path in video_paths))
+            target, mismatched = plan_merge(infos)
+            
+            async with self.workspaces.workspace('merge') as workspace:
+                parts = list(video_paths)
+                normalized = await asyncio.gather(*(
+                    self._normalize_for_merge(video_paths[i], infos[i], target, workspace.file(f"normalized_{i}.mp4"))
+                    for i in mismatched
+                ))
+                for i, path in zip(mismatched, normalized):
+                    parts[i] = path
+                
+                # Create concat file
+                concat_file = workspace.file("concat.txt")
+                with open(concat_file, 'w') as f:
+                    for path in parts:
+                        f.write(f"file '{os.path.abspath(path)}'\n")
+                
+                stream = (
+                    ffmpeg
+                    .input(concat_file, format='concat', safe=0)
+                    .output(output_path, c='copy')
+                    .overwrite_output()
+                )
+                await self.runner.run(stream)
             return True
         except Exception as e:
-            print(f"Error merging videos: {e}")
+            record_failure('merge_videos', "Error merging videos", e)
             return False
     
+    async def _normalize_for_merge(self, video_path, info, target, output_path):
+        """Re-encode one merge input to the target's stream parameters"""
+        source = ffmpeg.input(video_path)
+        video = (
+            source['v:0']
+            .filter('scale', target.width, target.height, force_original_aspect_ratio='decrease')
+            .filter('pad', target.width, target.height, '(ow-iw)/2', '(oh-ih)/2')
+            .filter('setsar', 1)
+            .filter('fps', fps=target.fps)
+        )
+        streams = [video]
+        kwargs = {'pix_fmt': target.pix_fmt, 'crf': 18}
+        if ENCODER_PROFILES.get(target.profile):
+            kwargs['profile:v'] = ENCODER_PROFILES[target.profile]
+        if target.time_base and '/' in target.time_base:
+            kwargs['video_track_timescale'] = target.time_base.split('/')[1]
+        
+        if target.audio_codec:
+            if info.audio:
+                streams.append(source['a:0'])
+            else:
+                # Concat needs the same streams in every part, so pad with silence
+                silence = ffmpeg.input(
+                    f"anullsrc=r={target.sample_rate}:cl={'mono' if target.channels == 1 else 'stereo'}",
+                    f='lavfi'
+                )
+                streams.append(silence['a'])
+                kwargs['shortest'] = None
+            kwargs.update({
+                'c:a': AUDIO_ENCODERS[target.audio_codec],
+                'ar': target.sample_rate,
+                'ac': target.channels
+            })
+        
+        async with self.scheduler.encode(SMART_CUT_ENCODERS[target.codec], 'fast') as settings:
+            stream = ffmpeg.output(*streams, output_path, **settings.output_options(), **kwargs).overwrite_output()
+            await self.runner.run(stream, limit=False)
+        return output_path
+    
     async def split_video_by_time(self, video_path, output_dir, segment_duration):
-        """Split video into segments by time duration"""
+        """Split video into segments by time duration
+
+        Cut points are snapped to the nearest keyframe so stream copy can
+        cut exactly there instead of drifting to the next keyframe.
+        """
         try:
-            output_pattern = os.path.join(output_dir, "segment_%03d.mp4")
+            info = await self.media.get(video_path)
+            keyframes = await self.media.keyframes(video_path) if info.video else []
+            cut_points = _keyframe_cut_points(info.duration, float(segment_duration), keyframes)
+            return await self._segment(video_path, output_dir, cut_points, segment_duration)
+        except Exception as e:
+            record_failure('split_video_by_time', "Error splitting video", e)
+            return []
+    
+    async def split_video_by_size(self, video_path, output_dir, max_bytes=UPLOAD_LIMIT):
+        """Split video into stream-copied parts of at most max_bytes each
+
+        Cut points come from one pass over the packet sizes, placed on the
+        last keyframe before each part would outgrow the limit.
+        """
+        try:
+            info = await self.media.get(video_path)
+            if (info.size or os.path.getsize(video_path)) <= max_bytes:
+                return await self._segment(video_path, output_dir, [])
+            packets = await self.media.packets(video_path)
+            cut_points = _size_cut_points(packets, _sync_points(packets, info), max_bytes)
+            return await self._segment(video_path, output_dir, cut_points)
+        except Exception as e:
+            record_failure('split_video_by_size', "Error splitting video by size", e)
+            return []
+    
+    async def split_video_into_parts(self, video_path, output_dir, parts, max_bytes=UPLOAD_LIMIT):
+        """Split video into `parts` parts of about equal length
+
+        When an equal-length part would be over max_bytes, more parts are
+        used until each one fits.
+        """
+        try:
+            info = await self.media.get(video_path)
+            parts = max(1, int(parts))
+            packets = await self.media.packets(video_path)
+            keyframes = _sync_points(packets, info)
+            
+            total = sum(p[1] for p in packets)
+            parts = max(parts, -(-total // int(max_bytes * (1 - SIZE_SPLIT_MARGIN))))
+            while True:
+                cut_points = _keyframe_cut_points(info.duration, info.duration / parts, keyframes)
+                sizes = _part_sizes(packets, cut_points)
+                if max(sizes) <= max_bytes * (1 - SIZE_SPLIT_MARGIN) or parts >= len(keyframes):
+                    break
+                parts += 1
+            return await self._segment(video_path, output_dir, cut_points)
+        except Exception as e:
+            record_failure('split_video_into_parts', "Error splitting video into parts", e)
+            return []
+    
+    async def _segment(self, video_path, output_dir, cut_points, segment_duration=None):
+        """Stream-copy video_path into segments at cut_points"""
+        # A per-call prefix keeps concurrent splits into one directory apart
+        prefix = f"segment_{uuid.uuid4().hex[:8]}"
+        output_pattern = os.path.join(output_dir, f"{prefix}_%03d.mp4")
+        
+        segment_options = {
+            'c': 'copy',
+            'f': 'segment',
+            'reset_timestamps': '1'
+        }
+        if cut_points:
+            segment_options['segment_times'] = _segment_times(cut_points)
+        elif segment_duration:
+            segment_options['segment_time'] = segment_duration
+        else:
+            # One part: a far-away cut keeps everything in the first segment
+            segment_options['segment_time'] = 10 ** 9
+        
+        async with self.workspaces.workspace('split') as workspace:
+            # ffmpeg lists exactly the segments it wrote
+            segment_list = workspace.file("segments.txt")
+            segment_options['segment_list'] = segment_list
+            segment_options['segment_list_type'] = 'flat'
             
-            (
+            stream = (
                 ffmpeg
                 .input(video_path)
-                .output(output_pattern, **{
-                    'c': 'copy',
-                    'f': 'segment',
-                    'segment_time': segment_duration,
-                    'reset_timestamps': '1'
-                })
+                .output(output_pattern, **segment_options)
                 .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
             )
+            await self.runner.run(stream)
             
             # Get list of created segments
-            segments = sorted([f for f in os.listdir(output_dir) if f.startswith('segment_')])
-            return [os.path.join(output_dir, seg) for seg in segments]
-        except Exception as e:
-            print(f"Error splitting video: {e}")
-            return []
+            with open(segment_list) as f:
+                segments = [line.strip() for line in f if line.strip()]
+        return [os.path.join(output_dir, seg) for seg in segments]
     
-    async def optimize_video(self, video_path, output_path, preset='balanced'):
-        """Optimize video for smaller size"""
+    async def optimize_video(self, video_path, output_path, preset='balanced', parallel=True):
+        """Optimize video for smaller size
+
+        parallel: let long videos be encoded in keyframe-aligned chunks by
+                  several ffmpeg processes at once when cores are free
+        """
         presets = {
             'high': {'crf': 18, 'preset': 'slow'},
             'balanced': {'crf': 23, 'preset': 'medium'},
@@ -125,107 +723,251 @@ class VideoProcessor:
         config = presets.get(preset, presets['balanced'])
         
         try:
-            (
-                ffmpeg
-                .input(video_path)
-                .output(output_path, **{
-                    'c:v': 'libx264',
-                    'crf': config['crf'],
-                    'preset': config['preset'],
-                    'c:a': 'aac',
-                    'b:a': '128k'
-                })
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
+            info = await self.media.get(video_path) if parallel else None
+            # Chunks are planned from the duration; without one, encode in one go
+            chunkable = (
+                info is not None and info.video is not None and info.duration is not None
+                and info.duration >= PARALLEL_ENCODE_MIN_DURATION
             )
-            return True
-        except ffmpeg.Error as e:
-            print(f"Error optimizing video: {e}")
-            return False
-    
-    async def add_subtitles(self, video_path, subtitle_path, output_path, burn=True):
-        """Add subtitles to video"""
-        try:
-            if burn:
-                # Burn subtitles into video
-                (
+            # The scheduler may trade the preset for speed when encodes queue up
+            async with self.scheduler.encode('libx264', config['preset']) as settings:
+                workers = settings.threads // CHUNK_ENCODE_THREADS
+                if chunkable and workers > 1:
+                    await self._encode_in_chunks(video_path, output_path, info, settings, workers, {
+                        'crf': config['crf']
+                    })
+                    return True
+                
+                stream = (
                     ffmpeg
                     .input(video_path)
-                    .output(output_path, vf=f"subtitles={subtitle_path}")
+                    .output(output_path, **settings.output_options(), **{
+                        'crf': config['crf'],
+                        'c:a': 'aac',
+                        'b:a': '128k'
+                    })
                     .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
                 )
-            else:
-                # Soft subtitles
-                (
+                await self.runner.run(stream, limit=False)
+            return True
+        except Exception as e:
+            record_failure('optimize_video', "Error optimizing video", e)
+            return False
+    
+    async def _encode_in_chunks(self, video_path, output_path, info, settings, workers, video_kwargs):
+        """Encode the video stream as keyframe-aligned chunks in parallel
+
+        The chunks are cut by the segment muxer like split_video_by_time,
+        encoded by up to `workers` ffmpeg processes with the scheduler's
+        thread share divided between them, and joined with the concat
+        demuxer like merge_videos. Audio is encoded once alongside.
+        """
+        keyframes = await self.media.keyframes(video_path)
+        # A few chunks per worker keeps them all busy until the end
+        chunk_length = max(PARALLEL_CHUNK_MIN_SECONDS, info.duration / (workers * 3))
+        cut_points = _keyframe_cut_points(info.duration, chunk_length, keyframes)
+        
+        async with self.workspaces.workspace('chunks') as workspace:
+            segment_list = workspace.file("chunks.txt")
+            split = (
+                ffmpeg
+                .input(video_path)
+                .output(workspace.file("chunk_%04d.mkv"), **{
+                    'map': '0:v:0',
+                    'c': 'copy',
+                    'f': 'segment',
+                    'segment_format': 'matroska',
+                    'segment_times': _segment_times(cut_points) or str(info.duration),
+                    'reset_timestamps': '1',
+                    'segment_list': segment_list,
+                    'segment_list_type': 'flat'
+                })
+                .overwrite_output()
+            )
+            await self.runner.run(split, limit=False)
+            with open(segment_list) as f:
+                chunks = [workspace.file(line.strip()) for line in f if line.strip()]
+            
+            chunk_options = dict(settings.with_threads(CHUNK_ENCODE_THREADS).output_options(), **video_kwargs)
+            pool = asyncio.Semaphore(workers)
+            job = current_job.get()
+            
+            async def encode_chunk(index, chunk):
+                async with pool:
+                    if job is not None:
+                        # Runs in its own task, so this only affects this chunk
+                        current_job.set(job.part(index))
+                    encoded = workspace.file(f"encoded_{index:04d}.mkv")
+                    stream = ffmpeg.input(chunk).output(encoded, an=None, **chunk_options).overwrite_output()
+                    await self.runner.run(stream, limit=False)
+                    return encoded
+            
+            async def encode_audio():
+                if info.audio is None:
+                    return None
+                if job is not None:
+                    # Cancelled with the job; its seconds are already counted by the chunks
+                    current_job.set(job.part('audio', counted=False))
+                audio = workspace.file("audio.m4a")
+                stream = (
                     ffmpeg
                     .input(video_path)
-                    .output(output_path, c='copy')
+                    .output(audio, map='0:a:0', vn=None, **{'c:a': 'aac', 'b:a': '128k'})
                     .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
                 )
+                await self.runner.run(stream, limit=False)
+                return audio
+            
+            tasks = [asyncio.ensure_future(encode_chunk(i, c)) for i, c in enumerate(chunks)]
+            tasks.append(asyncio.ensure_future(encode_audio()))
+            try:
+                *encoded, audio = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            
+            concat_file = workspace.file("concat.txt")
+            with open(concat_file, 'w') as f:
+                for path in encoded:
+                    f.write(f"file '{os.path.abspath(path)}'\n")
+            
+            joined = ffmpeg.input(concat_file, format='concat', safe=0)
+            streams = [joined['v:0']]
+            if audio:
+                streams.append(ffmpeg.input(audio)['a:0'])
+            stream = ffmpeg.output(*streams, output_path, c='copy').overwrite_output()
+            await self.runner.run(stream, limit=False)
+    
+    async def add_subtitles(self, video_path, subtitle_path, output_path, burn=True):
+        """Add subtitles to video
+
+        subtitle_path: a subtitle file, or a list of files or SubtitleTracks;
+                       burn-in uses the first one
+        burn: draw the subtitles into the picture instead of muxing them
+              as selectable tracks
+        """
+        paths = subtitle_path if isinstance(subtitle_path, (list, tuple)) else [subtitle_path]
+        try:
+            async with self.workspaces.workspace('subtitles') as workspace:
+                tracks = [
+                    p if isinstance(p, SubtitleTrack) else prepare_track(p, workspace.path)
+                    for p in paths
+                ]
+                if burn:
+                    await self._burn_subtitles(video_path, tracks[0], output_path)
+                else:
+                    await self._mux_subtitles(video_path, tracks, output_path)
             return True
         except Exception as e:
-            print(f"Error adding subtitles: {e}")
+            record_failure('add_subtitles', "Error adding subtitles", e)
             return False
     
-    async def take_screenshots(self, video_path, output_dir, times=None, interval=None):
+    async def _mux_subtitles(self, video_path, tracks, output_path):
+        """Add tracks as selectable subtitle streams, copying everything else"""
+        info = await self.media.get(video_path)
+        source = ffmpeg.input(video_path)
+        streams = [source['v?'], source['a?']]
+        codecs = []
+        # Existing subtitle streams are kept when the output container can hold them
+        for stream in info.subtitle_streams:
+            codec = _subtitle_codec(stream.codec_name, output_path)
+            if codec:
+                streams.append(source[str(stream.index)])
+                codecs.append(codec)
+        
+        options = {'c': 'copy'}
+        # Output index of the first subtitle stream, after every video and audio stream
+        offset = sum(1 for stream in info.streams if stream.codec_type in ('video', 'audio'))
+        first = len(codecs)
+        for position, track in enumerate(tracks):
+            index = first + position
+            streams.append(ffmpeg.input(track.path)['s:0'])
+            codecs.append(_subtitle_codec(track.format, output_path))
+            if track.language:
+                options[f'metadata:s:s:{index}'] = f'language={track.language}'
+            if track.title:
+                # A second spelling of the same stream, as options are keyed by name
+                options[f'metadata:s:{offset + index}'] = f'title={track.title}'
+            # Players show the first new track unless the viewer picks another
+            options[f'disposition:s:{index}'] = 'default' if position == 0 else '0'
+        for index, codec in enumerate(codecs):
+            options[f'c:s:{index}'] = codec
+        if output_path.lower().endswith(('.mp4', '.m4v', '.mov')):
+            options['movflags'] = '+faststart'
+        
+        stream = ffmpeg.output(*streams, output_path, **options).overwrite_output()
+        await self.runner.run(stream)
+    
+    async def _burn_subtitles(self, video_path, track, output_path):
+        """Overlay pre-rendered subtitles in one encode, copying the audio"""
+        info = await self.media.get(video_path)
+        if info.video is None:
+            raise ValueError("No video stream to burn subtitles into")
+        width, height = info.video.width, info.video.height
+        rotation = info.video.rotation
+        if rotation in (90, 270):
+            # ffmpeg turns the picture upright before the overlay, so the
+            # canvas takes the displayed shape, not the coded one
+            width, height = height, width
+        
+        async def render(path):
+            # The subtitles alone on a transparent canvas as long as the last cue
+            canvas = ffmpeg.input(
+                f"color=c=black@0.0:s={width}x{height}:r={OVERLAY_FPS}:d={max(track.end, 1):.3f},format=rgba",
+                f='lavfi'
+            )
+            stream = (
+                canvas
+                .filter('subtitles', filename=track.path, alpha=1)
+                .output(path, vcodec='qtrle', f='mov')
+                .overwrite_output()
+            )
+            await self.runner.run(stream)
+        
+        overlay = await overlay_cache.get_or_render(overlay_cache.key(track, width, height, rotation), render)
+        
+        async with self.scheduler.encode('libx264', 'medium') as settings:
+            source = ffmpeg.input(video_path)
+            # eof_action=pass keeps the video going once the subtitles run out
+            video = ffmpeg.overlay(source['v:0'], ffmpeg.input(overlay)['v:0'], eof_action='pass')
+            stream = (
+                ffmpeg
+                .output(video, source['a?'], output_path, **settings.output_options(), **{
+                    'c:a': 'copy',
+                    'pix_fmt': 'yuv420p'
+                })
+                .overwrite_output()
+            )
+            await self.runner.run(stream, limit=False)
+    
+    async def take_screenshots(self, video_path, output_dir, times=None, interval=None, contact_sheet=None):
         """Take screenshots at specific times or intervals"""
         try:
-            if times:
-                screenshots = []
-                for i, time in enumerate(times):
-                    output_file = os.path.join(output_dir, f"screenshot_{i+1}.jpg")
-                    (
-                        ffmpeg
-                        .input(video_path, ss=time)
-                        .output(output_file, vframes=1)
-                        .overwrite_output()
-                        .run(capture_stdout=True, capture_stderr=True)
-                    )
-                    screenshots.append(output_file)
-                return screenshots
-            
-            elif interval:
-                # Get video duration
-                probe = ffmpeg.probe(video_path)
-                duration = float(probe['streams'][0]['duration'])
-                
-                screenshots = []
-                count = int(duration / interval)
-                
-                for i in range(count):
-                    time = i * interval
-                    output_file = os.path.join(output_dir, f"screenshot_{i+1}.jpg")
-                    (
-                        ffmpeg
-                        .input(video_path, ss=time)
-                        .output(output_file, vframes=1)
-                        .overwrite_output()
-                        .run(capture_stdout=True, capture_stderr=True)
-                    )
-                    screenshots.append(output_file)
-                
-                return screenshots
+            if times or interval:
+                return await self.extract_frames(
+                    video_path, output_dir, times=times, interval=interval,
+                    prefix='screenshot', contact_sheet=contact_sheet
+                )
             
             else:
                 # Single screenshot at middle
-                probe = ffmpeg.probe(video_path)
-                duration = float(probe['streams'][0]['duration'])
-                middle = duration / 2
+                info = await self.media.get(video_path)
+                middle = info.duration / 2
                 
                 output_file = os.path.join(output_dir, "screenshot.jpg")
-                (
+                stream = (
                     ffmpeg
                     .input(video_path, ss=middle)
                     .output(output_file, vframes=1)
                     .overwrite_output()
-                    .run(capture_stdout=True, capture_stderr=True)
                 )
+                await self.runner.run(stream)
                 return [output_file]
                 
         except Exception as e:
-            print(f"Error taking screenshots: {e}")
+            record_failure('take_screenshots', "Error taking screenshots", e)
             return []
 
 # Global instance
@@ -244,11 +986,23 @@ async def merge_videos(*args, **kwargs):
 async def split_video(*args, **kwargs):
     return await video_processor.split_video_by_time(*args, **kwargs)
 
+async def split_video_by_size(*args, **kwargs):
+    return await video_processor.split_video_by_size(*args, **kwargs)
+
+async def split_video_into_parts(*args, **kwargs):
+    return await video_processor.split_video_into_parts(*args, **kwargs)
+
 async def optimize_video(*args, **kwargs):
     return await video_processor.optimize_video(*args, **kwargs)
 
 async def add_subtitles(*args, **kwargs):
     return await video_processor.add_subtitles(*args, **kwargs)
 
+async def smart_thumbnails(*args, **kwargs):
+    return await video_processor.smart_thumbnails(*args, **kwargs)
+
 async def take_screenshots(*args, **kwargs):
     return await video_processor.take_screenshots(*args, **kwargs)
+
+async def extract_frames(*args, **kwargs):
+    return await video_processor.extract_frames(*args, **kwargs)